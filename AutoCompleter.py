@@ -1,18 +1,184 @@
+import re
+import time
+import bisect
+
+# Characters that start a new word in an option, e.g. the underscores in P1234_S017_L002
+WORD_SEPARATORS = "_-. /"
+
+# Seconds the subsequence search may take per keystroke, and the number of options searched between checks
+# of the time (see CompletionIndex.find_subsequence())
+SUBSEQUENCE_TIME_LIMIT = 0.003
+SUBSEQUENCE_BATCH_SIZE = 2500
+
+
+class CompletionIndex(object):
+    """
+    Index of completion options (e.g. all sample names), built once and shared by every prompt that
+    completes from the same options. Matching is case-insensitive and ranked:
+        1. options that start with the text
+        2. options where a later word starts with the text, e.g. "s017" matches P1234_S017_L002
+        3. options that contain the text anywhere
+        4. options that contain the characters of the text in order, e.g. "s17l2" matches P1234_S017_L002
+    1 is a binary search in the sorted options. 2-4 search all options joined into one string, so the scan
+    runs in C (str.find() and re). Every step stops as soon as max_matches options have been found. 2 is skipped
+    if nothing contains the text, and 4 is only tried if nothing contains the text and every character of it
+    occurs in some option. 4 is the slowest (a regex), so it stops after SUBSEQUENCE_TIME_LIMIT and only returns
+    the matches among the options it got through, so typing stays responsive with 100k options.
+    """
+
+    def add(self, option):
+        """
+        Adds a single option, keeping the options sorted.
+        """
+        if not option or option in self.option_set:
+            return
+
+        key = option.lower()
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.options.insert(i, option)
+        self.option_set.add(option)
+
+        # Rebuilt on the next search
+        self.blob = None
+
+    def update(self, options):
+        """
+        Adds all options that aren't in the index yet, e.g. samples added in watch mode.
+        """
+        for option in options:
+            self.add(option)
+
+    def get_blob(self):
+        """
+        Returns all (lower-case) options joined by newlines. The start of every option in it is kept in self.offsets.
+        """
+        if self.blob is None:
+            self.offsets = []
+            position = 0
+            for key in self.keys:
+                self.offsets.append(position)
+                position += len(key) + 1
+            self.blob = "\n".join(self.keys)
+            self.separators = [c for c in WORD_SEPARATORS if c in self.blob]
+            self.characters = set(self.blob)
+        return self.blob
+
+    def find_prefix(self, key, matches, found, limit):
+        """
+        Adds options starting with key to matches.
+        """
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and len(matches) < limit and self.keys[i].startswith(key):
+            found.add(i)
+            matches.append(self.options[i])
+            i += 1
+
+    def find_substring(self, key, matches, found, limit):
+        """
+        Adds options containing key to matches.
+        """
+        blob = self.get_blob()
+        position = blob.find(key)
+        while position != -1 and len(matches) < limit:
+            i = bisect.bisect_right(self.offsets, position) - 1
+            if i not in found:
+                found.add(i)
+                matches.append(self.options[i])
+
+            # Continue after this option
+            position = blob.find(key, self.offsets[i] + len(self.keys[i]) + 1)
+
+    def find_subsequence(self, key, matches, found, limit):
+        """
+        Adds options containing the characters of key in order to matches. Options are searched in batches,
+        and the search stops after SUBSEQUENCE_TIME_LIMIT.
+        """
+        # [^\nc]*c can't cross into the next option and doesn't backtrack
+        pattern = re.compile(re.escape(key[0]) + "".join("[^\\n%s]*%s" % (re.escape(c), re.escape(c)) for c in key[1:]))
+        blob = self.get_blob()
+        deadline = time.time() + SUBSEQUENCE_TIME_LIMIT
+
+        for start in xrange(0, len(self.keys), SUBSEQUENCE_BATCH_SIZE):
+            last = min(start + SUBSEQUENCE_BATCH_SIZE, len(self.keys)) - 1
+            for match in pattern.finditer(blob, self.offsets[start], self.offsets[last] + len(self.keys[last])):
+                if len(matches) >= limit:
+                    return
+
+                i = bisect.bisect_right(self.offsets, match.start()) - 1
+                if i not in found:
+                    found.add(i)
+                    matches.append(self.options[i])
+
+            if time.time() > deadline:
+                return
+
+    def match(self, text, limit=None):
+        """
+        Returns the options matching the text, best matches first (see class docstring).
+        :param text: Text typed so far
+        :param limit: Maximum number of matches, max_matches by default. All options are returned if text is empty
+        """
+        if not text:
+            return list(self.options)
+
+        if limit is None:
+            limit = self.max_matches
+
+        key = text.lower()
+        matches = []
+        found = set()  # Indices of options in matches
+
+        self.find_prefix(key, matches, found, limit)
+
+        # Words are found as separator + text, e.g. "_s017". They're only searched if the text occurs at all
+        blob = self.get_blob()
+        if len(matches) < limit and blob.find(key) != -1:
+            for separator in self.separators:
+                if len(matches) < limit:
+                    self.find_substring(separator + key, matches, found, limit)
+
+            if len(matches) < limit:
+                self.find_substring(key, matches, found, limit)
+
+        if len(matches) == 0 and len(key) > 1 and self.characters.issuperset(key):
+            self.find_subsequence(key, matches, found, limit)
+
+        return matches
+
+    def __len__(self):
+        return len(self.options)
+
+    def __init__(self, options=(), max_matches=200):
+        self.max_matches = max_matches
+        self.option_set = set(o for o in options if o)
+
+        # Sorted by lower-case key, self.keys[i] is self.options[i].lower()
+        decorated = sorted((o.lower(), o) for o in self.option_set)
+        self.keys = [k for k, o in decorated]
+        self.options = [o for k, o in decorated]
+
+        self.blob = None
+        self.offsets = []  # Format: [position of self.keys[i] in self.blob]
+        self.separators = []  # WORD_SEPARATORS that occur in the options
+        self.characters = set()  # Characters that occur in the options
+
+
 class MyCompleter(object):  # Custom completer
 
     def __init__(self, options):
-        self.options = sorted(options)
+        # Reuse an existing index, so large option lists aren't sorted again for every prompt
+        if isinstance(options, CompletionIndex):
+            self.index = options
+        else:
+            self.index = CompletionIndex(options)
 
     def complete(self, text, state):
         if state == 0:  # on first trigger, build possible matches
-            if text:  # cache matches (entries that start with entered text)
-                self.matches = [s for s in self.options if s and s.startswith(text)]
-                #self.matches = [s for s in self.options if text in s]
-            else:  # no text entered, all matches possible
-                self.matches = self.options[:]
+            self.matches = self.index.match(text)
 
         # return match indexed by state
         try:
             return self.matches[state]
         except IndexError:
-            return None
\ No newline at end of file
+            return None
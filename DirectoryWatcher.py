@@ -0,0 +1,155 @@
+import os
+import threading
+import Queue
+from Sample import Sample
+from SampleCache import get_zip_fingerprint
+
+# pyinotify is optional, without it the watcher falls back to polling
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class DirectoryWatcher(object):
+    """
+    Watches the input directory for new or changed sample directories while the browser is running.
+    New samples are parsed in a background thread and queued. The queue is merged into the SampleManager
+    from the main thread (see merge_pending()), so the manager is never modified while a query is running.
+
+    Changes are detected by comparing zip-file fingerprints (see SampleCache.get_zip_fingerprint()). A sample
+    is only parsed once its fingerprint is the same in two scans in a row, so zip-files that are still being
+    written are left alone. If pyinotify is installed, file system events trigger a scan right away;
+    otherwise the directory is polled every `interval` seconds.
+    """
+
+    def get_snapshot(self):
+        """
+        Returns the fingerprints of all sample directories in the parent directory.
+        :return snapshot: Dictionary where keys are sample paths and values are fingerprints
+        """
+        snapshot = {}
+
+        for s in os.listdir(self.parent_dir):
+            sample_path = os.path.join(self.parent_dir, s)
+            if not os.path.isdir(sample_path):
+                continue
+
+            try:
+                snapshot[sample_path] = get_zip_fingerprint(sample_path)
+            except OSError:
+                # Directory or zip-file disappeared while scanning
+                continue
+
+        return snapshot
+
+    def scan(self):
+        """
+        Compares the parent directory with the last scan and parses samples that are new or have changed.
+        """
+        for sample_path, fingerprint in self.get_snapshot().items():
+            # Directories without zip-files (yet) are not samples
+            if len(fingerprint) == 0:
+                continue
+
+            # Unchanged
+            if self.known.get(sample_path) == fingerprint:
+                continue
+
+            # Changed since last scan, wait for the next scan to see if it's still being written
+            if self.pending.get(sample_path) != fingerprint:
+                self.pending[sample_path] = fingerprint
+                continue
+
+            del self.pending[sample_path]
+            self.known[sample_path] = fingerprint
+
+            try:
+                sample = Sample(sample_path, self.parent_dir)
+            except SystemExit:
+                # Sample() has already printed the reason, try again when the directory changes
+                continue
+            except Exception as e:
+                print "Warning: Could not load new sample %s (%s)" % (sample_path, e)
+                continue
+
+            self.queue.put(sample)
+
+    def wait_for_changes(self):
+        """
+        Blocks until file system events arrive (pyinotify) or the poll interval has passed.
+        """
+        if self.notifier is not None:
+            if self.notifier.check_events(timeout=int(self.interval * 1000)):
+                self.notifier.read_events()
+                self.notifier.process_events()
+        else:
+            self.stop_event.wait(self.interval)
+
+    def run(self):
+        """
+        Main loop of the background thread.
+        """
+        while not self.stop_event.is_set():
+            self.wait_for_changes()
+            if self.stop_event.is_set():
+                break
+            self.scan()
+
+    def start(self):
+        """
+        Starts watching in a background thread.
+        """
+        if pyinotify is not None:
+            mask = pyinotify.IN_CREATE | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO
+            watch_manager = pyinotify.WatchManager()
+            watch_manager.add_watch(self.parent_dir, mask, rec=True, auto_add=True)
+            self.notifier = pyinotify.Notifier(watch_manager)
+
+        self.thread = threading.Thread(target=self.run, name="DirectoryWatcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(self.interval + 1)
+        if self.notifier is not None:
+            self.notifier.stop()
+
+    def merge_pending(self, sample_manager):
+        """
+        Adds all samples parsed since the last call to the sample manager. Must be called from the thread
+        that runs the queries.
+        :return num_merged: Number of samples that were added or replaced
+        """
+        num_merged = 0
+
+        while True:
+            try:
+                sample = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+
+            sample_manager.add_sample(sample)
+            num_merged += 1
+
+        if num_merged > 0:
+            print "(Watch mode: loaded %d new or updated sample(s))" % num_merged
+
+        return num_merged
+
+    def __init__(self, parent_dir, interval=10):
+        self.parent_dir = os.path.abspath(parent_dir)
+        self.interval = interval
+        self.queue = Queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.notifier = None
+        self.pending = {}  # Format: {sample_path: fingerprint}, changes seen in one scan only
+
+        # Everything that's in the directory now is loaded by setup_samples()
+        self.known = self.get_snapshot()  # Format: {sample_path: fingerprint}
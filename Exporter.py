@@ -0,0 +1,205 @@
+import os
+import shutil
+import sqlite3
+from Sample import BASIC_STATS, get_read_order
+
+# pyarrow is optional, samples can always be exported to SQLite
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Columns of the exported tables and their (SQLite) types. Format: [(table, [(column, type)])]
+TABLES = [
+    ("statuses", [("sample", "TEXT"), ("read", "INTEGER"), ("module", "TEXT"), ("status", "TEXT")]),
+    ("basic_stats", [("sample", "TEXT"), ("read", "INTEGER"), ("filename", "TEXT"), ("file_type", "TEXT"), ("encoding", "TEXT"),
+                     ("total_sequences", "INTEGER"), ("poor_quality", "INTEGER"), ("sequence_length", "TEXT"), ("gc", "REAL"), ("lanes", "INTEGER")]),
+    ("module_values", [("sample", "TEXT"), ("read", "INTEGER"), ("module", "TEXT"), ("label", "TEXT"), ("column", "TEXT"), ("value", "REAL")]),
+]
+
+# Supported export formats
+FORMATS = ["parquet", "sqlite"]
+
+
+def get_default_format():
+    return "parquet" if pyarrow is not None else "sqlite"
+
+
+def to_number(value, cast):
+    """
+    Converts a Basic Statistics value to a number, None if it's missing or not a number (e.g. a length range).
+    """
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SqliteWriter(object):
+    """
+    Writes exported tables to a single SQLite database file. Any existing tables of the same names are replaced,
+    unless replace is False.
+    """
+
+    def write(self, table, rows):
+        self.connection.executemany(self.inserts[table], rows)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __init__(self, path, tables, replace=True, check_same_thread=True):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=check_same_thread)
+        self.connection.text_factory = str
+        self.inserts = {}  # Format: {table: INSERT statement}
+
+        # Do stuff
+        for table, columns in tables:
+            if replace:
+                self.connection.execute('DROP TABLE IF EXISTS %s' % table)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (table, ", ".join('"%s" %s' % c for c in columns)))
+            self.inserts[table] = 'INSERT INTO %s VALUES (%s)' % (table, ", ".join("?" * len(columns)))
+        self.connection.commit()
+
+
+class ParquetWriter(object):
+    """
+    Writes every exported table to its own Parquet file (TABLE.parquet) in a directory, one row group per batch.
+    Needs pyarrow.
+    """
+
+    # Arrow types of the SQLite types in TABLES
+    arrow_types = {"TEXT": "string", "INTEGER": "int64", "REAL": "float64"}
+
+    def write(self, table, rows):
+        columns = self.columns[table]
+        arrays = [pyarrow.array([row[i] for row in rows], type=self.schemas[table].types[i]) for i in range(len(columns))]
+        batch = pyarrow.Table.from_arrays(arrays, schema=self.schemas[table])
+
+        if table not in self.writers:
+            self.writers[table] = pyarrow.parquet.ParquetWriter(os.path.join(self.path, table + ".parquet"), self.schemas[table])
+        self.writers[table].write_table(batch)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def __init__(self, path, tables):
+        self.path = path
+        self.columns = {}  # Format: {table: [column]}
+        self.schemas = {}  # Format: {table: pyarrow.Schema}
+        self.writers = {}  # Format: {table: pyarrow.parquet.ParquetWriter}, created with the first batch
+
+        # Do stuff
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        for table, columns in tables:
+            self.columns[table] = [name for name, column_type in columns]
+            fields = [pyarrow.field(name, getattr(pyarrow, self.arrow_types[column_type])()) for name, column_type in columns]
+            self.schemas[table] = pyarrow.schema(fields)
+
+            # Remove tables of an earlier export, tables without rows are not written
+            table_path = os.path.join(path, table + ".parquet")
+            if os.path.isdir(table_path):
+                shutil.rmtree(table_path)
+            elif os.path.exists(table_path):
+                os.remove(table_path)
+
+
+class Exporter(object):
+    """
+    Exports parsed samples as long-format tables: the status of every module (statuses), the Basic Statistics
+    of every read (basic_stats) and optionally every numeric value of the module tables (module_values).
+    Samples are written in batches, so only one batch of rows is kept in memory however many samples there are.
+    """
+
+    def get_tables(self):
+        return [(table, columns) for table, columns in TABLES if table != "module_values" or self.include_modules]
+
+    def get_status_rows(self, sample):
+        return [(sample.name, read_number, module, status) for read_number, module, status in sample.get_statuses()]
+
+    def get_basic_stats_rows(self, sample):
+        rows = []
+        for read_number, values in zip(sample.read_numbers, sample.basic_stats):
+            if values is None:
+                continue
+
+            stats = dict(zip(BASIC_STATS, values))
+            rows.append((sample.name, read_number, stats["Filename"], stats["File type"], stats["Encoding"],
+                         to_number(stats["Total Sequences"], int), to_number(stats["Sequences flagged as poor quality"], int),
+                         stats["Sequence length"], to_number(stats["%GC"], float), to_number(stats["Lanes"], int)))
+        return rows
+
+    def get_module_value_rows(self, sample):
+        """
+        Returns every numeric value in the module tables of a sample, e.g. the Mean quality at every base position.
+        """
+        rows = []
+        for read_number, module, status in sample.get_statuses():
+            table = sample.get_module_table(read_number, module)
+            if table is None:
+                continue
+
+            labels = table.get_labels()
+            for column in table.get_numeric_columns():
+                if column == table.columns[0]:
+                    continue  # Row labels, see MetricStore.get_metric_columns()
+                for label, value in zip(labels, table[column].tolist()):
+                    if value == value:  # Leave out NaN
+                        rows.append((sample.name, read_number, module, label, column, value))
+        return rows
+
+    def export(self, samples):
+        """
+        Writes the tables of all samples and closes the writer.
+        :return num_rows: Number of rows written. Format: {table: rows}
+        """
+        num_rows = self.write_samples(samples)
+        self.writer.close()
+        return num_rows
+
+    def write_samples(self, samples):
+        """
+        Writes the rows of some samples, in batches.
+        :return num_rows: Number of rows written. Format: {table: rows}
+        """
+        num_rows = dict((table, 0) for table, columns in self.get_tables())
+        batch = dict((table, []) for table in num_rows)
+
+        # Samples in a tar archive are read in its order (see get_read_order())
+        samples = [samples[row] for row in get_read_order(samples)]
+        for i, sample in enumerate(samples):
+            sample.require(sample.LOAD_ALL)
+            batch["statuses"] += self.get_status_rows(sample)
+            batch["basic_stats"] += self.get_basic_stats_rows(sample)
+            if self.include_modules:
+                batch["module_values"] += self.get_module_value_rows(sample)
+
+            # Write every batch_size samples, or sooner if a table has grown large (module values)
+            last = i == len(samples) - 1
+            for table, rows in batch.items():
+                if len(rows) > 0 and (last or (i + 1) % self.batch_size == 0 or len(rows) >= self.max_rows):
+                    self.writer.write(table, rows)
+                    num_rows[table] += len(rows)
+                    batch[table] = []
+
+        return num_rows
+
+    def __init__(self, path, export_format=None, include_modules=False, batch_size=1000, writer=None):
+        self.path = path
+        self.export_format = export_format or get_default_format()
+        self.include_modules = include_modules  # Also export module_values (needs numpy)
+        self.batch_size = batch_size  # Samples per batch
+        self.max_rows = 100000  # Rows of a table that are written at once, even if the batch isn't complete
+
+        # Do stuff, unless the tables are written by a given writer (e.g. an SqliteWriter that's kept open)
+        if writer is not None:
+            self.writer = writer
+        elif self.export_format == "parquet":
+            self.writer = ParquetWriter(path, self.get_tables())
+        else:
+            self.writer = SqliteWriter(path, self.get_tables())
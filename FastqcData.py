@@ -0,0 +1,228 @@
+# numpy is only needed to decode module tables, everything else works without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Numeric columns are stored as float32, unless they hold values float32 can't represent exactly (e.g. read counts)
+FLOAT32_MAX_EXACT = 2 ** 24
+
+
+def index_sections(content):
+    """
+    Finds every module (>>Module name<TAB>status ... >>END_MODULE) in the content of a fastqc_data.txt file,
+    in a single pass and without splitting the content into lines.
+    :param content: Content of fastqc_data.txt as a string
+    :return sections: Dictionary {module_name: (status, start, end)}, where content[start:end] is the module's
+                      table, without the >>Module and >>END_MODULE lines
+    """
+    sections = {}
+
+    start = content.find(">>")
+    while start != -1:
+        line_end = content.find("\n", start)
+        if line_end == -1:
+            break
+
+        # Table ends where the >>END_MODULE line starts
+        header = content[start + 2:line_end].rstrip("\r")
+        end_marker = content.find("\n>>END_MODULE", line_end)
+        end = len(content) if end_marker == -1 else end_marker + 1
+
+        if header != "END_MODULE":
+            name, _, status = header.partition("\t")
+            sections[name] = (status.strip().upper(), line_end + 1, end)
+
+        if end_marker == -1:
+            break
+
+        # Next module header after the >>END_MODULE line
+        start = content.find("\n>>", end)
+        if start != -1:
+            start += 1
+
+    return sections
+
+
+def parse_table(text):
+    """
+    Decodes the table of a single module (see index_sections()) into typed columns.
+    :param text: The module's table, starting with the #-prefixed header line(s)
+    :return table: ModuleTable, or None if numpy is not available
+    """
+    if np is None:
+        print "ERROR: Could not import module 'numpy', which is needed to decode module tables."
+        return None
+
+    header = []
+    comments = {}  # Extra #-lines before the header, e.g. #Total Deduplicated Percentage
+    rows = []
+
+    for line in text.splitlines():
+        if not line:
+            continue
+
+        if line.startswith("#"):
+            # The last #-line before the data is the header, earlier ones are key/value comments
+            if header:
+                comments[header[0]] = header[1] if len(header) > 1 else ""
+            header = line[1:].split("\t")
+            continue
+
+        rows.append(line.split("\t"))
+
+    # Transpose rows into columns, pad short rows
+    columns = []
+    for i in range(len(header)):
+        columns.append([row[i] if i < len(row) else "" for row in rows])
+
+    data = {}
+    for name, values in zip(header, columns):
+        data[name] = to_array(values)
+
+    # Row labels as written in the file, e.g. base positions ("1", "2", ..., "10-14")
+    labels = [row[0] for row in rows]
+
+    return ModuleTable(header, data, labels, comments)
+
+
+def to_array(values):
+    """
+    Converts a column of strings to a float32 (or float64 for large values) array,
+    or a string array if any of the values isn't a number (e.g. base ranges like "10-14").
+    """
+    try:
+        array = np.array(values, dtype=np.float64)
+    except ValueError:
+        return np.array(values)
+
+    return shrink_array(array)
+
+
+def shrink_array(array):
+    """
+    Converts a float64 array to float32, unless it holds values float32 can't represent exactly.
+    """
+    finite = array[~np.isnan(array)]
+    if len(finite) == 0 or np.max(np.abs(finite)) < FLOAT32_MAX_EXACT:
+        return array.astype(np.float32)
+
+    return array
+
+
+def get_row_keys(labels):
+    """
+    Returns a key for every row of a table, used to match rows between tables. The key is the label,
+    plus how many times the label has been seen before, since some modules (e.g. Per tile sequence
+    quality) repeat labels.
+    """
+    seen = {}
+    keys = []
+    for label in labels:
+        keys.append((label, seen.get(label, 0)))
+        seen[label] = seen.get(label, 0) + 1
+    return keys
+
+
+def merge_tables(tables, weights):
+    """
+    Merges the tables of the same module from several lanes into one table. Rows are matched by label.
+    "Count" columns (histograms) are added up, every other numeric column is averaged, weighted by the
+    number of sequences in each lane. Lanes that don't have a row are left out of its average.
+    Text columns are taken from the first lane that has the row.
+    :param tables: List of ModuleTable, one per lane
+    :param weights: Number of sequences in each lane
+    :return table: Merged ModuleTable
+    """
+    # Union of rows and columns, in order of first appearance
+    keys = []
+    labels = []
+    row_index = {}
+    table_rows = []
+    for table in tables:
+        rows = []
+        for key in get_row_keys(table.get_labels()):
+            if key not in row_index:
+                row_index[key] = len(keys)
+                keys.append(key)
+                labels.append(key[0])
+            rows.append(row_index[key])
+        table_rows.append(rows)
+
+    columns = []
+    for table in tables:
+        columns += [c for c in table.columns if c not in columns]
+
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.sum() == 0:
+        weights = np.ones(len(tables))
+
+    data = {}
+    for column in columns:
+        numeric = all(column not in t.data or t[column].dtype.kind == "f" for t in tables)
+
+        if not numeric:
+            values = [""] * len(keys)
+            for table, rows in zip(tables, table_rows):
+                if column not in table.data:
+                    continue
+                for row, value in zip(rows, table[column]):
+                    if values[row] == "":
+                        values[row] = value
+            data[column] = np.array(values)
+            continue
+
+        total = np.zeros(len(keys))
+        weight_sum = np.zeros(len(keys))
+        for table, rows, weight in zip(tables, table_rows, weights):
+            if column not in table.data:
+                continue
+            values = table[column].astype(np.float64)
+            if column == "Count":
+                total[rows] += values
+                weight_sum[rows] += 1
+            else:
+                total[rows] += values * weight
+                weight_sum[rows] += weight
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if column != "Count":
+                total = total / weight_sum
+        total[weight_sum == 0] = np.nan
+        data[column] = shrink_array(total)
+
+    return ModuleTable(columns, data, labels, dict(tables[0].comments))
+
+
+class ModuleTable(object):
+    """
+    The decoded table of a single FastQC module. Columns are numpy arrays, indexed by column name,
+    e.g. table["Mean"] for "Per base sequence quality".
+    """
+
+    def get_column(self, name):
+        return self.data[name]
+
+    def get_labels(self):
+        """
+        Returns the first column as it's written in the file, e.g. the base positions ("1", "2", ..., "10-14").
+        """
+        return self.labels
+
+    def get_numeric_columns(self):
+        """
+        Returns the names of all columns that hold numbers.
+        """
+        return [c for c in self.columns if self.data[c].dtype.kind == "f"]
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __init__(self, columns, data, labels, comments):
+        self.columns = columns  # Column names in file order
+        self.data = data  # Format: {column_name: numpy array}
+        self.labels = labels  # First column as strings
+        self.comments = comments  # Format: {key: value}
@@ -0,0 +1,401 @@
+import re
+
+# numpy is optional, filter queries can't be run without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from StatusIndex import STATUS_CODES, STATUS_NAMES
+from Sample import MODULE_NAMES
+
+# Numeric fields of a read file, and the Basic Statistics they're taken from (None: not a Basic Statistic)
+NUMERIC_FIELDS = {
+    "read": None,
+    "total_sequences": "Total Sequences",
+    "reads": "Total Sequences",
+    "poor_quality": "Sequences flagged as poor quality",
+    "sequence_length": "Sequence length",
+    "gc": "%GC",
+}
+
+# Words that start a clause after the filter expression
+CLAUSES = ["sort", "limit", "columns"]
+
+# Numbers (5, -5, 0.5, 5e6), quoted strings, operators and names. A number that runs into a name
+# (e.g. 5x or -1a in a sample name) is part of the name
+TOKEN_PATTERN = re.compile(r"\s*(?:(-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)(?![^\s<>=!~(),'\"])|'([^']*)'|\"([^\"]*)\"|(<=|>=|!=|==|=|<|>|~|\(|\)|,)|([^\s<>=!~(),'\"]+))")
+
+
+def is_module_name(name):
+    """
+    Returns True if name is a FastQC module, as typed in commands (adapter_content) or by its FastQC name.
+    """
+    return name.replace("_", " ").lower() in [m.lower() for m in MODULE_NAMES]
+
+
+class FilterError(Exception):
+    """
+    Raised when a query can't be parsed or run, e.g. because of an unknown field.
+    """
+    pass
+
+
+def tokenize(text):
+    """
+    Splits a query into tokens.
+    :return tokens: Format: [(kind, value)], kind is number, string, operator or name. Numbers are kept as
+                    written, since they can also be (parts of) sample names
+    """
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            raise FilterError("Could not parse query at: %s" % text[position:])
+        position = match.end()
+
+        number, single_quoted, double_quoted, operator, name = match.groups()
+        if number is not None:
+            tokens.append(("number", number))
+        elif single_quoted is not None or double_quoted is not None:
+            tokens.append(("string", single_quoted if single_quoted is not None else double_quoted))
+        elif operator is not None:
+            tokens.append(("operator", "=" if operator == "==" else operator))
+        else:
+            tokens.append(("name", name.lower()))
+    return tokens
+
+
+def to_number(value):
+    """
+    Converts a Basic Statistics value to a float: ranges like "35-151" become their largest value,
+    and values that aren't numbers become NaN.
+    """
+    try:
+        return float(value.split("-")[-1])
+    except (AttributeError, ValueError):
+        return float("nan")
+
+
+class Context(object):
+    """
+    The data a compiled query is evaluated against, as arrays of shape (samples x reads), where row i is
+    the i-th sample in SampleManager.all_samples and column j is read number j + 1.
+    """
+
+    def pad(self, array, fill):
+        """
+        Pads or cuts the read axis of an array to the number of read columns.
+        """
+        if array.shape[1] == self.num_reads:
+            return array
+        padded = np.empty((array.shape[0], self.num_reads) + array.shape[2:], dtype=array.dtype)
+        padded.fill(fill)
+        num_reads = min(array.shape[1], self.num_reads)
+        padded[:, :num_reads] = array[:, :num_reads]
+        return padded
+
+    def get_module_id(self, module):
+        """
+        Finds the column of a module in the status index by its name as typed in commands (adapter_content) or by
+        its FastQC name (Adapter Content).
+        """
+        name = module.replace("_", " ").lower()
+        for module_id, module_name in enumerate(self.module_names):
+            if module_name.lower() == name:
+                return module_id
+        return None
+
+    def get_status(self, module):
+        """
+        Returns the status codes of a module (0 where a read file has no status).
+        """
+        module_id = self.get_module_id(module)
+        if module_id is None:
+            if not is_module_name(module):
+                raise FilterError("Unknown module: %s" % module)
+            return np.zeros((self.num_samples, self.num_reads), dtype=np.int8)
+        return self.codes[:, :, module_id]
+
+    def get_field(self, field):
+        """
+        Returns a numeric field as a float array, NaN where it's missing.
+        """
+        if field not in self.fields:
+            if field == "read":
+                self.fields[field] = np.tile(np.arange(1, self.num_reads + 1, dtype=np.float64), (self.num_samples, 1))
+            elif NUMERIC_FIELDS[field] == "Total Sequences":
+                counts = self.pad(self.sample_manager.get_read_counts().get_counts(), -1).astype(np.float64)
+                counts[counts < 0] = np.nan
+                self.fields[field] = counts
+            else:
+                self.fields[field] = self.pad(self.sample_manager.get_basic_stat_array(NUMERIC_FIELDS[field], to_number), np.nan)
+        return self.fields[field]
+
+    def get_names(self):
+        """
+        Returns the lowercase name of every sample, as an array that can be searched with np.char.
+        """
+        if self.names is None:
+            self.names = np.array([sample.name.lower() for sample in self.sample_manager.all_samples] or [""])[:self.num_samples]
+        return self.names
+
+    def __init__(self, sample_manager):
+        self.sample_manager = sample_manager
+        self.fields = {}  # Format: {field: array}, fields used by the query
+        self.names = None
+
+        # Do stuff
+        sample_manager.load_statuses()
+        status_index = sample_manager.status_index
+        counts = sample_manager.get_read_counts().get_counts()
+        self.num_samples = len(sample_manager.all_samples)
+        self.num_reads = max(status_index.codes.shape[1], counts.shape[1])
+        self.module_names = status_index.module_names
+        self.codes = self.pad(status_index.get_codes(), 0)
+
+        # Read files that exist: they have a status or a number of reads
+        self.exists = (self.codes.max(axis=2) > 0) | (self.pad(counts, -1) >= 0)
+
+
+class FilterQuery(object):
+    """
+    A parsed query over read files, e.g.
+        FAIL in adapter_content and WARN in per_base_sequence_content and total_sequences < 5e6 and read = 2
+        sort total_sequences desc limit 20 columns sample, read, total_sequences
+    The expression is parsed once into nested functions that each compute a boolean array over all samples and
+    reads (see Context), so running a query doesn't loop over samples.
+
+    Conditions:
+        STATUS in MODULE, or STATUS in any      e.g. FAIL in adapter_content
+        MODULE = STATUS, MODULE != STATUS      e.g. adapter_content != PASS
+        FIELD OP NUMBER                        fields: read, total_sequences (reads), poor_quality, sequence_length, gc
+                                               operators: = != < <= > >=
+        sample = NAME, sample ~ TEXT           exact name, or name contains the text (case-insensitive)
+    Conditions are combined with and, or, not and parentheses. After the expression, optionally:
+        sort FIELD [asc|desc], limit N, columns FIELD, FIELD, ...   (FIELD can also be sample or a module name)
+    """
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise FilterError("Unexpected end of query")
+        self.position += 1
+        return token
+
+    def accept(self, kind, value=None):
+        """
+        Consumes the next token if it matches, and returns whether it did.
+        """
+        token_kind, token_value = self.peek()
+        if token_kind == kind and (value is None or token_value == value):
+            self.position += 1
+            return True
+        return False
+
+    def expect_name(self, what):
+        kind, value = self.next()
+        if kind not in ("name", "string", "number"):
+            raise FilterError("Expected %s, got %s" % (what, value))
+        return value
+
+    def parse_or(self):
+        function = self.parse_and()
+        while self.accept("name", "or"):
+            left, right = function, self.parse_and()
+            function = lambda context, left=left, right=right: left(context) | right(context)
+        return function
+
+    def parse_and(self):
+        function = self.parse_not()
+        while self.accept("name", "and"):
+            left, right = function, self.parse_not()
+            function = lambda context, left=left, right=right: left(context) & right(context)
+        return function
+
+    def parse_not(self):
+        if self.accept("name", "not"):
+            inner = self.parse_not()
+            return lambda context: ~inner(context)
+        if self.accept("operator", "("):
+            function = self.parse_or()
+            if not self.accept("operator", ")"):
+                raise FilterError("Missing )")
+            return function
+        return self.parse_condition()
+
+    def parse_condition(self):
+        kind, word = self.next()
+        if kind != "name":
+            raise FilterError("Expected a status, field or module name, got %s" % word)
+
+        # STATUS in MODULE
+        if word.upper() in STATUS_CODES:
+            code = STATUS_CODES[word.upper()]
+            if not self.accept("name", "in"):
+                raise FilterError("Expected 'in' after %s" % word.upper())
+            module = self.expect_name("a module name")
+            if module == "any":
+                return lambda context: (context.codes == code).any(axis=2)
+            self.add_column(module)
+            return lambda context: context.get_status(module) == code
+
+        if word != "sample" and word not in NUMERIC_FIELDS and not is_module_name(word):
+            raise FilterError("Unknown field or module: %s" % word)
+
+        kind, operator = self.next()
+        if kind != "operator" or operator in ("(", ")", ","):
+            raise FilterError("Expected an operator after %s" % word)
+
+        # sample = NAME, sample ~ TEXT
+        if word == "sample":
+            text = self.expect_name("a sample name").lower()
+            if operator == "~":
+                return lambda context: (np.char.find(context.get_names(), text) >= 0)[:, np.newaxis]
+            if operator in ("=", "!="):
+                equal = operator == "="
+                return lambda context: ((context.get_names() == text) == equal)[:, np.newaxis]
+            raise FilterError("Samples can only be compared with = != or ~")
+
+        # FIELD OP NUMBER
+        if word in NUMERIC_FIELDS:
+            kind, number = self.next()
+            if kind != "number":
+                raise FilterError("Expected a number after %s %s" % (word, operator))
+            self.add_column(word)
+            compare = self.get_comparison(operator)
+            number = float(number)
+            return lambda context: compare(context.get_field(word), number)
+
+        # MODULE = STATUS
+        status = self.expect_name("a status").upper()
+        if status not in STATUS_CODES:
+            raise FilterError("Invalid status: %s" % status)
+        if operator not in ("=", "!="):
+            raise FilterError("Statuses can only be compared with = or !=")
+        code = STATUS_CODES[status]
+        equal = operator == "="
+        self.add_column(word)
+        return lambda context: (context.get_status(word) == code) == equal
+
+    def get_comparison(self, operator):
+        comparisons = {
+            "=": np.equal, "!=": np.not_equal, "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal
+        }
+        if operator not in comparisons:
+            raise FilterError("Numbers can't be compared with %s" % operator)
+        return comparisons[operator]
+
+    def add_column(self, field):
+        if field not in self.columns:
+            self.columns.append(field)
+
+    def parse_clauses(self):
+        columns = None
+        while self.peek()[0] is not None:
+            clause = self.expect_name("sort, limit or columns")
+            if clause == "sort":
+                self.sort_field = self.expect_name("a field to sort by")
+                if self.accept("name", "desc"):
+                    self.descending = True
+                else:
+                    self.accept("name", "asc")
+            elif clause == "limit":
+                kind, limit = self.next()
+                if kind != "number" or not limit.isdigit():
+                    raise FilterError("Expected a number after limit")
+                self.limit = int(limit)
+            elif clause == "columns":
+                columns = [self.expect_name("a column name")]
+                while self.accept("operator", ","):
+                    columns.append(self.expect_name("a column name"))
+            else:
+                raise FilterError("Unknown clause: %s" % clause)
+
+        if columns is not None:
+            self.columns = columns
+        elif self.sort_field is not None and self.sort_field not in ("sample", "read"):
+            self.add_column(self.sort_field)
+
+    def get_values(self, context, field, rows, read_slots):
+        """
+        Returns the values of a column for the selected read files.
+        """
+        if field == "sample":
+            return [context.sample_manager.all_samples[row].name for row in rows.tolist()]
+        if field == "read":
+            return (read_slots + 1).tolist()
+        if field in NUMERIC_FIELDS:
+            values = context.get_field(field)[rows, read_slots]
+            return [None if v != v else int(v) if v == int(v) else v for v in values.tolist()]
+        if context.get_module_id(field) is not None:
+            return [STATUS_NAMES[code] for code in context.get_status(field)[rows, read_slots].tolist()]
+        raise FilterError("Unknown column: %s" % field)
+
+    def get_sort_keys(self, context, rows, read_slots):
+        """
+        Returns the keys to sort the selected read files by, most significant last (see np.lexsort()).
+        Read files are always ordered by sample name (naturally) and read number after the sort field.
+        """
+        keys = [read_slots, context.sample_manager.get_natural_ranks()[rows]]
+        field = self.sort_field
+        if field is None or field == "sample":
+            return keys
+
+        if field in NUMERIC_FIELDS:
+            values = context.get_field(field)[rows, read_slots]
+            missing = np.isnan(values)
+            values = np.where(missing, 0, values)
+        elif context.get_module_id(field) is not None:
+            values = context.get_status(field)[rows, read_slots].astype(np.float64)
+            missing = np.zeros(len(values), dtype=bool)
+        else:
+            raise FilterError("Can't sort by %s" % field)
+
+        # Missing values last, also when sorting from high to low
+        return keys + [-values if self.descending else values, missing]
+
+    def run(self, sample_manager):
+        """
+        Runs the query against the current samples.
+        :return (columns, rows): Column names, and one row per selected read file
+        """
+        if np is None:
+            raise FilterError("Queries need numpy")
+
+        context = Context(sample_manager)
+        mask = context.exists
+        if self.function is not None:
+            with np.errstate(invalid="ignore"):  # Comparisons with missing values (NaN) are False
+                mask = mask & self.function(context)
+
+        rows, read_slots = np.nonzero(mask)
+        order = np.lexsort(self.get_sort_keys(context, rows, read_slots))
+        if self.descending and self.sort_field in (None, "sample"):
+            order = order[::-1]
+        if self.limit is not None:
+            order = order[:self.limit]
+        rows, read_slots = rows[order], read_slots[order]
+
+        values = [self.get_values(context, column, rows, read_slots) for column in self.columns]
+        return list(self.columns), [list(row) for row in zip(*values)] if values else []
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.function = None  # Compiled filter, returns a boolean array (samples x reads). None selects every read file
+        self.columns = ["sample", "read"]  # Columns of the result, fields used in the filter are added
+        self.sort_field = None
+        self.descending = False
+        self.limit = None
+
+        # Do stuff
+        if self.peek()[0] is not None and self.peek() not in [("name", c) for c in CLAUSES]:
+            self.function = self.parse_or()
+        self.parse_clauses()
@@ -0,0 +1,242 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from Sample import get_read_order
+
+# numpy is optional, the metric store can't be used without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_label_sort_key(label):
+    """
+    Sort key for row labels: base positions ("1", "10-14") are sorted by their first position,
+    anything else by name after all positions.
+    """
+    try:
+        return (0, int(label.split("-")[0]), label)
+    except ValueError:
+        return (1, 0, label)
+
+
+def find_position(labels, position):
+    """
+    Returns the index of the label that covers a base position, e.g. 12 is covered by "10-14".
+    :return index: Index into labels, or None if no label covers the position
+    """
+    for i, label in enumerate(labels):
+        if label == str(position):
+            return i
+
+        bounds = label.split("-")
+        try:
+            if int(bounds[0]) <= int(position) <= int(bounds[-1]):
+                return i
+        except ValueError:
+            continue
+
+    return None
+
+
+class MetricStore(object):
+    """
+    Columnar store of numeric module data across all samples. For a given module and read number, every
+    numeric column is stored as a sample x position matrix (float32, NaN where a sample has no value), e.g.
+    the "Mean" column of "Per base sequence quality". Matrices are written as .npy files to the store
+    directory and memory-mapped when they're used, so cohort-wide queries are array slices and don't need
+    the module tables of every sample in memory.
+
+    Every matrix is saved with a key computed from the sample list (names and zip-file sizes/mtimes), so
+    matrices are rebuilt when samples are added or changed.
+    """
+
+    def get_samples_key(self, samples):
+        """
+        Returns a digest of the sample list: names, order and the size/mtime of every zip-file.
+        """
+        md5 = hashlib.md5()
+        for sample in samples:
+            md5.update(sample.name + "\0")
+            for read_number, zip_path in sample.get_zip_files():
+                try:
+                    stat = os.stat(zip_path)
+                    md5.update("%s\0%d\0%d\0%r\0" % (zip_path, read_number, stat.st_size, stat.st_mtime))
+                except OSError:
+                    md5.update("%s\0%d\0missing\0" % (zip_path, read_number))
+        return md5.hexdigest()
+
+    def get_base_path(self, module, read_number):
+        """
+        Returns the path (without extension) used for files of a module and read number.
+        """
+        name = "%s.r%d" % (module.lower().replace(" ", "_"), read_number)
+        return os.path.join(self.store_dir, name)
+
+    def get_column_path(self, base_path, column_index):
+        return "%s.c%d.npy" % (base_path, column_index)
+
+    def build_module(self, samples, module, read_number):
+        """
+        Decodes the module table of every sample once and builds a matrix for every numeric column.
+        :return entry: Dictionary with "labels", "columns" and "matrices" ({column_name: matrix})
+        """
+        # Tables are read in the order of the files (see get_read_order()), labels and columns follow the samples
+        tables = [None] * len(samples)
+        for row in get_read_order(samples):
+            if samples[row].has_module_data(read_number):
+                tables[row] = samples[row].get_module_table(read_number, module)
+
+        labels = []
+        seen_labels = set()
+        columns = []
+
+        for table in tables:
+            if table is None:
+                continue
+
+            # Union of labels and numeric columns over all samples
+            for label in table.get_labels():
+                if label not in seen_labels:
+                    seen_labels.add(label)
+                    labels.append(label)
+            for column in self.get_metric_columns(table):
+                if column not in columns:
+                    columns.append(column)
+
+        # Order rows by position if the labels are positions
+        if all(get_label_sort_key(l)[0] == 0 for l in labels):
+            labels.sort(key=get_label_sort_key)
+        label_index = dict((label, i) for i, label in enumerate(labels))
+
+        matrices = {}
+        for column in columns:
+            matrices[column] = np.empty((len(samples), len(labels)), dtype=np.float32)
+            matrices[column].fill(np.nan)
+
+        for row, table in enumerate(tables):
+            if table is None:
+                continue
+
+            positions = [label_index[label] for label in table.get_labels()]
+            for column in columns:
+                if column in table.data and table[column].dtype.kind == "f":
+                    matrices[column][row, positions] = table[column]
+
+        return {"labels": labels, "columns": columns, "matrices": matrices}
+
+    def get_metric_columns(self, table):
+        """
+        Returns the numeric columns of a module table. The first column holds the row labels
+        (position, quality, GC %), so it's not a metric even if it's numeric.
+        """
+        return [c for c in table.get_numeric_columns() if c != table.columns[0]]
+
+    def save_module(self, base_path, key, entry):
+        """
+        Writes the matrices of a module to .npy files, and the labels/columns to a .json file next to them.
+        Files are written to temporary names first, so other sessions never see half-written files.
+        :return saved: False if the files could not be written (e.g. the disk is full), the matrices are then
+                       only kept in memory
+        """
+        tmp_path = None
+        try:
+            if not os.path.isdir(self.store_dir):
+                os.makedirs(self.store_dir)
+
+            for i, column in enumerate(entry["columns"]):
+                fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".npy")
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, entry["matrices"][column])
+                os.rename(tmp_path, self.get_column_path(base_path, i))
+
+            meta = {"key": key, "labels": entry["labels"], "columns": entry["columns"]}
+            fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".json")
+            with os.fdopen(fd, "w") as f:
+                json.dump(meta, f)
+            os.rename(tmp_path, base_path + ".json")
+        except (IOError, OSError) as e:
+            print "Warning: Could not write metrics to %s (%s)" % (self.store_dir, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+        return True
+
+    def load_module(self, base_path, key):
+        """
+        Memory-maps the matrices of a module, if they exist and were built for the same samples.
+        :return entry: See build_module(), or None if there's nothing (valid) on disk
+        """
+        try:
+            with open(base_path + ".json") as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if meta.get("key") != key:
+            return None
+
+        matrices = {}
+        try:
+            for i, column in enumerate(meta["columns"]):
+                matrices[column] = np.load(self.get_column_path(base_path, i), mmap_mode="r")
+        except IOError:
+            return None
+
+        return {"labels": meta["labels"], "columns": meta["columns"], "matrices": matrices}
+
+    def get_module(self, samples, module, read_number, generation=None):
+        """
+        Returns the matrices of a module for the given samples, from memory, disk or by building them.
+        :param generation: Optional counter that changes whenever the sample list changes. Avoids stat'ing
+                           every zip-file when the same sample list is queried again
+        :return entry: See build_module(), or None if numpy is not available
+        """
+        if np is None:
+            print "ERROR: Could not import module 'numpy', which is needed for cohort-wide metrics."
+            return None
+
+        if generation is None or generation != self.generation:
+            self.key = self.get_samples_key(samples)
+            self.generation = generation
+
+        memory_key = (module, read_number)
+        entry = self.loaded.get(memory_key)
+        if entry is not None and entry["key"] == self.key:
+            return entry
+
+        entry = None
+        if self.store_dir is not None:
+            base_path = self.get_base_path(module, read_number)
+            entry = self.load_module(base_path, self.key)
+            if entry is None:
+                entry = self.build_module(samples, module, read_number)
+                # Use the memory-mapped files if they could be written, otherwise the matrices that were built
+                if self.save_module(base_path, self.key, entry):
+                    entry = self.load_module(base_path, self.key) or entry
+        else:
+            entry = self.build_module(samples, module, read_number)
+
+        entry["key"] = self.key
+        self.loaded[memory_key] = entry
+        return entry
+
+    def get_matrix(self, samples, module, column, read_number, generation=None):
+        """
+        Returns the sample x position matrix of one column of a module, and the position labels.
+        :return (matrix, labels): Matrix rows follow the order of samples. (None, None) if the column doesn't exist
+        """
+        entry = self.get_module(samples, module, read_number, generation)
+        if entry is None or column not in entry["matrices"]:
+            return None, None
+        return entry["matrices"][column], entry["labels"]
+
+    def __init__(self, store_dir=None):
+        self.store_dir = store_dir  # Keep matrices in memory only if None
+        self.loaded = {}  # Format: {(module, read_number): entry}
+        self.key = None
+        self.generation = None
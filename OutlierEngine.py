@@ -0,0 +1,187 @@
+import warnings
+
+# numpy is optional, outliers can't be computed without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Module metrics that samples are compared on, as they are typed in commands, with the columns of the module
+# table that are compared and the smallest spread that's used as one unit of the z-score (in the unit of the
+# column), so a position where nearly every sample has the same value doesn't turn tiny differences into outliers.
+# Format: [(metric, module, columns, min_scale)]
+METRICS = [
+    ("per_base_quality", "Per base sequence quality", ["Mean"], 0.5),
+    ("per_base_content", "Per base sequence content", ["G", "A", "T", "C"], 0.5),
+    ("per_base_n_content", "Per base N content", ["N-Count"], 0.1),
+    ("gc_distribution", "Per sequence GC content", ["Count"], 0.1),
+]
+
+# Metrics whose values are compared as a percentage of the sample's total, because they're counts of reads
+NORMALIZED_METRICS = ["gc_distribution"]
+
+# Robust z-score from which a value counts as an outlier (Iglewicz and Hoaglin)
+OUTLIER_Z = 3.5
+
+# Scales the median absolute deviation to the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+
+
+def robust_z_scores(values, min_scale):
+    """
+    Computes the robust z-score of every value: its distance to the median of its column, in units of the
+    scaled median absolute deviation (MAD) of that column. Unlike the mean and standard deviation, the median and MAD
+    aren't pulled towards the outliers themselves.
+    :param values: Float array of shape (samples x positions x ...), NaN where a sample has no value
+    :param min_scale: Smallest scale (scaled MAD) of a column
+    :return (z_scores, medians): z-scores (same shape as values, NaN where values are NaN) and the median of every column
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # Positions that no sample has are all NaN
+        medians = np.nanmedian(values, axis=0)
+        deviations = np.abs(values - medians)
+        scales = np.nanmedian(deviations, axis=0) * MAD_SCALE
+
+    scales = np.fmax(scales, min_scale)
+    return (values - medians) / scales, medians
+
+
+class OutlierEngine(object):
+    """
+    Finds samples that are unusual compared to the rest of the cohort, even if FastQC passes them, since its
+    PASS/WARN/FAIL only looks at one file at a time. For a metric like the mean quality at every base position,
+    the sample x position matrices of the MetricStore are compared with the median of all samples at every position
+    (see robust_z_scores()), which ranks both the most anomalous samples and the positions where they differ.
+    Scores are cached until samples are added or removed.
+    """
+
+    def get_metric(self, metric):
+        """
+        Returns the module, columns and minimum scale of a metric (see METRICS), or None if it's unknown.
+        """
+        for name, module, columns, min_scale in METRICS:
+            if name == metric:
+                return module, columns, min_scale
+        return None
+
+    def get_values(self, metric, read_number):
+        """
+        Returns the values of a metric as a float array of shape (samples x positions x columns), and the position labels.
+        :return (values, labels): (None, None) if no sample has the metric
+        """
+        module, columns, min_scale = self.get_metric(metric)
+        matrices = []
+        labels = None
+        for column in columns:
+            matrix, labels = self.sample_manager.get_metric_matrix(module, column, read_number)
+            if matrix is None:
+                return None, None
+            matrices.append(np.asarray(matrix, dtype=np.float64))
+
+        values = np.dstack(matrices)
+        if metric in NORMALIZED_METRICS:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                totals = np.nansum(values, axis=1, keepdims=True)
+                values = values * 100.0 / np.where(totals > 0, totals, np.nan)
+
+        return values, labels
+
+    def get_scores(self, metric, read_number):
+        """
+        Scores every sample and position of a metric. Where a metric has several columns (e.g. G, A, T and C),
+        the column that differs most from the cohort counts.
+        :return scores: Dictionary, or None if no sample has the metric:
+                        labels: position labels
+                        medians: cohort median at every position (array of positions x columns)
+                        z: robust z-score of every sample at every position (array of samples x positions, NaN if missing)
+                        sample_scores: root mean square of the z-scores of every sample (NaN if it has no values)
+                        outliers: array of samples x positions, True where |z| >= OUTLIER_Z
+        """
+        key = (metric, read_number)
+        cached = self.scores.get(key)
+        if cached is not None and cached[0] == self.sample_manager.generation:
+            return cached[1]
+
+        values, labels = self.get_values(metric, read_number)
+        if values is None:
+            return None
+
+        module, columns, min_scale = self.get_metric(metric)
+        z_scores, medians = robust_z_scores(values, min_scale)
+
+        # The column with the largest |z| at every sample and position, keeping its sign
+        magnitudes = np.abs(z_scores)
+        missing = np.isnan(magnitudes)
+        magnitudes[missing] = -1
+        worst_columns = magnitudes.argmax(axis=2)
+        num_samples, num_positions = worst_columns.shape
+        z = z_scores[np.arange(num_samples)[:, np.newaxis], np.arange(num_positions), worst_columns]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # Samples without values get NaN
+            sample_scores = np.sqrt(np.nanmean(z * z, axis=1))
+
+        scores = {
+            "labels": labels,
+            "medians": medians,
+            "z": z,
+            "sample_scores": sample_scores,
+            "outliers": np.abs(np.nan_to_num(z)) >= OUTLIER_Z,
+        }
+        self.scores[key] = (self.sample_manager.generation, scores)
+        return scores
+
+    def rank_samples(self, metric, read_number):
+        """
+        Ranks the samples that are outliers at one or more positions, most anomalous (highest score) first.
+        :return rows: Format: [(sample_name, score, outlier_positions, worst_position, worst_z)], None if no sample has the metric
+        """
+        scores = self.get_scores(metric, read_number)
+        if scores is None:
+            return None
+
+        z = scores["z"]
+        outlier_positions = scores["outliers"].sum(axis=1)
+        rows = np.flatnonzero(outlier_positions > 0)
+        order = np.argsort(-scores["sample_scores"][rows], kind="mergesort")
+
+        magnitudes = np.abs(np.nan_to_num(z[rows[order]]))
+        worst = magnitudes.argmax(axis=1)
+
+        ranked = []
+        for i, row in enumerate(rows[order].tolist()):
+            ranked.append((self.sample_manager.all_samples[row].name, float(scores["sample_scores"][row]), int(outlier_positions[row]),
+                           scores["labels"][worst[i]], float(z[row, worst[i]])))
+        return ranked
+
+    def rank_positions(self, metric, read_number):
+        """
+        Ranks positions by the number of samples that are outliers there, then by their mean |z|.
+        :return rows: Format: [(position, outlier_samples, mean_abs_z, worst_sample, worst_z)], None if no sample has the metric
+        """
+        scores = self.get_scores(metric, read_number)
+        if scores is None:
+            return None
+
+        z = scores["z"]
+        outlier_samples = scores["outliers"].sum(axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # Positions without values get NaN
+            mean_abs_z = np.nanmean(np.abs(z), axis=0)
+
+        # Positions that no sample has are left out
+        positions = np.flatnonzero(~np.isnan(mean_abs_z))
+        order = np.lexsort((-mean_abs_z[positions], -outlier_samples[positions]))
+        positions = positions[order]
+        worst = np.abs(np.nan_to_num(z[:, positions])).argmax(axis=0)
+
+        ranked = []
+        for i, position in enumerate(positions.tolist()):
+            ranked.append((scores["labels"][position], int(outlier_samples[position]), float(mean_abs_z[position]),
+                           self.sample_manager.all_samples[worst[i]].name, float(z[worst[i], position])))
+        return ranked
+
+    def __init__(self, sample_manager):
+        self.sample_manager = sample_manager  # Its MetricStore holds the matrices that are compared
+        self.scores = {}  # Format: {(metric, read_number): (generation, scores)}, see get_scores()
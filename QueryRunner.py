@@ -0,0 +1,432 @@
+import sys
+import json
+import shlex
+from MetricStore import find_position
+import ReadCounts
+import OutlierEngine
+from TableRenderer import select_rows, format_tsv_value
+from FilterQuery import FilterQuery, FilterError
+
+# Module names as they are typed in commands, and the names FastQC uses for them
+MODULE_NAMES = {
+    "per_tile_sequence_quality": "Per tile sequence quality",
+    "per_base_sequence_quality": "Per base sequence quality",
+    "sequence_duplication_levels": "Sequence Duplication Levels",
+    "per_base_sequence_content": "Per base sequence content",
+    "per_sequence_gc_content": "Per sequence GC content",
+    "sequence_length_distribution": "Sequence Length Distribution",
+    "kmer_content": "Kmer Content",
+    "basic_statistics": "Basic Statistics",
+    "adapter_content": "Adapter Content",
+    "overrepresented_sequences": "Overrepresented sequences",
+    "per_base_n_content": "Per base N content",
+    "per_sequence_quality_scores": "Per sequence quality scores"
+}
+
+# Supported statuses
+STATUSES = ["PASS", "WARN", "FAIL"]
+
+
+class QueryError(Exception):
+    """
+    Raised when a command can't be run, e.g. because of an unknown sample or module name.
+    """
+    pass
+
+
+class QueryRunner(object):
+    """
+    Runs the browser's commands without prompts, e.g. "print_samples_by_status_in_module adapter_content FAIL",
+    and returns the results as tables (column names and rows) instead of printing them. Used by batch mode,
+    so scripts can run many commands against a single load.
+    """
+
+    # Supported commands and the arguments they take
+    commands = [
+        ("help", []),
+        ("print_global_stats", []),
+        ("print_module_stats", []),
+        ("print_sample_details", ["SAMPLE"]),
+        ("print_samples_by_status_in_module", ["MODULE", "STATUS"]),
+        ("print_all_samples_orderby_status", ["STATUS"]),
+        ("print_all_modules_orderby_status", ["STATUS"]),
+        ("print_module_description", ["MODULE"]),
+        ("print_metric_by_position", ["MODULE", "READ", "COLUMN", "POSITION"]),
+        ("print_read_count_stats", []),
+        ("print_read_count_histogram", []),
+        ("print_read_counts_by_status", ["MODULE"]),
+        ("print_low_depth_reads", ["FRACTION"]),
+        ("print_outlier_samples", ["METRIC", "READ"]),
+        ("print_outlier_positions", ["METRIC", "READ"]),
+        ("query", ["EXPRESSION"]),
+        ("open_sample_html_report", ["SAMPLE", "READ"]),
+        ("list_samples", []),
+        ("list_metric_columns", ["MODULE", "READ"]),
+    ]
+
+    # Commands whose results are never cut by --limit/--offset, they're used by clients and scripts to get the complete lists
+    unlimited_commands = ["help", "list_samples", "list_metric_columns", "open_sample_html_report"]
+
+    def get_module(self, module_name):
+        """
+        Returns the FastQC name of a module, e.g. "Adapter Content" for adapter_content.
+        """
+        if module_name not in MODULE_NAMES:
+            raise QueryError("Invalid module name: %s" % module_name)
+        return MODULE_NAMES[module_name]
+
+    def get_status(self, status):
+        if status.upper() not in STATUSES:
+            raise QueryError("Invalid status: %s" % status)
+        return status.upper()
+
+    def get_sample(self, sample_name):
+        if not self.sample_manager.has_sample(sample_name):
+            raise QueryError("Invalid sample name: %s" % sample_name)
+        return self.sample_manager.get_sample_by_name(sample_name)
+
+    def get_read_number(self, read_number):
+        if not read_number.isdigit():
+            raise QueryError("Invalid read number: %s" % read_number)
+        return int(read_number)
+
+    def get_metric(self, metric):
+        if OutlierEngine.np is None:
+            raise QueryError("Could not compute outliers (numpy is missing)")
+        if metric not in [m[0] for m in OutlierEngine.METRICS]:
+            raise QueryError("Invalid metric: %s" % metric)
+        return metric
+
+    def get_fraction(self, fraction):
+        try:
+            value = float(fraction)
+        except ValueError:
+            raise QueryError("Invalid fraction: %s" % fraction)
+        # NaN and infinity aren't fractions of the median either
+        if value < 0 or value != value or value == float("inf"):
+            raise QueryError("Invalid fraction: %s" % fraction)
+        return value
+
+    def get_read_count_rows(self, summaries, groups):
+        """
+        Returns one row of read count statistics per group (see ReadCounts.summarize()), groups without read files are left out.
+        """
+        rows = []
+        for group in groups:
+            summary = summaries.get(group)
+            if summary is not None:
+                rows.append([group, summary["files"], int(summary["mean"])] + [int(round(p)) for p in summary["percentiles"]])
+        return rows
+
+    def query_help(self):
+        rows = [[name, " ".join(args)] for name, args in self.commands]
+        return ["command", "arguments"], rows
+
+    def query_print_global_stats(self):
+        manager = self.sample_manager
+        manager.load_statuses()
+        row = [manager.num_passes, manager.num_warnings, manager.num_failures]
+
+        reads_stats = manager.get_stats_number_of_reads()
+        if reads_stats == -1:
+            raise QueryError("Could not calculate number of reads (numpy is missing)")
+
+        row += [int(reads_stats["mean"]), int(reads_stats["median"]), int(reads_stats["low"]), int(reads_stats["high"])]
+        return ["passes", "warnings", "failures", "mean_reads", "median_reads", "min_reads", "max_reads"], [row]
+
+    def query_print_module_stats(self):
+        self.sample_manager.load_statuses()
+        module_stats = self.sample_manager.module_stats
+        rows = [[module] + [module_stats[module][status] for status in STATUSES] for module in sorted(module_stats.keys())]
+        return ["module", "pass", "warn", "fail"], rows
+
+    def query_print_sample_details(self, sample_name):
+        sample = self.get_sample(sample_name)
+        rows = []
+        for module in sorted(sample.modules.keys()):
+            for read_number, status in sorted(sample.modules[module].items()):
+                rows.append([sample.name, read_number, module, status])
+        return ["sample", "read", "module", "status"], rows
+
+    def query_print_samples_by_status_in_module(self, module_name, status):
+        module = self.get_module(module_name)
+        status = self.get_status(status)
+
+        result = self.sample_manager.get_samples_by_module_and_status(module, status)
+        rows = []
+        for name in sorted(result.keys(), key=self.sample_manager.sort_keys.get):
+            rows.append([name, module, status, " ".join(str(rn) for rn in result[name])])
+        return ["sample", "module", "status", "reads"], rows
+
+    def query_print_all_samples_orderby_status(self, status):
+        status = self.get_status(status)
+        self.sample_manager.load_statuses()
+        status_counts = self.sample_manager.status_counts
+
+        rows = []
+        for name in self.sample_manager.get_ranked_samples(status):
+            rows.append([name] + [status_counts[name][s] for s in STATUSES])
+        return ["sample", "pass", "warn", "fail"], rows
+
+    def query_print_all_modules_orderby_status(self, status):
+        status = self.get_status(status)
+        self.sample_manager.load_statuses()
+        module_stats = self.sample_manager.module_stats
+
+        rows = []
+        for module in sorted(module_stats.keys(), key=lambda m: (-module_stats[m][status], m)):
+            rows.append([module] + [module_stats[module][s] for s in STATUSES])
+        return ["module", "pass", "warn", "fail"], rows
+
+    def query_print_module_description(self, module_name):
+        self.get_module(module_name)
+        description = self.module_descriptions.get(module_name, "")
+        return ["module", "description"], [[module_name, description.strip()]]
+
+    def query_print_metric_by_position(self, module_name, read_number, column, position):
+        module = self.get_module(module_name)
+        read_number = self.get_read_number(read_number)
+
+        matrix, labels = self.sample_manager.get_metric_matrix(module, column, read_number)
+        if matrix is None:
+            raise QueryError("No data for column '%s' in module '%s' for read %d" % (column, module, read_number))
+
+        index = find_position(labels, position)
+        if index is None:
+            raise QueryError("No position '%s' in module '%s'" % (position, module))
+
+        rows = []
+        for sample, value in zip(self.sample_manager.all_samples, matrix[:, index].tolist()):
+            if value == value:  # Leave out NaN (samples without a value)
+                rows.append([sample.name, labels[index], round(value, 4)])
+        rows.sort(key=lambda r: r[2])
+        return ["sample", "position", column], rows
+
+    def query_print_read_count_stats(self):
+        read_counts = self.sample_manager.get_read_counts()
+        summaries = self.sample_manager.get_read_counts_by_status()
+        if read_counts is None or summaries is None:
+            raise QueryError("Could not calculate number of reads (numpy is missing)")
+
+        summaries["all"] = read_counts.get_summary()
+        columns = ["group", "files", "mean"] + ["p%d" % p for p in ReadCounts.PERCENTILES]
+        return columns, self.get_read_count_rows(summaries, ["all"] + STATUSES)
+
+    def query_print_read_count_histogram(self):
+        read_counts = self.sample_manager.get_read_counts()
+        if read_counts is None:
+            raise QueryError("Could not calculate number of reads (numpy is missing)")
+
+        bin_counts, edges = read_counts.get_histogram()
+        rows = [[int(edges[i]), int(edges[i + 1]), int(count)] for i, count in enumerate(bin_counts)]
+        return ["from", "to", "files"], rows
+
+    def query_print_read_counts_by_status(self, module_name):
+        module = self.get_module(module_name)
+        summaries = self.sample_manager.get_read_counts_by_status(module)
+        if summaries is None:
+            raise QueryError("Could not calculate number of reads (numpy is missing)")
+
+        columns = ["status", "files", "mean"] + ["p%d" % p for p in ReadCounts.PERCENTILES]
+        return columns, self.get_read_count_rows(summaries, STATUSES)
+
+    def query_print_low_depth_reads(self, fraction):
+        fraction = self.get_fraction(fraction)
+        threshold, reads = self.sample_manager.get_low_depth_reads(fraction)
+        if threshold is None:
+            raise QueryError("Could not calculate number of reads (numpy is missing)")
+        return ["sample", "read", "reads"], [list(read) for read in reads]
+
+    def query_print_outlier_samples(self, metric, read_number):
+        metric = self.get_metric(metric)
+        read_number = self.get_read_number(read_number)
+
+        ranked = self.sample_manager.outlier_engine.rank_samples(metric, read_number)
+        if ranked is None:
+            raise QueryError("No data for metric '%s' for read %d" % (metric, read_number))
+
+        rows = [[name, round(score, 4), positions, position, round(z, 4)] for name, score, positions, position, z in ranked]
+        return ["sample", "score", "outlier_positions", "worst_position", "worst_z"], rows
+
+    def query_print_outlier_positions(self, metric, read_number):
+        metric = self.get_metric(metric)
+        read_number = self.get_read_number(read_number)
+
+        ranked = self.sample_manager.outlier_engine.rank_positions(metric, read_number)
+        if ranked is None:
+            raise QueryError("No data for metric '%s' for read %d" % (metric, read_number))
+
+        rows = [[position, samples, round(mean_abs_z, 4), name, round(z, 4)] for position, samples, mean_abs_z, name, z in ranked]
+        return ["position", "outlier_samples", "mean_abs_z", "worst_sample", "worst_z"], rows
+
+    def query_query(self, expression):
+        """
+        Runs a filter query over all read files (see FilterQuery). Parsed queries are kept, so running the same
+        query again only evaluates it.
+        """
+        try:
+            query = self.filter_queries.get(expression)
+            if query is None:
+                query = FilterQuery(expression)
+                if len(self.filter_queries) >= 100:
+                    self.filter_queries.clear()
+                self.filter_queries[expression] = query
+            return query.run(self.sample_manager)
+        except FilterError as e:
+            raise QueryError(str(e))
+
+    def query_open_sample_html_report(self, sample_name, read_number):
+        """
+        Returns where the HTML report is (zip-file and member), rather than extracting it: extracted reports
+        are removed when the browser exits.
+        """
+        sample = self.get_sample(sample_name)
+        read_number = self.get_read_number(read_number)
+        if read_number not in sample.html_reports:
+            raise QueryError("No HTML report for read %d in sample %s" % (read_number, sample.name))
+        return ["sample", "read", "zip", "member"], [[sample.name, read_number, sample.read_zips[read_number], sample.html_reports[read_number]]]
+
+    def query_list_samples(self):
+        names = sorted(self.sample_manager.sample_names, key=self.sample_manager.sort_keys.get)
+        return ["sample"], [[name] for name in names]
+
+    def query_list_metric_columns(self, module_name, read_number):
+        module = self.get_module(module_name)
+        read_number = self.get_read_number(read_number)
+        return ["column"], [[column] for column in self.sample_manager.get_metric_columns(module, read_number)]
+
+    def run(self, line):
+        """
+        Runs a single command line, e.g. "print_samples_by_status_in_module adapter_content FAIL".
+        :return result: Dictionary with "command", and "columns" and "rows", or "error" if the command failed
+        """
+        result = {"command": line.strip()}
+
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            result["error"] = "Could not parse command: %s" % e
+            return result
+
+        if len(words) == 0:
+            result["error"] = "Empty command"
+            return result
+
+        command = words[0].lower()
+        args = words[1:]
+
+        # Expressions are parsed by the command itself, e.g. "query FAIL in adapter_content and read = 2".
+        # A single quoted argument is unquoted, as sent by clients (see read_remote_input())
+        if dict(self.commands).get(command) == ["EXPRESSION"]:
+            expression = line.strip().split(None, 1)[1] if len(args) > 0 else ""
+            args = [args[0] if len(args) == 1 else expression]
+
+        expected_args = dict(self.commands).get(command)
+        if expected_args is None:
+            result["error"] = "Unknown command: %s" % command
+            return result
+
+        if len(args) != len(expected_args):
+            result["error"] = "Usage: %s %s" % (command, " ".join(expected_args))
+            return result
+
+        try:
+            columns, rows = getattr(self, "query_" + command)(*args)
+        except QueryError as e:
+            result["error"] = str(e)
+            return result
+
+        result["columns"] = columns
+        if command in self.unlimited_commands:
+            result["rows"] = rows
+        else:
+            result["rows"] = list(select_rows(rows, self.limit, self.offset))
+        return result
+
+    def __init__(self, sample_manager, module_descriptions=None, limit=None, offset=0):
+        self.sample_manager = sample_manager
+        self.module_descriptions = module_descriptions or {}  # Format: {module_name: description}
+        self.filter_queries = {}  # Format: {expression: FilterQuery}, parsed queries
+        self.limit = limit  # Maximum number of rows of a result, None for all (see --limit)
+        self.offset = offset  # Number of rows of a result to skip (see --offset)
+
+
+def format_text(result):
+    """
+    Formats the result of QueryRunner.run() as an aligned table for people to read.
+    Values that span several lines (e.g. module descriptions) are printed below their column name instead.
+    """
+    if "error" in result:
+        return "ERROR: %s\n" % result["error"]
+
+    columns = result["columns"]
+    rows = [[v if isinstance(v, basestring) else str(v) for v in row] for row in result["rows"]]
+
+    if any("\n" in v for row in rows for v in row):
+        lines = []
+        for row in rows:
+            for column, value in zip(columns, row):
+                lines += ["== %s ==" % column, value, ""]
+        return "\n".join(lines) + "\n"
+
+    widths = [len(c) for c in columns]
+    for row in rows:
+        widths = [max(w, len(v)) for w, v in zip(widths, row)]
+
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip()]
+    lines.append("  ".join("-" * w for w in widths))
+    for row in rows:
+        lines.append("  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+    return "\n".join(lines) + "\n"
+
+
+def format_result(result, output_format):
+    """
+    Formats the result of QueryRunner.run() as TSV (a "# command" line, a header line and one line per row,
+    see format_tsv_value()), JSON (one object per line) or text (see format_text()).
+    """
+    if output_format == "json":
+        return json.dumps(result) + "\n"
+
+    if output_format == "text":
+        return "# %s\n%s" % (result["command"], format_text(result))
+
+    lines = ["# " + result["command"]]
+    if "error" in result:
+        lines.append("# ERROR: " + result["error"])
+    else:
+        lines.append("\t".join(result["columns"]))
+        for row in result["rows"]:
+            lines.append("\t".join(format_tsv_value(v) for v in row))
+
+    return "\n".join(lines) + "\n"
+
+
+def run_batch(query_runner, command_file, output_format="tsv", output=None):
+    """
+    Runs every command in a file (one per line, empty lines and lines starting with # are skipped)
+    and writes the results to output.
+    :param query_runner: QueryRunner (or QueryClient) to run the commands with
+    :param command_file: Open file to read commands from, e.g. sys.stdin
+    :param output_format: "tsv", "json" or "text"
+    :param output: Open file to write results to, sys.stdout by default
+    :return num_errors: Number of commands that failed
+    """
+    if output is None:
+        output = sys.stdout
+
+    num_errors = 0
+
+    for line in command_file:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        result = query_runner.run(line)
+        if "error" in result:
+            num_errors += 1
+
+        output.write(format_result(result, output_format))
+        output.flush()
+
+    return num_errors
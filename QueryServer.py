@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import socket
+import threading
+import SocketServer
+
+# Permissions of the socket file. Clients need write permission to connect, so the owner's group can query the server
+DEFAULT_SOCKET_MODE = 0660
+
+
+class QueryRequestHandler(SocketServer.StreamRequestHandler):
+    """
+    Answers the queries of a single client connection. Every request is one line: either a JSON object
+    {"query": "print_samples_by_status_in_module adapter_content FAIL"} or the plain command line.
+    Every response is one line of JSON, see QueryRunner.run().
+    """
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                query = json.loads(line)["query"] if line.startswith("{") else line
+            except (ValueError, KeyError, TypeError):
+                result = {"command": line, "error": "Invalid request, expected {\"query\": \"...\"}"}
+            else:
+                result = self.server.run_query(query)
+
+            try:
+                self.wfile.write(json.dumps(result) + "\n")
+                self.wfile.flush()
+            except socket.error:
+                # Client has gone away
+                return
+
+
+class QueryServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Keeps a loaded SampleManager in memory and answers queries on a Unix domain socket, so clients
+    (see QueryClient) start instantly no matter how many samples there are.
+    Every client gets its own thread, but queries are run one at a time: the SampleManager (and its
+    metric store) is not thread-safe, and queries are short compared to loading.
+    """
+    daemon_threads = True
+
+    def run_query(self, query):
+        """
+        Runs a query while holding the lock. In watch mode, new samples are merged in first.
+        """
+        with self.lock:
+            if self.watcher is not None:
+                self.watcher.merge_pending(self.query_runner.sample_manager)
+
+            try:
+                return self.query_runner.run(query)
+            except Exception as e:
+                # Keep serving other queries
+                return {"command": query, "error": "Internal error: %s" % e}
+
+    def server_bind(self):
+        SocketServer.UnixStreamServer.server_bind(self)
+        os.chmod(self.socket_path, self.socket_mode)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    @staticmethod
+    def remove_stale_socket(socket_path):
+        """
+        Removes a socket file left behind by a server that didn't shut down cleanly.
+        Exits if another server is still answering on it.
+        """
+        if not os.path.exists(socket_path):
+            return
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except socket.error:
+            os.remove(socket_path)
+        else:
+            print "ERROR: Another server is already running on %s" % socket_path
+            sys.exit()
+        finally:
+            sock.close()
+
+    def __init__(self, socket_path, query_runner, watcher=None, socket_mode=DEFAULT_SOCKET_MODE):
+        self.socket_path = os.path.abspath(socket_path)
+        self.query_runner = query_runner
+        self.watcher = watcher  # Optional DirectoryWatcher
+        self.socket_mode = socket_mode  # Set after binding, see server_bind()
+        self.lock = threading.Lock()
+
+        # Do stuff
+        self.remove_stale_socket(self.socket_path)
+        SocketServer.UnixStreamServer.__init__(self, self.socket_path, QueryRequestHandler)
+
+
+class QueryClient(object):
+    """
+    Sends queries to a QueryServer. run() returns the same results as QueryRunner.run(), so a client
+    can be used wherever a QueryRunner is (e.g. batch mode).
+    """
+
+    def run(self, line):
+        """
+        Runs a command line on the server.
+        :return result: Dictionary with "command", and "columns" and "rows", or "error"
+        """
+        self.wfile.write(json.dumps({"query": line}) + "\n")
+        self.wfile.flush()
+
+        response = self.rfile.readline()
+        if not response:
+            raise IOError("Server closed the connection")
+        return json.loads(response)
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile("rb")
+        self.wfile = self.sock.makefile("wb")
@@ -0,0 +1,186 @@
+import math
+
+# numpy is optional, read count statistics aren't available without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from StatusIndex import STATUS_CODES
+
+# Percentiles in every read count summary (see summarize())
+PERCENTILES = [0, 5, 25, 50, 75, 95, 100]
+
+
+def summarize(values):
+    """
+    Returns the number of read files, mean, median, lowest and highest number of reads of a sorted array.
+    :return summary: Dictionary with keys files, mean, median, low, high and percentiles (at PERCENTILES),
+                     or None if values is empty
+    """
+    if len(values) == 0:
+        return None
+
+    return {
+        "files": len(values),
+        "mean": np.mean(values),
+        "median": np.median(values),
+        "low": values[0],
+        "high": values[-1],
+        "percentiles": np.percentile(values, PERCENTILES)
+    }
+
+
+class ReadCounts(object):
+    """
+    Number of reads (Total Sequences) of every read file in the cohort: an int64 array of shape (samples x reads),
+    with -1 where a sample has no such read file or no Basic Statistics. Row i is the i-th sample in
+    SampleManager.all_samples, like in StatusIndex, so read counts can be grouped by status without any lookups.
+    The sorted counts and their summary are cached until samples are added or removed.
+    """
+
+    def reserve(self, num_samples, num_reads):
+        """
+        Grows the array (if needed) to fit the given number of samples and reads, in chunks (see StatusIndex.reserve()).
+        """
+        capacity, reads = self.counts.shape
+        if num_samples <= capacity and num_reads <= reads:
+            return
+
+        new_capacity = capacity
+        if num_samples > capacity:
+            new_capacity = max(num_samples, capacity * 2)
+
+        counts = np.empty((new_capacity, max(reads, num_reads)), dtype=np.int64)
+        counts.fill(-1)
+        counts[:capacity, :reads] = self.counts
+        self.counts = counts
+
+    def set_row(self, row, sample):
+        """
+        Writes the read counts of a sample to a row of the array.
+        """
+        entries = sample.get_number_of_reads_by_read()
+        num_reads = max([read_number for read_number, num_reads in entries] or [0])
+        self.reserve(row + 1, num_reads)
+
+        self.counts[row] = -1
+        for read_number, num_reads in entries:
+            self.counts[row, read_number - 1] = num_reads
+        self.clear_cache()
+
+    def append(self, sample):
+        """
+        Adds a sample as the last row.
+        """
+        self.set_row(self.num_samples, sample)
+        self.num_samples += 1
+
+    def remove(self, row):
+        """
+        Removes a row, later rows move up one step (see StatusIndex.remove()).
+        """
+        self.counts[row:self.num_samples - 1] = self.counts[row + 1:self.num_samples]
+        self.counts[self.num_samples - 1] = -1
+        self.num_samples -= 1
+        self.clear_cache()
+
+    def clear_cache(self):
+        self.sorted_counts = None
+        self.summary = None
+
+    def get_counts(self):
+        """
+        Returns the part of the array that's in use.
+        """
+        return self.counts[:self.num_samples]
+
+    def get_sorted_counts(self):
+        """
+        Returns the read counts of all read files, sorted. Computed once until samples are added or removed.
+        """
+        if self.sorted_counts is None:
+            counts = self.get_counts()
+            self.sorted_counts = np.sort(counts[counts >= 0])
+        return self.sorted_counts
+
+    def get_summary(self):
+        """
+        Returns the mean, median, lowest and highest number of reads (see summarize()), cached like get_sorted_counts().
+        """
+        if self.summary is None:
+            self.summary = summarize(self.get_sorted_counts())
+        return self.summary
+
+    def get_percentiles(self):
+        """
+        Returns the number of reads at PERCENTILES, or None if there are no read counts.
+        """
+        summary = self.get_summary()
+        if summary is None:
+            return None
+        return summary["percentiles"]
+
+    def get_histogram(self, num_bins=10):
+        """
+        Counts read files in bins that are evenly spaced on a log scale, since read counts often span
+        orders of magnitude.
+        :return (bin_counts, edges): Number of read files per bin, and the num_bins + 1 bin edges
+        """
+        values = self.get_sorted_counts()
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+
+        low = math.log10(max(values[0], 1))
+        high = math.log10(max(values[-1], 1))
+        if high <= low:
+            return np.array([len(values)]), np.array([values[0], values[-1]], dtype=np.float64)
+
+        edges = np.logspace(low, high, num_bins + 1)
+        edges[0] = values[0]  # Include read files with 0 reads in the first bin
+        edges[-1] = values[-1]  # and make sure rounding doesn't leave out the largest
+        bin_counts, edges = np.histogram(values, edges)
+        return bin_counts, edges
+
+    def get_status_groups(self, status_codes, module_id=None):
+        """
+        Groups read files by status: their status in a module, or their worst status over all modules.
+        :param status_codes: Statuses of the same samples, StatusIndex.get_codes() (samples x reads x modules)
+        :param module_id: Column of a module in the status index, None for the worst status of every read file
+        :return groups: Format: {status: sorted read counts}
+        """
+        num_reads = min(self.counts.shape[1], status_codes.shape[1])
+        counts = self.get_counts()[:, :num_reads]
+        codes = status_codes[:, :num_reads]
+
+        # FAIL has the highest code, so the worst status is the largest
+        if module_id is None:
+            codes = codes.max(axis=2)
+        else:
+            codes = codes[:, :, module_id]
+
+        groups = {}
+        for status, code in STATUS_CODES.items():
+            groups[status] = np.sort(counts[(codes == code) & (counts >= 0)])
+        return groups
+
+    def find_low_depth(self, threshold):
+        """
+        Finds read files with fewer reads than a threshold.
+        :return (rows, read_numbers, counts): Arrays of sample rows, read numbers and read counts, fewest reads first
+        """
+        counts = self.get_counts()
+        rows, read_slots = np.nonzero((counts >= 0) & (counts < threshold))
+        values = counts[rows, read_slots]
+        order = np.argsort(values, kind="mergesort")
+        return rows[order], read_slots[order] + 1, values[order]
+
+    def __init__(self, samples=()):
+        self.num_samples = 0
+        self.counts = np.empty((len(samples), 2), dtype=np.int64)
+        self.counts.fill(-1)
+        self.sorted_counts = None  # Sorted read counts of all read files, see get_sorted_counts()
+        self.summary = None
+
+        for sample in samples:
+            self.append(sample)
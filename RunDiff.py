@@ -0,0 +1,178 @@
+# numpy is optional, but runs can only be compared with it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from StatusIndex import STATUS_NAMES
+from FilterQuery import to_number
+
+
+class RunDiff(object):
+    """
+    Compares two runs of the same samples, e.g. before and after re-sequencing: which samples are in only one
+    of them, how the status of every module changed, and how the Basic Statistics changed. Samples are joined
+    by name with a hash table, after which the comparison works on the status index and read count arrays of
+    both SampleManagers (whose rows follow all_samples), so it doesn't loop over samples or modules.
+    """
+
+    def join(self):
+        """
+        Joins the samples of both runs by name.
+        :return (before_rows, after_rows): Arrays of the rows of the shared samples in both runs,
+                                           in natural order of their names
+        """
+        after_rows = dict((sample.name, row) for row, sample in enumerate(self.after.all_samples))
+        pairs = [(row, after_rows[sample.name]) for row, sample in enumerate(self.before.all_samples) if sample.name in after_rows]
+
+        before_rows = np.array([p[0] for p in pairs], dtype=np.intp)
+        after_rows = np.array([p[1] for p in pairs], dtype=np.intp)
+        order = np.argsort(self.before.get_natural_ranks()[before_rows], kind="mergesort")
+        return before_rows[order], after_rows[order]
+
+    def get_unmatched_samples(self):
+        """
+        Returns the samples that are in only one of the runs.
+        :return rows: Format: [[name, run]], where run is "before" or "after"
+        """
+        before_names = set(self.before.sample_names)
+        after_names = set(self.after.sample_names)
+        rows = [[name, "before"] for name in before_names - after_names] + [[name, "after"] for name in after_names - before_names]
+        return sorted(rows, key=lambda row: self.before.sort_keys.get(row[0]) or self.after.sort_keys.get(row[0]))
+
+    def get_aligned_codes(self):
+        """
+        Returns the statuses of the shared samples in both runs, with the same reads and modules in the same columns.
+        :return (codes_before, codes_after, module_names): Arrays of shape (shared samples x reads x modules)
+        """
+        before_index = self.before.status_index
+        after_index = self.after.status_index
+        module_names = sorted(set(before_index.module_names) | set(after_index.module_names))
+
+        codes_before = before_index.get_codes()[self.before_rows]
+        codes_after = after_index.get_codes()[self.after_rows]
+        num_reads = max(codes_before.shape[1], codes_after.shape[1])
+
+        aligned = []
+        for codes, index in ((codes_before, before_index), (codes_after, after_index)):
+            array = np.zeros((len(self.before_rows), num_reads, len(module_names)), dtype=np.int8)
+            columns = [module_names.index(module) for module in index.module_names]
+            array[:, :codes.shape[1], columns] = codes[:, :, :len(index.module_names)]
+            aligned.append(array)
+
+        return aligned[0], aligned[1], module_names
+
+    def get_status_changes(self):
+        """
+        Returns every read and module whose status differs between the runs. A status of None means the module
+        has no status in that run.
+        :return rows: Format: [[sample, read_number, module, before, after]], by sample, read and module
+        """
+        codes_before, codes_after, module_names = self.codes
+        rows, read_slots, module_ids = np.nonzero(codes_before != codes_after)
+        froms = codes_before[rows, read_slots, module_ids]
+        tos = codes_after[rows, read_slots, module_ids]
+
+        names = self.before.all_samples
+        return [[names[self.before_rows[row]].name, read_slot + 1, module_names[module_id], STATUS_NAMES[old], STATUS_NAMES[new]]
+                for row, read_slot, module_id, old, new in zip(rows.tolist(), read_slots.tolist(), module_ids.tolist(), froms.tolist(), tos.tolist())]
+
+    def get_transitions(self):
+        """
+        Counts the status changes of every module, e.g. how many reads went from PASS to FAIL in Adapter Content.
+        :return rows: Format: [[module, before, after, reads]], by module and most frequent change first
+        """
+        codes_before, codes_after, module_names = self.codes
+        num_modules = len(module_names)
+
+        # Every (module, before, after) combination is one bin
+        changed = codes_before != codes_after
+        module_ids = np.nonzero(changed)[2]
+        bins = (module_ids * 4 + codes_before[changed]) * 4 + codes_after[changed]
+        counts = np.bincount(bins, minlength=num_modules * 16).reshape(num_modules, 4, 4)
+
+        rows = []
+        for module_id, old, new in zip(*np.nonzero(counts)):
+            rows.append([module_names[module_id], STATUS_NAMES[old], STATUS_NAMES[new], int(counts[module_id, old, new])])
+        return sorted(rows, key=lambda row: (row[0], -row[3]))
+
+    def get_basic_stat_changes(self):
+        """
+        Returns the reads whose number of reads or %GC differ between the runs, largest relative change in number
+        of reads first. Missing values are None.
+        :return rows: Format: [[sample, read_number, reads_before, reads_after, delta, change_pct, gc_before, gc_after]]
+        """
+        before_counts = self.before.get_read_counts().get_counts()[self.before_rows]
+        after_counts = self.after.get_read_counts().get_counts()[self.after_rows]
+        before_gc = self.before.get_basic_stat_array("%GC", to_number)[self.before_rows]
+        after_gc = self.after.get_basic_stat_array("%GC", to_number)[self.after_rows]
+
+        # Same reads in both runs, -1 and NaN where a run doesn't have a read
+        num_reads = max(before_counts.shape[1], after_counts.shape[1], before_gc.shape[1], after_gc.shape[1])
+        arrays = []
+        for array, missing in ((before_counts, -1), (after_counts, -1), (before_gc, np.nan), (after_gc, np.nan)):
+            padded = np.empty((len(self.before_rows), num_reads), dtype=array.dtype)
+            padded.fill(missing)
+            padded[:, :array.shape[1]] = array
+            arrays.append(padded)
+        before_counts, after_counts, before_gc, after_gc = arrays
+
+        # NaN != NaN, so %GC only counts as changed if it's present in either run
+        gc_changed = (before_gc != after_gc) & ~(np.isnan(before_gc) & np.isnan(after_gc))
+        rows, read_slots = np.nonzero((before_counts != after_counts) | gc_changed)
+
+        old = before_counts[rows, read_slots]
+        new = after_counts[rows, read_slots]
+        both = (old >= 0) & (new >= 0)
+        delta = np.where(both, new - old, 0)
+        change = np.zeros(len(rows))
+        np.divide(delta * 100.0, old, out=change, where=both & (old > 0))
+
+        # Reads missing from a run go last, then the largest relative changes
+        order = np.lexsort((self.before.get_natural_ranks()[self.before_rows[rows]], -np.abs(change), ~both))
+
+        names = self.before.all_samples
+        results = []
+        for i in order.tolist():
+            row, read_slot = rows[i], read_slots[i]
+            gc = [None if value != value else value for value in (before_gc[row, read_slot], after_gc[row, read_slot])]
+            results.append([names[self.before_rows[row]].name, int(read_slot) + 1,
+                            int(old[i]) if old[i] >= 0 else None, int(new[i]) if new[i] >= 0 else None,
+                            int(delta[i]) if both[i] else None, round(change[i], 2) if both[i] and old[i] > 0 else None,
+                            gc[0], gc[1]])
+        return results
+
+    def get_tables(self):
+        """
+        Returns the whole comparison as results like QueryRunner.run()'s, to be printed with format_result().
+        """
+        unmatched = self.get_unmatched_samples()
+        changes = self.get_status_changes()
+        stat_changes = self.get_basic_stat_changes()
+
+        summary = [
+            ["samples in both", len(self.before_rows)],
+            ["only before", sum(1 for row in unmatched if row[1] == "before")],
+            ["only after", sum(1 for row in unmatched if row[1] == "after")],
+            ["status changes", len(changes)],
+            ["basic statistics changes", len(stat_changes)],
+        ]
+
+        return [
+            {"command": "diff summary", "columns": ["item", "count"], "rows": summary},
+            {"command": "diff unmatched samples", "columns": ["sample", "only_in"], "rows": unmatched},
+            {"command": "diff transitions", "columns": ["module", "before", "after", "reads"], "rows": self.get_transitions()},
+            {"command": "diff status changes", "columns": ["sample", "read", "module", "before", "after"], "rows": changes},
+            {"command": "diff basic statistics", "columns": ["sample", "read", "reads_before", "reads_after", "delta", "change_pct", "gc_before", "gc_after"],
+             "rows": stat_changes},
+        ]
+
+    def __init__(self, before, after):
+        self.before = before  # SampleManager of the first run
+        self.after = after  # SampleManager of the second run
+
+        # Do stuff
+        for sample_manager in (before, after):
+            sample_manager.load_statuses()
+        self.before_rows, self.after_rows = self.join()  # Rows of the shared samples in both runs
+        self.codes = self.get_aligned_codes()  # Format: (codes_before, codes_after, module_names)
@@ -1,263 +1,836 @@
 import os
+import re
 import zipfile
 import shutil
 import sys
+import tempfile
+import atexit
+import time
+import threading
+import functools
+from array import array
+from multiprocessing.pool import ThreadPool
+from cStringIO import StringIO
+import FastqcData
+import TarArchive
+from Timings import Timings
+from StatusIndex import STATUS_CODES, STATUS_NAMES
+
+# Lane and read number in FastQC zip-file names, e.g. P1234_S017_L002_R1_001_fastqc.zip
+LANE_PATTERN = re.compile(r"_L(\d+)(?=[_.])")
+READ_PATTERN = re.compile(r"_R([1-9])(?=[_.])")
+# Older naming without the R, e.g. sample1_1.zip or sample1_2_fastqc.zip
+SHORT_READ_PATTERN = re.compile(r"_([1-9])(?:_fastqc)?\.zip$")
+
+# Basic Statistics that are added up over lanes
+SUMMED_BASIC_STATS = ["Total Sequences", "Sequences flagged as poor quality"]
+
+# Basic Statistics that are kept, in the order they're stored in Sample.basic_stats. Lanes is added when lanes are merged
+BASIC_STATS = ["Filename", "File type", "Encoding", "Total Sequences", "Sequences flagged as poor quality", "Sequence length", "%GC", "Lanes"]
+
+# Status codes as single bytes, e.g. to count them in Sample.status_codes
+STATUS_BYTES = dict((status, chr(code)) for status, code in STATUS_CODES.items())
+
+# Every module name gets a small ID, shared by all samples. Known modules (of FastQC 0.10 and 0.11) are listed
+# in the order FastQC writes them, so they get the same IDs in every process. Others are added when they're found
+MODULE_NAMES = [
+    "Basic Statistics",
+    "Per base sequence quality",
+    "Per tile sequence quality",
+    "Per sequence quality scores",
+    "Per base sequence content",
+    "Per base GC content",
+    "Per sequence GC content",
+    "Per base N content",
+    "Sequence Length Distribution",
+    "Sequence Duplication Levels",
+    "Overrepresented sequences",
+    "Adapter Content",
+    "Kmer Content"
+]
+MODULE_IDS = dict((module, module_id) for module_id, module in enumerate(MODULE_NAMES))
+module_lock = threading.Lock()  # Lanes are read by several threads
+
+# Held while a sample is being loaded, so a sample that's loaded in the background and by a query at the
+# same time is only loaded once (see Sample.load())
+load_lock = threading.RLock()
+
+# Thread pool that reads the zip-files of lane-split samples (see Sample.ingest_lanes()), shared by all samples,
+# since starting and joining a pool for every sample costs more than reading its lanes. Format: (pid, ThreadPool)
+lane_pool = None
+lane_pool_lock = threading.Lock()
+
+
+def get_module_id(module):
+    """
+    Returns the ID of a module name, adding the module if it hasn't been seen before.
+    """
+    module_id = MODULE_IDS.get(module)
+    if module_id is None:
+        with module_lock:
+            if module not in MODULE_IDS:
+                MODULE_IDS[module] = len(MODULE_NAMES)
+                MODULE_NAMES.append(intern(module))
+            module_id = MODULE_IDS[module]
+    return module_id
+
+
+def get_lane_pool():
+    """
+    Returns the lane pool of this process, starting it on first use. Worker processes of --jobs get their own,
+    because the threads of a pool don't survive a fork.
+    """
+    global lane_pool
+    with lane_pool_lock:
+        if lane_pool is None or lane_pool[0] != os.getpid():
+            lane_pool = (os.getpid(), ThreadPool(Sample.max_lane_threads))
+        return lane_pool[1]
+
+
+def open_zip(zip_path):
+    """
+    Opens a FastQC zip-file, on disk or in a tar archive (see TarArchive), which is read from memory.
+    """
+    archive = TarArchive.find_archive(zip_path)
+    if archive is not None:
+        return zipfile.ZipFile(StringIO(archive.read_file(zip_path)), "r")
+    return zipfile.ZipFile(zip_path, "r")
+
+
+def list_zip_files(directory):
+    """
+    Returns the names of the zip-files in a sample directory, on disk or in a tar archive.
+    """
+    archive = TarArchive.find_archive(directory)
+    if archive is not None:
+        return archive.list_zip_files(directory)
+    return [f for f in os.listdir(directory) if f.endswith(".zip")]
+
+
+def get_read_order(samples):
+    """
+    Returns the indexes of samples in the order their zip-files are best read in, when every sample is read
+    (e.g. a module of all samples): samples in a tar archive in the order of the archive (see TarArchive.get_offset()),
+    so it's decompressed once rather than from a checkpoint for every sample. Samples on disk keep their order.
+    """
+    offsets = []
+    for sample in samples:
+        archive = TarArchive.find_archive(sample.main_directory)
+        offsets.append(archive.get_offset(sample.main_directory) if archive is not None else 0)
+    return sorted(range(len(samples)), key=offsets.__getitem__)
+
+
+def extract_html_report(zip_path, member, target_dir):
+    """
+    Extracts an HTML report and the images/icons it refers to (in the same directory of the zip-file),
+    unless it has been extracted before.
+    :param zip_path: FastQC zip-file
+    :param member: Path of the report in the zip-file, e.g. sample1_1_fastqc/fastqc_report.html
+    :param target_dir: Directory to extract to
+    :return html_path: Path of the extracted report
+    """
+    html_path = os.path.join(target_dir, member)
+
+    if not os.path.exists(html_path):
+        prefix = member.rsplit("/", 1)[0] + "/" if "/" in member else ""
+        zip_ref = open_zip(zip_path)
+        try:
+            members = [m for m in zip_ref.namelist() if m == member or m.startswith(prefix + "Images/") or m.startswith(prefix + "Icons/")]
+            zip_ref.extractall(target_dir, members)
+        finally:
+            zip_ref.close()
+
+    return html_path
+
+
+def get_read_keys(filenames):
+    """
+    Finds the (lane, read number) of every zip-file name. Lane is 0 if the name has no lane.
+    If the read number can't be found in every name, the files are numbered by their position
+    in the (sorted) list instead, one read per file.
+    :param filenames: Sorted list of zip-file names
+    :return keys: List of (lane, read_number) tuples, in the same order as filenames
+    """
+    keys = []
+
+    for f in filenames:
+        read_match = READ_PATTERN.search(f) or SHORT_READ_PATTERN.search(f)
+        if read_match is None:
+            # Fall back to position in list of zip-files
+            return [(0, pos + 1) for pos in range(len(filenames))]
+
+        lane_match = LANE_PATTERN.search(f)
+        lane = int(lane_match.group(1)) if lane_match else 0
+        keys.append((lane, int(read_match.group(1))))
+
+    return keys
+
+
+class Lane(object):
+    """
+    A single zip-file of a read. Reads that aren't split into lanes have one. Only the zip-file's name is kept,
+    the directory is the sample's. Module tables in fastqc_data.txt are found through self.sections.
+    """
+    __slots__ = ["lane", "zip_name", "members", "sections", "total", "statuses", "content"]
+
+    # Bits in self.members for the files FastQC writes
+    SUMMARY = 1
+    FASTQC_DATA = 2
+    HTML_REPORT = 4
+    member_files = [(SUMMARY, "summary.txt"), (FASTQC_DATA, "fastqc_data.txt"), (HTML_REPORT, "fastqc_report.html")]
+    member_names = dict(member_files)
+
+    @property
+    def dir(self):
+        # Directory inside the zip-file, e.g. sample1_1_fastqc
+        return self.zip_name.split(".zip")[0]
+
+    def get_member(self, flag):
+        """
+        Returns the path of summary.txt, fastqc_data.txt or the HTML report in the zip-file, or None if it's missing.
+        """
+        if not self.members & flag:
+            return None
+        return self.dir + "/" + self.member_names[flag]
+
+    @property
+    def summary_file(self):
+        return self.get_member(self.SUMMARY)
+
+    @property
+    def fastqc_data_file(self):
+        return self.get_member(self.FASTQC_DATA)
+
+    @property
+    def html_report(self):
+        return self.get_member(self.HTML_REPORT)
+
+    def set_sections(self, sections):
+        """
+        Stores where every module's table is in fastqc_data.txt.
+        :param sections: Dictionary {module_name: (status, start, end)}, see FastqcData.index_sections()
+        """
+        offsets = dict((get_module_id(module), (start, end)) for module, (status, start, end) in sections.items())
+        self.sections = array("i", [-1]) * (2 * (max(offsets.keys() or [-1]) + 1))
+        for module_id, (start, end) in offsets.items():
+            self.sections[2 * module_id] = start
+            self.sections[2 * module_id + 1] = end
+
+    def get_section(self, module_id):
+        """
+        Returns the (start, end) of a module's table in fastqc_data.txt, or None if the module isn't there.
+        """
+        if 2 * module_id >= len(self.sections) or self.sections[2 * module_id] == -1:
+            return None
+        return self.sections[2 * module_id], self.sections[2 * module_id + 1]
+
+    def __getstate__(self):
+        # Statuses and content are only used while loading
+        return self.lane, self.zip_name, self.members, self.sections, self.total
+
+    def __setstate__(self, state):
+        self.lane, self.zip_name, self.members, self.sections, self.total = state
+        self.statuses = None
+        self.content = None
+
+    def __init__(self, lane, zip_name):
+        self.lane = lane
+        self.zip_name = zip_name
+        self.members = 0  # Format: SUMMARY | FASTQC_DATA | HTML_REPORT, the files found in the zip-file
+        self.sections = array("i")  # Format: [start, end] per module ID, -1 if the module is missing
+        self.total = 0  # Total Sequences, to weigh lanes when merging module tables
+        self.statuses = None  # Format: [(module, status)] from summary.txt, only while loading
+        self.content = None  # Content of fastqc_data.txt, only while loading
 
 
 class Sample(object):
+    """
+    Statuses and Basic Statistics of a sample, stored compactly: all reads' statuses are one bytearray with a
+    status code (see StatusIndex.STATUS_CODES) per read and module ID, and Basic Statistics are tuples of
+    (interned) values. Paths are kept relative to the sample directory. The dictionaries of earlier versions
+    (passes, warnings, failures, modules, read_dirs, html_reports, ...) are properties derived from these.
+    """
+    __slots__ = ["name", "main_directory", "parent_dir", "read_numbers", "read_lanes", "status_codes", "basic_stats", "loaded", "timings"]
+
+    # Attributes that make up a parsed sample (see get_state() and from_state())
+    state_attributes = ["name", "main_directory", "parent_dir", "read_numbers", "read_lanes", "status_codes", "basic_stats"]
 
-    def handle_read_libraries(self):
+    # Private directory for HTML reports that have been extracted from zip-files (see get_report_cache_dir())
+    report_cache_dir = None
+
+    # Number of threads of the lane pool, which reads the zip-files of lane-split samples
+    max_lane_threads = 8
+
+    # Record the time, bytes read and files of every load phase in self.timings (see --timings)
+    record_timings = False
+
+    # How much of a sample has been loaded (self.loaded). Each level includes the ones before it
+    LOAD_PATHS = 0  # Only the sample's name and directory
+    LOAD_STATUSES = 1  # Zip-files, their members and the statuses in summary.txt
+    LOAD_ALL = 2  # Also Basic Statistics and module offsets from fastqc_data.txt
+
+    def handle_read_libraries(self, required=True):
         # TODO: Add to documentation that these zip-files are expected (required)
         # Find zipped files
-        zipped_files = [f for f in os.listdir(self.main_directory) if f.endswith(".zip")]
+        zipped_files = sorted(list_zip_files(self.main_directory))
 
-        # If no zip-files are found, exit
+        # If no zip-files are found, exit. Samples loaded on demand are left empty instead of ending the session
         if len(zipped_files) == 0:
+            if not required:
+                print "Warning: No zip-files containing FastQC info found in %s, the sample is left empty" % self.main_directory
+                return
             print "ERROR: No zip-files containing FastQC info found in %s. Exiting" % self.main_directory
             sys.exit()
 
-        # If there's more than 2 zip-files, I don't know what to do with them
-        if len(zipped_files) > 2:
-            print "ERROR: More than two (%d) zip-files found in %s. I don't know how to handle more than 2. Exiting." % (len(zipped_files), self.main_directory)
-            sys.exit()
+        # Group zip-files by read number. Lane-split samples have several zip-files per read
+        lanes = {}  # Format: {read_number: [Lane]}
+        for f, (lane, read_number) in zip(zipped_files, get_read_keys(zipped_files)):
+            lanes.setdefault(read_number, []).append(Lane(lane, f))
+
+        # The first lane represents the read, e.g. when opening the HTML report
+        self.read_numbers = tuple(sorted(lanes.keys()))
+        self.read_lanes = tuple(tuple(sorted(lanes[read_number], key=lambda l: (l.lane, l.zip_name))) for read_number in self.read_numbers)
+
+    def get_lanes(self, read_number):
+        """
+        Returns the lanes (zip-files) of a read, an empty tuple if there is no such read.
+        """
+        self.require(self.LOAD_STATUSES)
+        if read_number not in self.read_numbers:
+            return ()
+        return self.read_lanes[self.read_numbers.index(read_number)]
+
+    def get_zip_path(self, lane):
+        return os.path.join(self.main_directory, lane.zip_name)
+
+    def read_zip_member(self, zip_path, member):
+        """
+        Reads the content of a file inside a zip-file, without extracting it.
+        """
+        zip_ref = open_zip(zip_path)
+        try:
+            return zip_ref.read(member)
+        finally:
+            zip_ref.close()
+
+    def ingest_lane(self, lane, read_summary=True, read_data=True):
+        """
+        Reads summary.txt and/or fastqc_data.txt of a single zip-file, and stores the results in the lane.
+        Only the zip-file's member list and these two files are read, nothing is extracted to disk.
+        :return bytes_read: Compressed size of the files that were read
+        """
+        bytes_read = 0
+        zip_ref = open_zip(self.get_zip_path(lane))
+        try:
+            members = set(zip_ref.namelist())
+
+            # Expected paths
+            for flag, filename in Lane.member_files:
+                if lane.dir + "/" + filename in members:
+                    lane.members |= flag
+
+            # Statuses as a list of (module, status)
+            lane.statuses = []
+            if read_summary and lane.summary_file is not None:
+                bytes_read += zip_ref.getinfo(lane.summary_file).compress_size
+                for line in zip_ref.read(lane.summary_file).splitlines():
+                    # Split by tabs to get: PASS/WARN/FAIL MODULE FASTQ-file
+                    stats = line.split("\t")
 
-        # Handle zip files
-        for f in sorted(zipped_files):
-            # Get sample dir path
-            sample_path = os.path.join(self.parent_dir, self.main_directory)
+                    # Sanity check results
+                    if len(stats) < 2:
+                        continue
 
-            # Get absolute path
-            abs_path = os.path.abspath(os.path.join(sample_path, f))
+                    lane.statuses.append((stats[1], stats[0]))
 
-            # Unzip file
-            zip_ref = zipfile.ZipFile(abs_path, "r")
+            # Index where every module's table is, the tables are decoded on demand (see get_module_table())
+            lane.content = ""
+            if read_data and lane.fastqc_data_file is not None:
+                bytes_read += zip_ref.getinfo(lane.fastqc_data_file).compress_size
+                lane.content = zip_ref.read(lane.fastqc_data_file)
+                lane.set_sections(FastqcData.index_sections(lane.content))
+        finally:
+            zip_ref.close()
 
-            # Get unzipped dirname
-            unzipped_dirname = abs_path.split(".zip")[0]
+        return bytes_read
 
-            # Delete unzipped dir if already exists
-            if os.path.exists(unzipped_dirname) and os.path.isdir(unzipped_dirname):
-                shutil.rmtree(unzipped_dirname)
+    def ingest_lanes(self, read_summary=True, read_data=True):
+        """
+        Reads every zip-file of this sample. Samples with more than two zip-files (lane-split samples)
+        are read with the shared lane pool (see get_lane_pool()).
+        :return (bytes_read, files): Compressed bytes read and number of zip-files
+        """
+        all_lanes = [lane for lanes in self.read_lanes for lane in lanes]
+        ingest_lane = functools.partial(self.ingest_lane, read_summary=read_summary, read_data=read_data)
 
-            # Extract content
-            zip_ref.extractall(sample_path)
+        if len(all_lanes) <= 2:
+            return sum(ingest_lane(lane) for lane in all_lanes), len(all_lanes)
 
-            # Assign read-number according to position in list of zip-files
-            pos = sorted(zipped_files).index(f) + 1
-            self.read_dirs[pos] = unzipped_dirname
+        return sum(get_lane_pool().map(ingest_lane, all_lanes)), len(all_lanes)
 
     def locate_summary_files(self):
-        # Traverse read directories and find summary files
-        for read_number, read_dir in self.read_dirs.items():
+        # Report zip-files without a summary file. The first lane's is used for the read
+        for lanes in self.read_lanes:
+            for lane in lanes:
+                if lane.summary_file is None:
+                    print "No summary file found in %s in sample %s" % (lane.dir, self.name)
+
+    def locate_fastq_data_files(self):
+        # Report zip-files without fastqc_data.txt
+        for lanes in self.read_lanes:
+            for lane in lanes:
+                if lane.fastqc_data_file is None:
+                    print "No fastqc_data.txt found in %s in sample %s" % (lane.dir, self.name)
+
+    def locate_html_reports(self):
+        # Report reads without an HTML report (in the first lane)
+        for read_number, lanes in zip(self.read_numbers, self.read_lanes):
+            if lanes[0].html_report is None:
+                print "No HTML report file found for read file %d in sample %s" % (read_number, self.name)
+
+    def parse_summaries(self):
+        """
+        Stores the status of every read and module in self.status_codes. Lanes are rolled up into
+        one status per module: the worst status in any lane (codes are ordered PASS < WARN < FAIL).
+        """
+        # Every read gets a row of one code per module ID
+        module_ids = [[(get_module_id(module), STATUS_CODES.get(status, 0)) for module, status in lane.statuses]
+                      for lanes in self.read_lanes for lane in lanes]
+        num_modules = len(MODULE_NAMES)
+        self.status_codes = bytearray(len(self.read_numbers) * num_modules)
+
+        lane_number = 0
+        for read_index, lanes in enumerate(self.read_lanes):
+            row = read_index * num_modules
+            for lane in lanes:
+                for module_id, code in module_ids[lane_number]:
+                    if code > self.status_codes[row + module_id]:
+                        self.status_codes[row + module_id] = code
+                lane.statuses = None
+                lane_number += 1
+
+    def get_module_stride(self):
+        """
+        Returns the number of module IDs in each read's row of self.status_codes.
+        """
+        if len(self.read_numbers) == 0:
+            return 0
+        return len(self.status_codes) // len(self.read_numbers)
 
-            # Get sample path
-            sample_path = os.path.join(self.parent_dir, self.main_directory)
+    def get_statuses(self):
+        """
+        Returns every status of this sample as a list of (read_number, module, status), ordered by read and module ID.
+        """
+        self.require(self.LOAD_STATUSES)
+        stride = self.get_module_stride()
+        statuses = []
+        for read_index, read_number in enumerate(self.read_numbers):
+            row = read_index * stride
+            for module_id in range(stride):
+                code = self.status_codes[row + module_id]
+                if code:
+                    statuses.append((read_number, MODULE_NAMES[module_id], STATUS_NAMES[code]))
+        return statuses
+
+    @property
+    def modules(self):
+        # Format: {module_name: {read_num: status}}
+        modules = {}
+        for read_number, module, status in self.get_statuses():
+            modules.setdefault(module, {})[read_number] = status
+        return modules
+
+    @property
+    def passes(self):
+        # Format: {read_number: [modules]}, same for warnings and failures
+        return self.get_collection_by_status("PASS")
+
+    @property
+    def warnings(self):
+        return self.get_collection_by_status("WARN")
+
+    @property
+    def failures(self):
+        return self.get_collection_by_status("FAIL")
+
+    def parse_basic_statistics(self, content, lane):
+        """
+        Returns the Basic Statistics of a single fastqc_data.txt file as a dictionary {info_name: value}.
+        :param content: Content of fastqc_data.txt
+        :param lane: Lane the file belongs to, with the module offsets in the file (see Lane.get_section())
+        """
+        # Overview of data we want to keep
+        keep_data = BASIC_STATS[:-1]
+
+        data = {}
+
+        # Only Basic Statistics is parsed right away
+        section = lane.get_section(MODULE_IDS["Basic Statistics"])
+        if section is not None:
+            start, end = section
+            content = content[start:end]
+
+        # Read each line
+        for line in content.splitlines():
 
-            # Get absolute path
-            abs_read_dir = os.path.join(sample_path, read_dir)
+            # Split line by tabs
+            stats = line.split("\t")
 
-            # Expected path
-            summary_path = os.path.join(abs_read_dir, "summary.txt")
-            if not os.path.exists(summary_path):
-                print "No summary file found in %s in sample %s" % (read_dir, self.name)
+            # Sanity check results
+            if len(stats) < 2:
                 continue
-            else:
-                # Store reference to summary file
-                if read_number not in self.summary_files.keys():
-                    self.summary_files[read_number] = summary_path
-                else:
-                    print "Summary file for read %d already present in sample %s" % (read_number, self.name)
 
-    def locate_fastq_data_files(self):
-        # Traverse read directories and find fastq_data files
-        for read_number, read_dir in self.read_dirs.items():
+            # Get info and description
+            info = stats[0].rstrip()
+            value = stats[1].rstrip()
+
+            # Keep data if there's something we're intrested in
+            if info in keep_data:
+                data[info] = value
+
+        return data
 
-            # Get sample path
-            sample_path = os.path.join(self.parent_dir, self.main_directory)
+    def parse_fastqc_data(self):
+        """
+        Stores the (merged) Basic Statistics of every read in self.basic_stats, as tuples in the order of BASIC_STATS.
+        Values other than file names are interned, since most are the same in every sample.
+        """
+        basic_stats = []
+
+        # Loop reads
+        for lanes in self.read_lanes:
+            lane_data = []
+            for lane in lanes:
+                # The file content is not kept, only the module offsets
+                content = lane.content or ""
+                lane.content = None
 
-            # Get absolute path
-            abs_read_dir = os.path.join(sample_path, read_dir)
+                if lane.fastqc_data_file is None:
+                    continue
 
-            # Expected path
-            fastqc_data_path = os.path.join(abs_read_dir, "fastqc_data.txt")
-            if not os.path.exists(fastqc_data_path):
-                print "No fastqc_data.txt found in %s in sample %s" % (read_dir, self.name)
+                data = self.parse_basic_statistics(content, lane)
+                lane_data.append(data)
+
+                # Keep the read count of every lane, to weigh lanes when merging module tables
+                lane.total = int(data.get("Total Sequences", 0))
+
+            if len(lane_data) == 0:
+                basic_stats.append(None)
                 continue
-            else:
-                # Store reference to fastqc data file
-                if read_number not in self.fastqc_data_files.keys():
-                    self.fastqc_data_files[read_number] = fastqc_data_path
-                else:
-                    print "Fastq data file for read %d already present in sample %s" % (read_number, self.name)
 
-    def locate_html_reports(self):
-        # Traverse read directories and find report files
-        for read_number, read_dir in self.read_dirs.items():
+            data = self.merge_basic_statistics(lane_data)
+            basic_stats.append(tuple(None if info not in data else data[info] if info == "Filename" else intern(data[info]) for info in BASIC_STATS))
 
-            # Get sample path
-            sample_path = os.path.join(self.parent_dir, self.main_directory)
+        self.basic_stats = tuple(basic_stats)
 
-            # Get absolute path
-            abs_read_dir = os.path.join(sample_path, read_dir)
+    @property
+    def fastqc_data(self):
+        # Format: {read_number: {info_name: value}}
+        self.require(self.LOAD_ALL)
+        fastqc_data = {}
+        for read_number, values in zip(self.read_numbers, self.basic_stats):
+            if values is not None:
+                fastqc_data[read_number] = dict((info, value) for info, value in zip(BASIC_STATS, values) if value is not None)
+        return fastqc_data
 
-            # Expected path
-            html_path = os.path.join(abs_read_dir, "fastqc_report.html")
-            if not os.path.exists(html_path):
-                print "No HTML report file found for read file %d in sample %s" % (read_number, self.name)
-            else:
-                # Store reference to report file
-                if read_number not in self.html_reports.keys():
-                    self.html_reports[read_number] = html_path
-                else:
-                    print "Report file already present for read %d in sample %s" % (read_number, self.name)
+    def merge_basic_statistics(self, lane_data):
+        """
+        Rolls the Basic Statistics of several lanes up into one: read counts are added up, %GC is
+        averaged (weighted by read count) and sequence lengths are combined into a range.
+        """
+        if len(lane_data) == 1:
+            return lane_data[0]
 
-    def parse_summaries(self):
+        merged = dict(lane_data[0])
+        totals = [int(d.get("Total Sequences", 0)) for d in lane_data]
 
-        # Loop summary files
-        for read_num, sum_file in self.summary_files.items():
-            # Read summary file
-            with open(sum_file) as sf:
-                # Read each line
-                for line in sf.readlines():
-                    # Split by tabs to get: PASS/WARN/FAIL MODULE FASTQ-file
-                    stats = line.split("\t")
-                    status = stats[0]
-                    module = stats[1]
-
-                    # Update module information
-                    if module not in self.modules.keys():
-                        self.modules[module] = {read_num: status}
-                    else:
-                        # Check if read_num is not already in there
-                        if read_num not in self.modules[module].keys():
-                            self.modules[module][read_num] = status
-
-                    # Update status
-                    if status == "WARN":
-                        if read_num not in self.warnings.keys():
-                            self.warnings[read_num] = [module]
-                        else:
-                            self.warnings[read_num].append(module)
-                    elif status == "PASS":
-                        if read_num not in self.passes.keys():
-                            self.passes[read_num] = [module]
-                        else:
-                            self.passes[read_num].append(module)
-                    elif status == "FAIL":
-                        if read_num not in self.failures:
-                            self.failures[read_num] = [module]
-                        else:
-                            self.failures[read_num].append(module)
+        for info in SUMMED_BASIC_STATS:
+            if all(info in d for d in lane_data):
+                merged[info] = str(sum(int(d[info]) for d in lane_data))
 
-    def parse_fastqc_data(self):
+        if all("%GC" in d for d in lane_data) and sum(totals) > 0:
+            gc = sum(float(d["%GC"]) * t for d, t in zip(lane_data, totals)) / sum(totals)
+            merged["%GC"] = str(int(round(gc)))
 
-        # Container to store data
-        container = {}
+        lengths = []
+        for d in lane_data:
+            lengths += [int(l) for l in d.get("Sequence length", "").split("-") if l.isdigit()]
+        if lengths:
+            low, high = min(lengths), max(lengths)
+            merged["Sequence length"] = str(low) if low == high else "%d-%d" % (low, high)
 
-        # Overview of data we want to keep
-        keep_data = ["Filename", "File type", "Encoding", "Total Sequences", "Sequences flagged as poor quality", "Sequence length", "%GC"]
+        merged["Filename"] = ", ".join(d.get("Filename", "") for d in lane_data)
+        merged["Lanes"] = str(len(lane_data))
 
-        # Loop fastq data files
-        for read_num, data_file in self.fastqc_data_files.items():
+        return merged
 
-            # Add read to container
-            container[read_num] = {}
+    def get_module_table(self, read_number, module_name):
+        """
+        Decodes the table of a module in fastqc_data.txt, e.g. "Per base sequence quality", into numpy arrays.
+        Only this module is decoded, using the offsets found when the sample was loaded. For lane-split
+        reads, the tables of all lanes are merged (see FastqcData.merge_tables()).
+        :return table: FastqcData.ModuleTable, or None if the module (or numpy) is not available
+        """
+        self.require(self.LOAD_ALL)
+        module_id = MODULE_IDS.get(module_name)
+        if module_id is None:
+            return None
 
-            # Read data file
-            with open(data_file) as f:
-                # Read each line
-                for line in f.readlines():
+        tables = []
+        weights = []
 
-                    # Split line by tabs
-                    stats = line.split("\t")
+        for lane in self.get_lanes(read_number):
+            section = lane.get_section(module_id)
+            if section is None:
+                continue
 
-                    # Sanity check results
-                    if len(stats) < 2:
-                        continue
+            start, end = section
+            content = self.read_zip_member(self.get_zip_path(lane), lane.fastqc_data_file)
+            table = FastqcData.parse_table(content[start:end])
+            if table is None:
+                return None
+
+            tables.append(table)
+            weights.append(lane.total)
 
-                    # Get info and description
-                    info = stats[0].rstrip()
-                    value = stats[1].rstrip()
+        if len(tables) == 0:
+            return None
+        if len(tables) == 1:
+            return tables[0]
 
-                    # Keep data if there's something we're intrested in
-                    if info in keep_data:
-                        container[read_num][info] = value
+        return FastqcData.merge_tables(tables, weights)
 
-        # Store container to self.fastqc_data
-        self.fastqc_data = container
+    def has_module_data(self, read_number):
+        """
+        Returns True if fastqc_data.txt was found for a read.
+        """
+        lanes = self.get_lanes(read_number)
+        return len(lanes) > 0 and lanes[0].fastqc_data_file is not None
+
+    def get_zip_files(self):
+        """
+        Returns every zip-file of this sample as a list of (read_number, zip_path), including all lanes.
+        """
+        self.require(self.LOAD_STATUSES)
+        return [(read_number, self.get_zip_path(lane)) for read_number, lanes in zip(self.read_numbers, self.read_lanes) for lane in lanes]
+
+    def get_first_lane_files(self, get_file):
+        """
+        Returns {read_number: file} for the first lane of every read, leaving out reads where get_file() returns None.
+        """
+        self.require(self.LOAD_STATUSES)
+        files = {}
+        for read_number, lanes in zip(self.read_numbers, self.read_lanes):
+            f = get_file(lanes[0])
+            if f is not None:
+                files[read_number] = f
+        return files
+
+    @property
+    def read_dirs(self):
+        # Format: {read_number: directoryName}, e.g. 2:sample1_2_fastqc (directory inside the zip-file)
+        return self.get_first_lane_files(lambda lane: lane.dir)
+
+    @property
+    def read_zips(self):
+        # Format: {read_number: path_to_zip_file}, the first lane if a read is split into lanes
+        return self.get_first_lane_files(self.get_zip_path)
+
+    @property
+    def summary_files(self):
+        # Format: {read_number: member_name}, paths are relative to the zip-file
+        return self.get_first_lane_files(lambda lane: lane.summary_file)
+
+    @property
+    def fastqc_data_files(self):
+        return self.get_first_lane_files(lambda lane: lane.fastqc_data_file)
+
+    @property
+    def html_reports(self):
+        return self.get_first_lane_files(lambda lane: lane.html_report)
+
+    @classmethod
+    def get_report_cache_dir(cls):
+        """
+        Returns a private temporary directory where HTML reports are extracted when they're opened.
+        The directory is created on first use and deleted when the program exits.
+        """
+        if cls.report_cache_dir is None:
+            cls.report_cache_dir = tempfile.mkdtemp(prefix="fastqc_browser_")
+            atexit.register(shutil.rmtree, cls.report_cache_dir, True)
+        return cls.report_cache_dir
 
     def get_html_report(self, read_number):
+        """
+        Returns the path to the HTML report for a given read number. The report (and the images
+        it refers to) is extracted from the zip-file into the report cache the first time it's requested.
+        """
         # TODO: Sanity check
-        return self.html_reports[read_number]
+        lane = self.get_lanes(read_number)[0]
+
+        # Every sample and read gets its own directory in the cache
+        target_dir = os.path.join(self.get_report_cache_dir(), self.name, str(read_number))
+        return extract_html_report(self.get_zip_path(lane), lane.html_report, target_dir)
 
     def get_number_of_passes(self):
         # Add together number of passes for both read files
-        total = 0
-        for read_num, modules in self.passes.items():
-            total += len(modules)
-        return total
+        self.require(self.LOAD_STATUSES)
+        return self.status_codes.count(STATUS_BYTES["PASS"])
 
     def get_number_of_warnings(self):
-        # Add together number of passes for both read files
-        total = 0
-        for read_num, modules in self.warnings.items():
-            total += len(modules)
-        return total
+        self.require(self.LOAD_STATUSES)
+        return self.status_codes.count(STATUS_BYTES["WARN"])
 
     def get_number_of_failures(self):
-        # Add together number of passes for both read files
-        total = 0
-        for read_num, modules in self.failures.items():
-            total += len(modules)
-        return total
+        self.require(self.LOAD_STATUSES)
+        return self.status_codes.count(STATUS_BYTES["FAIL"])
 
     def get_status_count(self, status_query):
-        if status_query.lower() == "pass":
-            return self.get_number_of_passes()
-        if status_query.lower() == "warn":
-            return self.get_number_of_warnings()
-        if status_query.lower() == "fail":
-            return self.get_number_of_failures()
+        self.require(self.LOAD_STATUSES)
+        if status_query.upper() in STATUS_BYTES:
+            return self.status_codes.count(STATUS_BYTES[status_query.upper()])
 
     def get_collection_by_status(self, status):
-        if status.lower() == "pass":
-            return self.passes
-        if status.lower() == "warn":
-            return self.warnings
-        if status.lower() == "fail":
-            return self.failures
+        """
+        Returns the modules with a given status per read, as {read_number: [modules]} (ordered by module ID).
+        """
+        if status.upper() not in STATUS_CODES:
+            return None
+
+        collection = {}
+        for read_number, module, module_status in self.get_statuses():
+            if module_status == status.upper():
+                collection.setdefault(read_number, []).append(module)
+        return collection
 
     def get_number_of_reads(self):
         """
         Returns the number of reads in each FASTQ-file (as a list).
         """
+        return [num_reads for read_number, num_reads in self.get_number_of_reads_by_read()]
+
+    def get_number_of_reads_by_read(self):
+        """
+        Returns the number of reads in each FASTQ-file that has Basic Statistics.
+        :return num_reads: Format: [(read_number, num_reads)]
+        """
 
         num_reads = []
 
         # Loop FASTQs
-        for read_num, data in self.fastqc_data.items():
-            num_reads.append(int(data["Total Sequences"]))  # Cast it to int
+        self.require(self.LOAD_ALL)
+        total_index = BASIC_STATS.index("Total Sequences")
+        for read_number, values in zip(self.read_numbers, self.basic_stats):
+            if values is not None:
+                num_reads.append((read_number, int(values[total_index])))  # Cast it to int
 
         return num_reads
 
-    def __init__(self, sample_dir, parent_dir):
+    def load(self, level, required=False):
+        """
+        Loads the sample up to a level (see LOAD_STATUSES and LOAD_ALL), skipping what has been loaded already.
+        Samples created with lazy=True are loaded by the first method that needs the data (see require()),
+        or in the background (see SampleManager.load_in_background()).
+        :param required: Exit if the sample has no zip-files, rather than leaving it empty
+        """
+        with load_lock:
+            if self.loaded >= level:
+                return
+
+            read_data = level >= self.LOAD_ALL
+            if self.loaded < self.LOAD_STATUSES:
+                # Everything is read in one go when both levels are needed
+                self.run_step("list zip-files", lambda: self.handle_read_libraries(required))
+                self.run_step("read zip-files", lambda: self.ingest_lanes(True, read_data))
+                self.run_step("locate members", self.locate_summary_files)
+                self.run_step("locate members", self.locate_html_reports)
+                self.run_step("parse summaries", self.parse_summaries)
+                self.loaded = self.LOAD_STATUSES
+            elif read_data:
+                self.run_step("read zip-files", lambda: self.ingest_lanes(False, True))
+
+            if read_data:
+                self.run_step("locate members", self.locate_fastq_data_files)
+                self.run_step("parse fastqc_data", self.parse_fastqc_data)
+                self.loaded = self.LOAD_ALL
+
+    def require(self, level):
+        """
+        Makes sure the sample is loaded up to a level, called by every method that reads the sample's data.
+        """
+        if self.loaded < level:
+            self.load(level)
+
+    def run_step(self, phase, method):
+        """
+        Runs one step of loading the sample, and times it if timings are recorded.
+        Steps that read files return (bytes_read, files), the rest return None.
+        """
+        if self.timings is None:
+            method()
+            return
+
+        start = time.time()
+        counts = method() or (0, 0)
+        self.timings.add(phase, time.time() - start, *counts)
+
+    def get_state(self):
+        """
+        Returns the parsed data of this sample as a dictionary of plain containers, e.g. to send it
+        between processes. Use Sample.from_state() to turn it back into a sample. Module IDs are only
+        the same within a process, so the state includes the module names they stand for.
+        """
+        self.require(self.LOAD_ALL)
+        state = dict((attr, getattr(self, attr)) for attr in self.state_attributes)
+        state["module_names"] = tuple(MODULE_NAMES)
+        return state
+
+    def remap_module_ids(self, module_names):
+        """
+        Translates the module IDs of a sample from another process (which named its modules module_names) to this process'.
+        """
+        new_ids = [get_module_id(module) for module in module_names]
+        old_stride = self.get_module_stride()
+        new_stride = len(MODULE_NAMES)
+
+        status_codes = bytearray(len(self.read_numbers) * new_stride)
+        for read_index in range(len(self.read_numbers)):
+            for old_id in range(old_stride):
+                status_codes[read_index * new_stride + new_ids[old_id]] = self.status_codes[read_index * old_stride + old_id]
+        self.status_codes = status_codes
+
+        for lanes in self.read_lanes:
+            for lane in lanes:
+                sections = lane.sections
+                lane.set_sections(dict((module_names[i // 2], (None, sections[i], sections[i + 1])) for i in range(0, len(sections), 2) if sections[i] != -1))
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Creates a sample from a dictionary returned by get_state(), without touching the zip-files.
+        """
+        sample = cls.__new__(cls)
+        for attr in cls.state_attributes:
+            setattr(sample, attr, state[attr])
+        sample.timings = None
+        sample.loaded = cls.LOAD_ALL
+
+        module_names = state["module_names"]
+        if module_names != tuple(MODULE_NAMES[:len(module_names)]):
+            sample.remap_module_ids(module_names)
+        return sample
+
+    def __init__(self, sample_dir, parent_dir, lazy=False):
         self.name = os.path.basename(os.path.normpath(sample_dir))
-        self.main_directory = sample_dir
-        self.parent_dir = parent_dir
-        self.read_dirs = {}  # Format: {read_number: directoryName}, e.g. 2:path_to_fastq2
-        self.summary_files = {}
-        self.fastqc_data_files = {}
-        self.fastqc_data = {}  # Format: {read_number: {info_name: value}}
-        self.html_reports = {}
-        self.warnings = {}  # Format: {read_number: [modules]}
-        self.passes = {}
-        self.failures = {}
-        self.modules = {}  # Format: {module_name: {read_num: status}}
-
-        # Do stuff
-        self.handle_read_libraries()
-        self.locate_summary_files()
-        self.locate_html_reports()
-        self.parse_summaries()
-        self.locate_fastq_data_files()
-        self.parse_fastqc_data()
+        self.main_directory = os.path.abspath(os.path.join(parent_dir, sample_dir))
+        self.parent_dir = intern(parent_dir)  # The same for every sample
+        self.read_numbers = ()  # Format: (read_number, ...), sorted
+        self.read_lanes = ()  # Format: ((Lane, ...), ...), the lanes of every read in self.read_numbers, sorted by lane
+        self.status_codes = bytearray()  # Format: status code per module ID, one row of len(MODULE_NAMES) per read
+        self.basic_stats = ()  # Format: (values, ...), a tuple in the order of BASIC_STATS for every read (None without fastqc_data.txt)
+        self.loaded = self.LOAD_PATHS
+        self.timings = Timings() if self.record_timings else None  # Only kept while loading, not part of the state
+
+        # Do stuff, unless the sample is loaded on demand
+        if not lazy:
+            self.load(self.LOAD_ALL, required=True)
@@ -0,0 +1,160 @@
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+
+
+def get_zip_fingerprint(sample_path, use_hashing=False):
+    """
+    Returns a fingerprint of the zip-files in a sample directory, as a tuple of (path, size, mtime[, md5]) tuples.
+    :param sample_path: Path to the sample directory
+    :param use_hashing: Add an MD5 of each zip-file's content (means reading every zip-file)
+    """
+    fingerprint = []
+
+    for f in sorted(os.listdir(sample_path)):
+        if not f.endswith(".zip"):
+            continue
+
+        zip_path = os.path.join(sample_path, f)
+        stat = os.stat(zip_path)
+        entry = (zip_path, stat.st_size, stat.st_mtime)
+
+        if use_hashing:
+            entry += (get_md5(zip_path),)
+
+        fingerprint.append(entry)
+
+    return tuple(fingerprint)
+
+
+def get_md5(path):
+    """
+    Returns the MD5 hex digest of a file, read in chunks.
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), ""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class SampleCache(object):
+    """
+    On-disk cache of parsed samples, so unchanged samples don't have to be parsed again on the next launch.
+    Every entry is keyed by the sample directory and a fingerprint of its zip-files (path, size and mtime,
+    and optionally an MD5 of the content). Entries whose fingerprint has changed are ignored and re-parsed.
+    """
+
+    # Bump this when the content of Sample.get_state() changes, old cache files are then ignored
+    version = 4
+
+    # Name of the cache file inside the cache directory
+    filename = "samples.pickle"
+
+    def get_fingerprint(self, sample_path):
+        """
+        Returns the fingerprint that cache entries for a sample directory are validated against.
+        """
+        return get_zip_fingerprint(sample_path, self.use_hashing)
+
+    def get(self, sample_path, fingerprint):
+        """
+        Returns the cached state of a sample (see Sample.get_state()), or None if it's missing or outdated.
+        """
+        entry = self.entries.get(sample_path)
+        if entry is None or entry[0] != fingerprint:
+            return None
+
+        # Keep this entry when the cache is saved
+        self.updated_entries[sample_path] = entry
+        return entry[1]
+
+    def put(self, sample_path, fingerprint, state):
+        """
+        Stores the state of a sample in the cache. Call save() to write it to disk.
+        """
+        self.updated_entries[sample_path] = (fingerprint, state)
+        self.modified = True
+
+    def put_sample(self, sample_path, fingerprint, sample):
+        """
+        Stores a sample that is loaded on demand (see Sample(lazy=True)). Its state is taken when the cache is
+        saved, samples that haven't been fully loaded by then are left out.
+        """
+        self.pending_samples[sample_path] = (fingerprint, sample)
+
+    def load(self):
+        """
+        Reads the cache file, if there is one. Unreadable or outdated cache files are ignored.
+        """
+        if not os.path.exists(self.path):
+            return
+
+        # A corrupt or foreign pickle can fail in many ways, the cache is only an optimisation
+        try:
+            with open(self.path, "rb") as f:
+                content = pickle.load(f)
+            if content.get("version") != self.version:
+                return
+            entries = dict(content["samples"])
+        except (IOError, EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError, ImportError, IndexError, KeyError) as e:
+            print "Warning: Ignoring unreadable sample cache %s (%s)" % (self.path, e)
+            return
+
+        self.entries = entries
+
+    def save(self):
+        """
+        Writes the samples that were used in this session to the cache file. Samples that have disappeared
+        from the input directory are dropped. The file is replaced atomically, so concurrent sessions never
+        read a half-written cache.
+        """
+        for sample_path, (fingerprint, sample) in self.pending_samples.items():
+            if sample.loaded == sample.LOAD_ALL and len(sample.read_numbers) > 0:
+                self.put(sample_path, fingerprint, sample.get_state())
+                del self.pending_samples[sample_path]
+
+        if not self.modified and len(self.updated_entries) == len(self.entries):
+            return
+
+        content = {"version": self.version, "samples": self.updated_entries}
+
+        tmp_path = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".samples_")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(content, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            print "Warning: Could not write sample cache %s (%s)" % (self.path, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self.entries = dict(self.updated_entries)
+        self.modified = False
+
+    @staticmethod
+    def get_default_cache_dir(parent_dir):
+        """
+        Returns the default cache directory for an input directory: one directory per input directory
+        under $XDG_CACHE_HOME/fastqc_browser (or ~/.cache/fastqc_browser).
+        """
+        base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        key = hashlib.md5(os.path.abspath(parent_dir)).hexdigest()
+        return os.path.join(base_dir, "fastqc_browser", key)
+
+    def __init__(self, cache_dir, use_hashing=False):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, self.filename)
+        self.use_hashing = use_hashing
+        self.entries = {}  # Format: {sample_path: (fingerprint, state)}
+        self.updated_entries = {}  # Entries used or added in this session, these are the ones that get saved
+        self.pending_samples = {}  # Format: {sample_path: (fingerprint, Sample)}, samples added with put_sample()
+        self.modified = False
+
+        # Do stuff
+        self.load()
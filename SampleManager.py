@@ -1,5 +1,29 @@
 import sys
 import re
+import bisect
+import threading
+from Sample import Sample, BASIC_STATS
+from MetricStore import MetricStore, find_position
+import StatusIndex
+import ReadCounts
+import OutlierEngine
+from TableRenderer import TableRenderer
+
+# numpy is optional, metrics by position can't be printed without it (see MetricStore)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Splits names into digit and non-digit parts for natural sorting (sample2 before sample10)
+NATURAL_SORT_PATTERN = re.compile(r"(\d+)")
+
+
+def get_natural_sort_key(name):
+    """
+    Returns a key that sorts names naturally, e.g. sample2 before sample10.
+    """
+    return [int(t) if t.isdigit() else t.lower() for t in NATURAL_SORT_PATTERN.split(name)]
 
 
 class SampleManager(object):
@@ -9,6 +33,14 @@ class SampleManager(object):
         Find the global number of passes, warnings and failures
         """
 
+        # One reduction over the status index
+        if self.status_index is not None:
+            counts = self.status_index.count_by_status()
+            self.num_passes = int(counts[StatusIndex.STATUS_CODES["PASS"]])
+            self.num_warnings = int(counts[StatusIndex.STATUS_CODES["WARN"]])
+            self.num_failures = int(counts[StatusIndex.STATUS_CODES["FAIL"]])
+            return
+
         # Counters
         num_passes = 0
         num_warnings = 0
@@ -32,6 +64,16 @@ class SampleManager(object):
         # Container to store data.
         module_stats = {}  # Format: moduleName: {status: counts}
 
+        # One reduction over the status index
+        if self.status_index is not None:
+            counts = self.status_index.count_by_module()
+            for module_id, module in enumerate(self.status_index.module_names):
+                module_counts = dict((status, int(counts[module_id, code])) for status, code in StatusIndex.STATUS_CODES.items())
+                if sum(module_counts.values()) > 0:
+                    module_stats[module] = module_counts
+            self.module_stats = module_stats
+            return
+
         # Loop through all samples
         for sample in self.all_samples:
             # Loop through passes
@@ -67,6 +109,181 @@ class SampleManager(object):
         # Store
         self.module_stats = module_stats
 
+    def update_stats(self, sample, sign):
+        """
+        Adds (sign=1) or subtracts (sign=-1) the statuses of a single sample to/from the global and
+        per-module stats, so they can be kept up to date without looping through all samples.
+        """
+        self.num_passes += sign * sample.get_number_of_passes()
+        self.num_warnings += sign * sample.get_number_of_warnings()
+        self.num_failures += sign * sample.get_number_of_failures()
+
+        for status in ["PASS", "WARN", "FAIL"]:
+            for read_num, modules in sample.get_collection_by_status(status).items():
+                for module in modules:
+                    if module not in self.module_stats:
+                        self.module_stats[module] = {"PASS": 0, "WARN": 0, "FAIL": 0}
+                    self.module_stats[module][status] += sign
+
+    def register_sample(self, sample):
+        """
+        Adds a sample to the name index and the ranked views (see get_ranked_samples()).
+        """
+        sort_key = get_natural_sort_key(sample.name)
+        self.samples_by_name[sample.name.lower()] = sample
+        self.sort_keys[sample.name] = sort_key
+
+        # Ranked views are built with the other aggregates (see load_statuses())
+        if not self.statuses_loaded:
+            return
+
+        counts = {"PASS": sample.get_number_of_passes(), "WARN": sample.get_number_of_warnings(), "FAIL": sample.get_number_of_failures()}
+        self.status_counts[sample.name] = counts
+
+        for status, ranking in self.ranked_samples.items():
+            bisect.insort(ranking, (-counts[status], sort_key, sample.name))
+
+    def unregister_sample(self, sample):
+        """
+        Removes a sample from the name index and the ranked views.
+        """
+        sort_key = self.sort_keys.pop(sample.name)
+        del self.samples_by_name[sample.name.lower()]
+
+        if not self.statuses_loaded:
+            return
+
+        counts = self.status_counts.pop(sample.name)
+
+        for status, ranking in self.ranked_samples.items():
+            entry = (-counts[status], sort_key, sample.name)
+            del ranking[bisect.bisect_left(ranking, entry)]
+
+    def build_name_index(self):
+        """
+        Builds the name index and natural sort keys for all samples at once. Only needs the sample names.
+        """
+        for sample in self.all_samples:
+            self.samples_by_name[sample.name.lower()] = sample
+            self.sort_keys[sample.name] = get_natural_sort_key(sample.name)
+
+    def build_registry(self):
+        """
+        Builds the status counts and ranked views for all samples at once.
+        """
+        for sample in self.all_samples:
+            self.status_counts[sample.name] = {"PASS": sample.get_number_of_passes(), "WARN": sample.get_number_of_warnings(), "FAIL": sample.get_number_of_failures()}
+
+        for status in self.ranked_samples.keys():
+            self.ranked_samples[status] = sorted((-self.status_counts[name][status], self.sort_keys[name], name) for name in self.sort_keys)
+
+    def get_ranked_samples(self, status):
+        """
+        Returns sample names ordered by their number of a given status (highest first), ties in natural order.
+        The ranking is kept up to date when samples are added, so this doesn't sort anything.
+        """
+        self.load_statuses()
+        return [entry[2] for entry in self.ranked_samples[status.upper()]]
+
+    def has_sample(self, name):
+        """
+        Returns True if there's a sample with exactly this name.
+        """
+        sample = self.samples_by_name.get(name.lower())
+        return sample is not None and sample.name == name
+
+    def add_sample(self, sample):
+        """
+        Adds a sample, or replaces the sample with the same name, and updates the stats incrementally.
+        """
+        with self.load_lock:
+            old_sample = self.get_sample_by_name(sample.name)
+            if old_sample is not None:
+                self.remove_sample(old_sample)
+
+            self.all_samples.append(sample)
+            self.sample_names.append(sample.name)
+            self.register_sample(sample)
+            if self.read_counts is not None:
+                self.read_counts.append(sample)
+            if self.statuses_loaded:
+                self.update_stats(sample, 1)
+                if self.status_index is not None:
+                    self.status_index.append(sample)
+            self.generation += 1
+
+    def remove_sample(self, sample):
+        """
+        Removes a sample and updates the stats incrementally.
+        """
+        with self.load_lock:
+            row = self.all_samples.index(sample)
+            del self.all_samples[row]
+            self.sample_names.remove(sample.name)
+            self.unregister_sample(sample)
+            if self.read_counts is not None:
+                self.read_counts.remove(row)
+            if self.statuses_loaded:
+                self.update_stats(sample, -1)
+                if self.status_index is not None:
+                    self.status_index.remove(row)
+            self.generation += 1
+
+    def load_statuses(self):
+        """
+        Builds everything that needs the statuses of all samples: the status index, ranked views and global and
+        per-module stats. Samples that were created lazily load their statuses first. Called by every query that
+        needs these, does nothing once they've been built.
+        """
+        if self.statuses_loaded:
+            return
+
+        with self.load_lock:
+            if self.statuses_loaded:
+                return
+
+            self.run_timed("load sample statuses", self.load_sample_statuses)
+            self.run_timed("build status index", self.build_status_index)
+            self.run_timed("build sample registry", self.build_registry)
+            self.run_timed("collect_global_summary_stats", self.collect_global_summary_stats)
+            self.run_timed("collect_stats_per_module", self.collect_stats_per_module)
+            self.statuses_loaded = True
+
+    def load_sample_statuses(self):
+        for sample in self.all_samples:
+            sample.require(sample.LOAD_STATUSES)
+
+    def load_in_background(self, on_loaded=None):
+        """
+        Loads lazily created samples in a background thread: first the statuses (see load_statuses()), then the
+        Basic Statistics of every sample. Queries that need something that hasn't been loaded yet load it themselves.
+        :param on_loaded: Optional function that's called when everything has been loaded, e.g. to save the cache
+        """
+        def load():
+            for level in (Sample.LOAD_STATUSES, Sample.LOAD_ALL):
+                for sample in list(self.all_samples):
+                    if self.stop_loading:
+                        return
+                    sample.require(level)
+                self.load_statuses()
+            self.get_read_counts()
+            if on_loaded is not None:
+                on_loaded()
+
+        self.stop_loading = False
+        self.loader = threading.Thread(target=load, name="SampleLoader")
+        self.loader.daemon = True
+        self.loader.start()
+
+    def stop_background_loading(self):
+        """
+        Stops loading samples in the background after the current sample. Call before exiting.
+        """
+        if self.loader is not None:
+            self.stop_loading = True
+            self.loader.join()
+            self.loader = None
+
     def get_sample_container_by_status(self, status):
         if status.lower() == "pass":
             return self.passed_samples
@@ -84,9 +301,23 @@ class SampleManager(object):
             self.failed_samples = container
 
     def get_samples_by_module_and_status(self, module_query, status_query):
+        self.load_statuses()
 
         container = {}  # Format: sample_name: [read_number, read_number]
 
+        # Look up the module and status in the status index
+        if self.status_index is not None:
+            rows, read_numbers = self.status_index.find(module_query, status_query.upper())
+            for row, read_num in zip(rows.tolist(), read_numbers.tolist()):
+                name = self.all_samples[row].name
+                if name not in container:
+                    container[name] = [read_num]
+                else:
+                    container[name].append(read_num)
+
+            self.set_sample_container_by_status(status_query, container)
+            return container
+
         # Loop through all samples
         for sample in self.all_samples:
             # Get status collection
@@ -109,9 +340,9 @@ class SampleManager(object):
         Returns path to the HTML report for a given samplename and read file number.
         """
         # Find sample
-        for sample in self.all_samples:
-            if sample.name == name:
-                return sample.html_reports[read_num]
+        sample = self.get_sample_by_name(name)
+        if sample is not None:
+            return sample.get_html_report(read_num)
 
     def print_samples_by_module_and_status(self, module_query, status_query):
         samples_result = self.get_samples_by_module_and_status(module_query, status_query)
@@ -121,17 +352,17 @@ class SampleManager(object):
             return
 
         # Print
-        print "{0:30}{1:30}{2:10}{3:8}".format("SAMPLE NAME", "MODULE NAME", "STATUS", "FASTQ(s)")
-
-        for name in sorted(samples_result.keys(), key=lambda s: [int(t) if t.isdigit() else t.lower() for t in re.split('(\d+)', s)]):
-            read_nums = samples_result[name]
-            fastqs_string = " ".join([str(rn) for rn in read_nums])
-            print "{0:30}{1:30}{2:10}{3:8}".format(name, module_query, status_query.center(6), fastqs_string.center(8))
+        rows = ((name, module_query, status_query, " ".join([str(rn) for rn in samples_result[name]])) for name in samples_result)
+        self.renderer.render("samples with status %s in %s" % (status_query, module_query), ["sample", "module", "status", "reads"], rows,
+                             lambda name, module, status, fastqs: "{0:30}{1:30}{2:10}{3:8}".format(name, module, status.center(6), fastqs.center(8)),
+                             header="{0:30}{1:30}{2:10}{3:8}".format("SAMPLE NAME", "MODULE NAME", "STATUS", "FASTQ(s)"),
+                             key=lambda row: self.sort_keys[row[0]])
 
     def print_global_summary(self):
         """
         Print global summary (number of passes, warnings and failures)
         """
+        self.load_statuses()
 
         # Get number of passes, warnings and failures
         num_p = int(self.num_passes)
@@ -181,45 +412,195 @@ class SampleManager(object):
 
     def get_stats_number_of_reads(self):
         """
-        Gets the number of reads from each sample and calcs global mean and median number of reads.
+        Gets the global mean, median, lowest and highest number of reads. Computed once from the read count
+        array (see get_read_counts()) until samples are added or removed.
         :return reads_stats: Dictionary of read number metrics where keys are metrics (mean, median, low, high)
         """
+        read_counts = self.get_read_counts()
+        if read_counts is None:
+            print "ERROR: Could not import module 'numpy'."
+            return -1
 
-        # Container for read counts
-        num_reads = []
+        reads_stats = read_counts.get_summary()
+        if reads_stats is None:
+            print "ERROR: No sample has a number of reads (Basic Statistics)."
+            return -1
 
-        # Loop samples and get read counts for each
-        for sample in self.all_samples:
-            num_reads += sample.get_number_of_reads()
+        return reads_stats
 
-        # Try to import numpy
-        try:
-            import numpy as np
-        except ImportError as e:
-            print "ERROR: Could not import module 'numpy'. (%s)" % e
-            return -1
+    def get_read_counts(self):
+        """
+        Returns the ReadCounts of all samples (number of reads per sample and read file), building it the first
+        time it's needed. It's kept up to date when samples are added or removed.
+        :return read_counts: ReadCounts, or None without numpy
+        """
+        if self.read_counts is None and np is not None:
+            with self.load_lock:
+                if self.read_counts is None:
+                    self.run_timed("build read counts", self.build_read_counts)
+        return self.read_counts
 
-        # Calc mean and median
-        mean_num_reads = np.mean(num_reads)
-        median_num_reads = np.median(num_reads)
+    def get_basic_stat_array(self, stat, convert):
+        """
+        Returns a Basic Statistics value (e.g. "%GC") of every sample and read as a float array (samples x reads),
+        NaN where it's missing. Arrays are cached until samples are added or removed.
+        :param convert: Function that converts a value (string) to a float
+        """
+        cached = self.basic_stat_arrays.get(stat)
+        if cached is not None and cached[0] == self.generation:
+            return cached[1]
+
+        index = BASIC_STATS.index(stat)
+        num_reads = max([max(sample.read_numbers or [0]) for sample in self.all_samples] or [0])
+        array = np.empty((len(self.all_samples), num_reads), dtype=np.float64)
+        array.fill(np.nan)
+        for row, sample in enumerate(self.all_samples):
+            sample.require(sample.LOAD_ALL)
+            for read_number, values in zip(sample.read_numbers, sample.basic_stats):
+                if values is not None and values[index] is not None:
+                    array[row, read_number - 1] = convert(values[index])
+
+        self.basic_stat_arrays[stat] = (self.generation, array)
+        return array
+
+    def get_natural_ranks(self):
+        """
+        Returns the position of every sample (in the order of self.all_samples) when sorted naturally by name.
+        Cached until samples are added or removed.
+        """
+        if self.natural_ranks is None or self.natural_ranks[0] != self.generation:
+            order = sorted(range(len(self.all_samples)), key=lambda row: self.sort_keys[self.all_samples[row].name])
+            ranks = np.empty(len(order), dtype=np.intp)
+            ranks[order] = np.arange(len(order))
+            self.natural_ranks = (self.generation, ranks)
+        return self.natural_ranks[1]
+
+    def get_read_counts_by_status(self, module=None):
+        """
+        Groups read files by their status in a module, or by their worst status in any module.
+        :param module: Module name as it appears in FastQC, None for the worst status
+        :return summaries: Format: {status: summary}, see ReadCounts.summarize(). None without numpy
+        """
+        self.load_statuses()
+        read_counts = self.get_read_counts()
+        if read_counts is None or self.status_index is None:
+            return None
 
-        # Get lowest and highest
-        low_num_reads = min(num_reads)
-        high_num_reads = max(num_reads)
+        module_id = None
+        if module is not None:
+            if module not in self.status_index.module_ids:
+                return {}
+            module_id = self.status_index.module_ids[module]
 
-        reads_stats = {
-            "mean": mean_num_reads,
-            "median": median_num_reads,
-            "low": low_num_reads,
-            "high": high_num_reads
-        }
+        groups = read_counts.get_status_groups(self.status_index.get_codes(), module_id)
+        return dict((status, ReadCounts.summarize(counts)) for status, counts in groups.items())
 
-        return reads_stats
+    def get_low_depth_reads(self, fraction):
+        """
+        Finds read files with fewer reads than a fraction of the median number of reads.
+        :param fraction: E.g. 0.5 for read files with less than half the median
+        :return (threshold, reads): The threshold and a list of (sample_name, read_number, num_reads),
+                                    fewest reads first. (None, []) without numpy
+        """
+        read_counts = self.get_read_counts()
+        if read_counts is None or read_counts.get_summary() is None:
+            return None, []
+
+        threshold = fraction * read_counts.get_summary()["median"]
+        rows, read_numbers, counts = read_counts.find_low_depth(threshold)
+        reads = [(self.all_samples[row].name, int(rn), int(count)) for row, rn, count in zip(rows, read_numbers, counts)]
+        return threshold, reads
+
+    def print_read_count_stats(self):
+        """
+        Prints percentiles of the number of reads per read file, and the number of reads of read files grouped
+        by their worst status.
+        """
+        read_counts = self.get_read_counts()
+        if read_counts is None:
+            print "ERROR: Read count statistics need numpy"
+            return
+
+        percentiles = read_counts.get_percentiles()
+        if percentiles is None:
+            print "No sample has a number of reads (Basic Statistics)"
+            return
+
+        self.print_header(" READ COUNTS ", 75, "=")
+        print "{0:>15}{1:>20}".format("PERCENTILE", "NUMBER OF READS")
+        for percentile, value in zip(ReadCounts.PERCENTILES, percentiles):
+            print "{0:>15}{1:>20}".format(percentile, int(round(value)))
+
+        print ""
+        self.print_reads_by_status_groups(self.get_read_counts_by_status(), "Read files by worst status")
+
+    def print_read_count_histogram(self, num_bins=10):
+        """
+        Prints a histogram of the number of reads per read file, with bins evenly spaced on a log scale.
+        """
+        read_counts = self.get_read_counts()
+        if read_counts is None:
+            print "ERROR: Read count statistics need numpy"
+            return
+
+        bin_counts, edges = read_counts.get_histogram(num_bins)
+        if len(bin_counts) == 0:
+            print "No sample has a number of reads (Basic Statistics)"
+            return
+
+        self.print_header(" READ COUNT HISTOGRAM ", 75, "=")
+        print "{0:>12}   {1:<12}{2:>8}".format("FROM", "TO", "FILES")
+        most = float(max(bin_counts))
+        for i, count in enumerate(bin_counts):
+            bar = "#" * int(round(35 * count / most))
+            print "{0:>12} - {1:<12}{2:>8}  {3}".format(int(edges[i]), int(edges[i + 1]), count, bar)
+
+    def print_read_counts_by_status(self, module):
+        """
+        Prints the number of reads of read files that PASS, WARN or FAIL a module.
+        :param module: Module name as it appears in FastQC, e.g. "Per base sequence quality"
+        """
+        summaries = self.get_read_counts_by_status(module)
+        if summaries is None:
+            print "ERROR: Read count statistics need numpy"
+            return
+
+        self.print_header(" READ COUNTS - " + module.upper() + " ", 75, "=")
+        self.print_reads_by_status_groups(summaries, "Read files by status")
+
+    def print_reads_by_status_groups(self, summaries, title):
+        if summaries is None:
+            return
+
+        self.print_header(" " + title + " ", 75, "*", False)
+        print "{0:8}{1:>8}{2:>15}{3:>15}{4:>15}{5:>15}".format("STATUS", "FILES", "MEAN", "MEDIAN", "MIN", "MAX")
+        for status in ["PASS", "WARN", "FAIL"]:
+            summary = summaries.get(status)
+            if summary is None:
+                print "{0:8}{1:>8}".format(status, 0)
+                continue
+            print "{0:8}{1:>8}{2:>15}{3:>15}{4:>15}{5:>15}".format(status, summary["files"], int(summary["mean"]), int(summary["median"]), int(summary["low"]), int(summary["high"]))
+
+    def print_low_depth_reads(self, fraction):
+        """
+        Prints read files with fewer reads than a fraction of the median number of reads, fewest reads first.
+        :param fraction: E.g. 0.5 for read files with less than half the median
+        """
+        threshold, reads = self.get_low_depth_reads(fraction)
+        if threshold is None:
+            print "ERROR: Read count statistics need numpy"
+            return
+
+        header_lines = self.get_header(" LOW DEPTH READ FILES ", 75, "=")
+        header_lines += ["%d read files with fewer than %d reads (%.2f x median)" % (len(reads), int(threshold), fraction), ""]
+        self.renderer.render("low depth reads", ["sample", "read", "reads"], reads, "{0:50}{1:>10}{2:>15}", header_lines,
+                             "{0:50}{1:>10}{2:>15}".format("SAMPLE NAME", "FASTQ", "READS"))
 
     def print_module_stats(self):
         """
         Print stats per module
         """
+        self.load_statuses()
 
         self.print_header(" MODULE STATS ", 75, "=")
         print '{0:{width}{base}} %5s\t%5s\t%5s'.format("MODULE", base="s", width=30) % ("PASS", "WARN", "FAIL")
@@ -234,17 +615,16 @@ class SampleManager(object):
 
     def get_sample_by_name(self, name):
         """
-        Get sample by name
+        Get sample by name (case-insensitive)
         """
-        for sample in self.all_samples:
-            if sample.name.lower() == name.lower():
-                return sample
+        return self.samples_by_name.get(name.lower())
 
     def print_modules_orderby_status(self, status_query):
         """
         Prints a list of modules ordered by the number of failures.
         :param status_query: Status as string: PASS | WARN | FAIL
         """
+        self.load_statuses()
 
         self.print_header(" MODULES ", 75, "=")
 
@@ -272,27 +652,14 @@ class SampleManager(object):
         Prints a list of sample names ordered by a given status
         :param status_query: Status as string: PASS | WARN | FAIL
         """
-        print "====================================================="
-        print "====================== SAMPLES ======================"
-        print "====================================================="
-        print '{0:{width}{base}} %5s\t%5s\t%5s'.format("SAMPLE", base="s", width=30) % ("PASS", "WARN", "FAIL")
+        self.load_statuses()
 
-        container = {}  # Format: sample_name: number_of_failures/passes/warnings
-
-        # Loop samples
-        for sample in self.all_samples:
-            if sample.name not in container.keys():
-                container[sample.name] = sample.get_status_count(status_query)
-            else:
-                print "Warning: print_samples_orderby_status(); dict already contains sample name"
-
-        # Print ordered list
-        for name, fails in sorted(container.items(), key=lambda x: x[1], reverse=True):
-            sample = self.get_sample_by_name(name)
-            passes = sample.get_number_of_passes()
-            warns = sample.get_number_of_warnings()
-            fails = sample.get_number_of_failures()
-            print '{0:{width}{base}} %5d\t%5d\t%5d'.format(name, base="s", width=30) % (passes, warns, fails)
+        # Print ordered list. The ranking is sorted already, so only the rows that are printed are looked at
+        counts = self.status_counts
+        rows = ((entry[2], counts[entry[2]]["PASS"], counts[entry[2]]["WARN"], counts[entry[2]]["FAIL"]) for entry in self.ranked_samples[status_query.upper()])
+        self.renderer.render("samples ordered by %s" % status_query.upper(), ["sample", "pass", "warn", "fail"], rows,
+                             "{0:30} {1:5d}\t{2:5d}\t{3:5d}", self.get_header(" SAMPLES ", 53, "="),
+                             "{0:30} {1:>5}\t{2:>5}\t{3:>5}".format("SAMPLE", "PASS", "WARN", "FAIL"))
 
     def print_sample_details(self, sample_name):
         """
@@ -443,17 +810,153 @@ class SampleManager(object):
             # Print
             print row_module + status_str
 
-    def print_header(self, header, size, fillchar, padding=True):
-        if padding:
-            print "".center(size, fillchar)
+    def get_metric_matrix(self, module, column, read_number):
+        """
+        Returns a sample x position matrix of a numeric column in a module, e.g. ("Per base sequence quality", "Mean"),
+        with one row per sample in the order of self.all_samples.
+        :return (matrix, labels): The matrix and the position labels, or (None, None) if not available
+        """
+        return self.metric_store.get_matrix(self.all_samples, module, column, read_number, self.generation)
+
+    def get_metric_columns(self, module, read_number):
+        """
+        Returns the names of the numeric columns in a module, e.g. Mean, Median, ... for "Per base sequence quality"
+        """
+        entry = self.metric_store.get_module(self.all_samples, module, read_number, self.generation)
+        if entry is None:
+            return []
+        return entry["columns"]
+
+    def print_metric_by_position(self, module, column, position, read_number):
+        """
+        Prints the value of a module metric at a given position for every sample, lowest first.
+        E.g. the median quality at base 140 of read 1.
+        :param module: Module name as it appears in FastQC, e.g. "Per base sequence quality"
+        :param column: Column in the module, e.g. "Median"
+        :param position: Base position (or other row label) to print values for
+        :param read_number: Read file number
+        """
+        matrix, labels = self.get_metric_matrix(module, column, read_number)
+        if matrix is None:
+            print "No data for column '%s' in module '%s' for read %d" % (column, module, read_number)
+            return
+
+        index = find_position(labels, position)
+        if index is None:
+            print "No position '%s' in module '%s'" % (position, module)
+            return
+
+        # One column of the matrix, samples without a value are left out
+        values = np.asarray(matrix[:, index], dtype=np.float64)
+        rows = np.flatnonzero(~np.isnan(values))
+        if len(rows) == 0:
+            print "No samples have a value at position '%s'" % position
+            return
+        present = values[rows]
+
+        # Lowest values first. With --limit, only that many are kept while going through the samples (see select_rows())
+        header_lines = self.get_header(" " + module.upper() + " - " + column.upper() + " ", 75, "=")
+        header_lines += ["Position %s (read %d): median %.2f, min %.2f, max %.2f in %d samples" % (labels[index], read_number, np.median(present), present.min(), present.max(), len(rows)), ""]
+        table_rows = ((self.all_samples[row].name, round(value, 4)) for row, value in zip(rows.tolist(), present.tolist()))
+        self.renderer.render("%s %s at position %s of read %d" % (module, column, labels[index], read_number), ["sample", column], table_rows,
+                             "{0:50}{1:>15.2f}", header_lines, "{0:50}{1:>15}".format("SAMPLE NAME", column.upper()), key=lambda row: row[1])
+
+    def print_outlier_samples(self, metric, read_number):
+        """
+        Prints the samples that differ most from the cohort in a module metric, e.g. the mean quality at every base
+        position, most anomalous first (see OutlierEngine). Only samples that are outliers at one or more positions are printed.
+        :param metric: Metric name, see OutlierEngine.METRICS
+        :param read_number: Read file number
+        """
+        if OutlierEngine.np is None:
+            print "ERROR: Outliers need numpy"
+            return
+
+        ranked = self.outlier_engine.rank_samples(metric, read_number)
+        if ranked is None:
+            print "No data for metric '%s' for read %d" % (metric, read_number)
+            return
+
+        header_lines = self.get_header(" OUTLIER SAMPLES - " + metric.upper() + " ", 75, "=")
+        header_lines += ["%d samples with |z| >= %.1f at one or more positions (read %d)" % (len(ranked), OutlierEngine.OUTLIER_Z, read_number), ""]
+        rows = ((name, round(score, 4), positions, position, round(z, 4)) for name, score, positions, position, z in ranked)
+        self.renderer.render("outlier samples in %s of read %d" % (metric, read_number), ["sample", "score", "outlier_positions", "worst_position", "worst_z"],
+                             rows, "{0:35}{1:>10.2f}{2:>12}{3:>10}{4:>10.2f}", header_lines,
+                             "{0:35}{1:>10}{2:>12}{3:>10}{4:>10}".format("SAMPLE NAME", "SCORE", "POSITIONS", "WORST", "Z"))
+
+    def print_outlier_positions(self, metric, read_number):
+        """
+        Prints the positions of a module metric where most samples are outliers (see OutlierEngine).
+        :param metric: Metric name, see OutlierEngine.METRICS
+        :param read_number: Read file number
+        """
+        if OutlierEngine.np is None:
+            print "ERROR: Outliers need numpy"
+            return
+
+        ranked = self.outlier_engine.rank_positions(metric, read_number)
+        if ranked is None:
+            print "No data for metric '%s' for read %d" % (metric, read_number)
+            return
 
-        print header.center(size, fillchar)
+        header_lines = self.get_header(" OUTLIER POSITIONS - " + metric.upper() + " ", 75, "=")
+        header_lines += ["Samples with |z| >= %.1f per position (read %d)" % (OutlierEngine.OUTLIER_Z, read_number), ""]
+        rows = ((position, samples, round(mean_abs_z, 4), name, round(z, 4)) for position, samples, mean_abs_z, name, z in ranked)
+        self.renderer.render("outlier positions in %s of read %d" % (metric, read_number), ["position", "outlier_samples", "mean_abs_z", "worst_sample", "worst_z"],
+                             rows, "{0:12}{1:>10}{2:>12.2f}  {3:31}{4:>10.2f}", header_lines,
+                             "{0:12}{1:>10}{2:>12}  {3:31}{4:>10}".format("POSITION", "SAMPLES", "MEAN |Z|", "WORST SAMPLE", "Z"))
 
+    def get_header(self, header, size, fillchar, padding=True):
+        """
+        Returns the lines of a banner, e.g. a header between two lines of "=".
+        """
         if padding:
-            print "".center(size, fillchar)
+            return ["".center(size, fillchar), header.center(size, fillchar), "".center(size, fillchar)]
+        return [header.center(size, fillchar)]
+
+    def print_header(self, header, size, fillchar, padding=True):
+        for line in self.get_header(header, size, fillchar, padding):
+            print line
+
+    def build_status_index(self):
+        if StatusIndex.np is not None:
+            self.status_index = StatusIndex.StatusIndex(self.all_samples)
+
+    def build_read_counts(self):
+        self.read_counts = ReadCounts.ReadCounts(self.all_samples)
+
+    def run_timed(self, phase, method):
+        """
+        Runs a step of building the manager, and times it if timings are recorded (see --timings).
+        """
+        if self.timings is None:
+            method()
+            return
+
+        with self.timings.phase(phase):
+            method()
 
-    def __init__(self, sample_list):
+    def __init__(self, sample_list, store_dir=None, timings=None, lazy=False):
         self.all_samples = sample_list
+        self.sample_names = [s.name for s in sample_list]
+        self.generation = 0  # Incremented whenever samples are added or removed
+        self.samples_by_name = {}  # Format: {lowercase_name: sample}
+        self.sort_keys = {}  # Format: {name: natural_sort_key}
+        self.status_counts = {}  # Format: {name: {status: count}}
+        self.ranked_samples = {"PASS": [], "WARN": [], "FAIL": []}  # Format: {status: sorted [(-count, sort_key, name)]}
+        self.metric_store = MetricStore(store_dir)  # Cross-sample module metrics, saved to store_dir if given
+        self.timings = timings  # Optional Timings of building the aggregates below
+        self.load_lock = threading.RLock()  # Held while the aggregates are built and samples are added or removed
+        self.statuses_loaded = False  # Whether the aggregates that need every sample's statuses have been built
+        self.loader = None  # Thread that loads lazily created samples (see load_in_background())
+        self.stop_loading = False
+
+        self.status_index = None  # Statuses of all samples as an int8 array (samples x reads x modules), needs numpy
+        self.read_counts = None  # Number of reads of all samples (samples x reads), built on first use, needs numpy
+        self.basic_stat_arrays = {}  # Format: {stat: (generation, array)}, see get_basic_stat_array()
+        self.natural_ranks = None  # Format: (generation, array), see get_natural_ranks()
+        self.outlier_engine = OutlierEngine.OutlierEngine(self)  # Robust z-scores of module metrics, computed on first use
+        self.renderer = TableRenderer()  # Writes the tables of the print_* methods, see --limit, --offset and --format
         self.num_passes = 0
         self.num_warnings = 0
         self.num_failures = 0
@@ -462,6 +965,8 @@ class SampleManager(object):
         self.warned_samples = {}
         self.passed_samples = {}
 
-        # Do stuff
-        self.collect_global_summary_stats()
-        self.collect_stats_per_module()
+        # Do stuff. With lazy=True the statuses are loaded by the first query that needs them (see load_statuses())
+        self.run_timed("build name index", self.build_name_index)
+        if not lazy:
+            self.load_statuses()
+            self.get_read_counts()
@@ -0,0 +1,191 @@
+import sqlite3
+import threading
+import Exporter
+from QueryRunner import QueryRunner, QueryError, STATUSES
+
+# Tables of the query database: the statuses and basic_stats tables of an export (see Exporter.TABLES),
+# every sample with its position in natural order, and the key of the samples the database was built from
+TABLES = [t for t in Exporter.TABLES if t[0] in ("statuses", "basic_stats")] + [
+    ("samples", [("name", "TEXT PRIMARY KEY"), ("sort_rank", "INTEGER")]),
+    ("meta", [("key", "TEXT PRIMARY KEY"), ("value", "TEXT")]),
+]
+
+# Indexes created after the tables have been filled. Format: [(index, table, columns)]
+INDEXES = [
+    ("statuses_module_status", "statuses", "module, status"),
+    ("statuses_sample", "statuses", "sample"),
+    ("basic_stats_sample", "basic_stats", "sample"),
+    ("basic_stats_total_sequences", "basic_stats", "total_sequences"),
+    ("basic_stats_gc", "basic_stats", "gc"),
+    ("samples_sort_rank", "samples", "sort_rank"),
+]
+
+
+class SqliteBackend(object):
+    """
+    Indexed SQLite database of the statuses and Basic Statistics of all samples, which the browser's commands
+    are run against (see SqliteQueryRunner). The file is kept between sessions and is only rebuilt when the samples
+    have changed, and it can be queried by other tools too. Samples added or removed while running (--watch)
+    are written to it before the next query.
+    """
+
+    def get_key(self, sample_manager):
+        """
+        Returns a digest of the sample list and the zip-files of every sample (see MetricStore.get_samples_key()).
+        """
+        return sample_manager.metric_store.get_samples_key(sample_manager.all_samples)
+
+    def get_stored_key(self):
+        """
+        Returns the key of the samples the database file was built from, None if there's no (valid) database.
+        """
+        connection = sqlite3.connect(self.path)
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'samples_key'").fetchone()
+        except sqlite3.DatabaseError:
+            return None
+        finally:
+            connection.close()
+        return row[0] if row is not None else None
+
+    def build(self, sample_manager):
+        """
+        Writes all samples to the database, unless it was built from the same samples before.
+        """
+        key = self.get_key(sample_manager)
+        rebuild = self.get_stored_key() != key
+
+        writer = Exporter.SqliteWriter(self.path, TABLES, replace=rebuild, check_same_thread=False)
+        self.connection = writer.connection
+        self.exporter = Exporter.Exporter(self.path, "sqlite", writer=writer)
+
+        if rebuild:
+            self.exporter.write_samples(sample_manager.all_samples)
+            self.write_sort_ranks(sample_manager)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('samples_key', ?)", (key,))
+
+        for index, table, columns in INDEXES:
+            self.connection.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (index, table, columns))
+        self.connection.commit()
+
+        self.samples = dict((sample.name, sample) for sample in sample_manager.all_samples)
+        self.generation = sample_manager.generation
+        return rebuild
+
+    def write_sort_ranks(self, sample_manager):
+        """
+        Stores every sample with its position in natural order, used to break ties when ordering samples.
+        """
+        names = sorted(sample_manager.sample_names, key=sample_manager.sort_keys.get)
+        self.connection.execute("DELETE FROM samples")
+        self.connection.executemany("INSERT INTO samples VALUES (?, ?)", [(name, rank) for rank, name in enumerate(names)])
+
+    def sync(self, sample_manager):
+        """
+        Writes samples that have been added, replaced or removed since the database was built or last synced.
+        """
+        if self.generation == sample_manager.generation:
+            return
+
+        with self.lock:
+            current = dict((sample.name, sample) for sample in sample_manager.all_samples)
+            changed = [name for name, sample in self.samples.items() if current.get(name) is not sample]
+            added = [sample for name, sample in current.items() if self.samples.get(name) is not sample]
+
+            for name in changed:
+                self.connection.execute("DELETE FROM statuses WHERE sample = ?", (name,))
+                self.connection.execute("DELETE FROM basic_stats WHERE sample = ?", (name,))
+            self.exporter.write_samples(added)
+            self.write_sort_ranks(sample_manager)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('samples_key', ?)", (self.get_key(sample_manager),))
+            self.connection.commit()
+
+            self.samples = current
+            self.generation = sample_manager.generation
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.exporter = None  # Writes the rows of samples, see Exporter.write_samples()
+        self.samples = {}  # Format: {name: Sample}, the samples that are in the database
+        self.generation = None  # SampleManager.generation when the database was last synced
+        self.lock = threading.RLock()  # The connection is shared by the threads of QueryServer
+
+
+class SqliteQueryRunner(QueryRunner):
+    """
+    Runs the commands over statuses and read counts as SQL against an SqliteBackend, rather than looping over
+    the samples in memory. Results are the same as QueryRunner's. Other commands (module tables, HTML reports)
+    still use the SampleManager.
+    """
+
+    def get_status_counts(self, group_by):
+        """
+        Returns SQL that counts PASS, WARN and FAIL of each group, e.g. "module".
+        """
+        counts = ", ".join("COUNT(CASE WHEN status = '%s' THEN 1 END)" % status for status in STATUSES)
+        return "SELECT %s, %s FROM statuses GROUP BY %s" % (group_by, counts, group_by)
+
+    def query_print_global_stats(self):
+        row = list(self.backend.query("SELECT %s FROM statuses" % ", ".join("COUNT(CASE WHEN status = '%s' THEN 1 END)" % s for s in STATUSES))[0])
+
+        num_reads, total, low, high = self.backend.query("SELECT COUNT(total_sequences), SUM(total_sequences), MIN(total_sequences), MAX(total_sequences) FROM basic_stats")[0]
+        if num_reads == 0:
+            raise QueryError("Could not calculate number of reads (no Basic Statistics)")
+
+        # Median: the middle value, or the mean of the two middle values
+        middle = self.backend.query("SELECT total_sequences FROM basic_stats WHERE total_sequences IS NOT NULL ORDER BY total_sequences LIMIT ? OFFSET ?",
+                                    (2 - num_reads % 2, (num_reads - 1) // 2))
+        median = sum(r[0] for r in middle) / float(len(middle))
+
+        row += [int(total / float(num_reads)), int(median), int(low), int(high)]
+        return ["passes", "warnings", "failures", "mean_reads", "median_reads", "min_reads", "max_reads"], [row]
+
+    def query_print_module_stats(self):
+        rows = self.backend.query(self.get_status_counts("module") + " ORDER BY module")
+        return ["module", "pass", "warn", "fail"], [list(row) for row in rows]
+
+    def query_print_sample_details(self, sample_name):
+        sample = self.get_sample(sample_name)
+        rows = self.backend.query("SELECT sample, read, module, status FROM statuses WHERE sample = ? ORDER BY module, read", (sample.name,))
+        return ["sample", "read", "module", "status"], [list(row) for row in rows]
+
+    def query_print_samples_by_status_in_module(self, module_name, status):
+        module = self.get_module(module_name)
+        status = self.get_status(status)
+
+        rows = []
+        query = "SELECT st.sample, st.read FROM statuses st JOIN samples s ON s.name = st.sample WHERE st.module = ? AND st.status = ? ORDER BY s.sort_rank, st.read"
+        for name, read_number in self.backend.query(query, (module, status)):
+            if len(rows) > 0 and rows[-1][0] == name:
+                rows[-1][3] += " %d" % read_number
+            else:
+                rows.append([name, module, status, str(read_number)])
+        return ["sample", "module", "status", "reads"], rows
+
+    def query_print_all_samples_orderby_status(self, status):
+        status = self.get_status(status)
+        counts = ", ".join("COUNT(CASE WHEN st.status = '%s' THEN 1 END) AS %s" % (s, s.lower()) for s in STATUSES)
+        query = "SELECT s.name, %s FROM samples s LEFT JOIN statuses st ON st.sample = s.name GROUP BY s.name ORDER BY %s DESC, s.sort_rank" % (counts, status.lower())
+        return ["sample", "pass", "warn", "fail"], [list(row) for row in self.backend.query(query)]
+
+    def query_print_all_modules_orderby_status(self, status):
+        status = self.get_status(status)
+        query = "SELECT * FROM (%s) ORDER BY %d DESC, module" % (self.get_status_counts("module"), STATUSES.index(status) + 2)
+        return ["module", "pass", "warn", "fail"], [list(row) for row in self.backend.query(query)]
+
+    def run(self, line):
+        self.backend.sync(self.sample_manager)
+        return QueryRunner.run(self, line)
+
+    def __init__(self, sample_manager, backend, module_descriptions=None, limit=None, offset=0):
+        QueryRunner.__init__(self, sample_manager, module_descriptions, limit, offset)
+        self.backend = backend  # SqliteBackend, built from the samples of sample_manager
@@ -0,0 +1,124 @@
+# numpy is optional, SampleManager falls back to looping over samples without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Status codes stored in the index. 0 means the read/module has no status
+STATUS_CODES = {"PASS": 1, "WARN": 2, "FAIL": 3}
+STATUS_NAMES = [None, "PASS", "WARN", "FAIL"]
+
+
+class StatusIndex(object):
+    """
+    Compact index of every status in the cohort: an int8 array of shape (samples x reads x modules),
+    where module names are interned to column numbers and statuses to small codes (see STATUS_CODES).
+    Row i is the i-th sample in SampleManager.all_samples. Questions like "which samples FAIL Adapter Content"
+    or "how many PASS/WARN/FAILs per module" are single vectorised reductions over this array.
+    """
+
+    def get_module_id(self, module):
+        """
+        Returns the column of a module, adding it to the index if it's new.
+        """
+        if module not in self.module_ids:
+            self.module_ids[module] = len(self.module_names)
+            self.module_names.append(module)
+        return self.module_ids[module]
+
+    def reserve(self, num_samples, num_reads, num_modules):
+        """
+        Grows the array (if needed) to fit the given number of samples, reads and modules.
+        Rows are allocated in chunks, so adding samples one by one doesn't copy the array every time.
+        """
+        capacity, reads, modules = self.codes.shape
+        if num_samples <= capacity and num_reads <= reads and num_modules <= modules:
+            return
+
+        new_capacity = capacity
+        if num_samples > capacity:
+            new_capacity = max(num_samples, capacity * 2)
+
+        codes = np.zeros((new_capacity, max(reads, num_reads), max(modules, num_modules)), dtype=np.int8)
+        codes[:capacity, :reads, :modules] = self.codes
+        self.codes = codes
+
+    def set_row(self, row, sample):
+        """
+        Writes the statuses of a sample to a row of the index.
+        """
+        entries = []
+        for read_number, module, status in sample.get_statuses():
+            entries.append((read_number - 1, self.get_module_id(module), STATUS_CODES[status]))
+
+        num_reads = max([e[0] for e in entries] or [0]) + 1
+        self.reserve(row + 1, num_reads, len(self.module_names))
+
+        self.codes[row] = 0
+        for read_slot, module_id, code in entries:
+            self.codes[row, read_slot, module_id] = code
+
+    def append(self, sample):
+        """
+        Adds a sample as the last row of the index.
+        """
+        self.set_row(self.num_samples, sample)
+        self.num_samples += 1
+
+    def remove(self, row):
+        """
+        Removes a row, later rows move up one step (like list.remove() in SampleManager.all_samples).
+        """
+        self.codes[row:self.num_samples - 1] = self.codes[row + 1:self.num_samples]
+        self.codes[self.num_samples - 1] = 0
+        self.num_samples -= 1
+
+    def get_codes(self):
+        """
+        Returns the part of the array that's in use.
+        """
+        return self.codes[:self.num_samples]
+
+    def count_by_module(self):
+        """
+        Counts statuses per module.
+        :return counts: Array of shape (modules x 4), counts[module_id, code]
+        """
+        num_modules = len(self.module_names)
+        codes = self.get_codes()[:, :, :num_modules].astype(np.intp)
+        flat = (codes + 4 * np.arange(num_modules)).ravel()
+        return np.bincount(flat, minlength=4 * num_modules).reshape(num_modules, 4)
+
+    def count_by_status(self):
+        """
+        Counts statuses over all samples, reads and modules.
+        :return counts: Array of length 4, counts[code]
+        """
+        return np.bincount(self.get_codes().ravel().astype(np.intp), minlength=4)
+
+    def count_per_sample(self, status):
+        """
+        Returns the number of modules with a given status in every sample (all reads together).
+        """
+        return (self.get_codes() == STATUS_CODES[status]).sum(axis=(1, 2))
+
+    def find(self, module, status):
+        """
+        Finds all reads that have a given status in a module.
+        :return (rows, read_numbers): Arrays of sample rows and read numbers, sorted by row
+        """
+        if module not in self.module_ids:
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+
+        mask = self.get_codes()[:, :, self.module_ids[module]] == STATUS_CODES[status]
+        rows, read_slots = np.nonzero(mask)
+        return rows, read_slots + 1
+
+    def __init__(self, samples=()):
+        self.module_ids = {}  # Format: {module_name: column}
+        self.module_names = []  # Format: [module_name], indexed by column
+        self.num_samples = 0
+        self.codes = np.zeros((len(samples), 2, 12), dtype=np.int8)
+
+        for sample in samples:
+            self.append(sample)
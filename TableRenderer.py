@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import heapq
+import itertools
+import subprocess
+
+# Pager used when PAGER isn't set. -F quits at once if the table fits on the screen after all, -R keeps colours
+# and -X leaves the table on the screen after quitting
+DEFAULT_PAGER = "less -FRX"
+
+
+def format_tsv_value(value):
+    """
+    Escapes backslashes, tabs and newlines, so every row is a single line. Missing values (None) are empty fields.
+    """
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def select_rows(rows, limit=None, offset=0, key=None, reverse=False):
+    """
+    Returns the rows from offset up to offset + limit, ordered by key if given. With a limit, only the first
+    offset + limit rows are kept (in a heap, see heapq.nsmallest()) instead of sorting all of them.
+    Ties keep their order, like sorted().
+    :param rows: Iterable of rows, e.g. a generator
+    :param limit: Number of rows to return, None for all
+    :return rows: Iterator over the selected rows
+    """
+    if key is not None:
+        if limit is None:
+            rows = sorted(rows, key=key, reverse=reverse)
+        elif reverse:
+            rows = heapq.nlargest(offset + limit, rows, key)
+        else:
+            rows = heapq.nsmallest(offset + limit, rows, key)
+
+    return itertools.islice(rows, offset, offset + limit if limit is not None else None)
+
+
+def get_pager():
+    return os.environ.get("PAGER") or DEFAULT_PAGER
+
+
+def get_terminal_height(stream):
+    """
+    Returns the number of lines of the terminal a stream writes to, 24 if it can't be found out.
+    """
+    try:
+        import fcntl
+        import struct
+        import termios
+        height = struct.unpack("hh", fcntl.ioctl(stream.fileno(), termios.TIOCGWINSZ, "1234"))[0]
+    except (ImportError, IOError, AttributeError, ValueError):
+        return 24
+    return height or 24
+
+
+class TableRenderer(object):
+    """
+    Writes the tables of the print_* commands of SampleManager. Rows are formatted and written in chunks of
+    lines, rather than with one print per row, and only rows from --offset up to --limit are formatted at all.
+    On a terminal, tables are aligned text, and tables taller than the screen go through a pager.
+    When stdout is a file or a pipe, rows are streamed as TSV or JSON (like the results of batch mode) instead.
+    """
+
+    def is_terminal(self):
+        output = self.output or sys.stdout
+        return hasattr(output, "isatty") and output.isatty()
+
+    def get_format(self):
+        """
+        Returns the format tables are written in: text on a terminal, otherwise output_format (TSV if it's not set).
+        """
+        if self.is_terminal():
+            return "text"
+        return self.output_format or "tsv"
+
+    def get_text_lines(self, rows, row_format, header_lines, header):
+        for line in header_lines:
+            yield line
+        if header is not None:
+            yield header
+        for row in rows:
+            yield row_format(*row) if callable(row_format) else row_format.format(*row)
+
+    def get_tsv_lines(self, title, columns, rows):
+        yield "# " + title
+        yield "\t".join(columns)
+        for row in rows:
+            yield "\t".join(format_tsv_value(v) for v in row)
+
+    def get_chunks(self, lines):
+        """
+        Joins lines into chunks of chunk_size lines.
+        """
+        while True:
+            chunk = list(itertools.islice(lines, self.chunk_size))
+            if len(chunk) == 0:
+                return
+            yield "\n".join(chunk) + "\n"
+
+    def get_json_chunks(self, title, columns, rows):
+        """
+        Writes a table as one JSON object (command, columns and rows, like batch mode), a chunk of rows at a time.
+        """
+        yield '{"command": %s, "columns": %s, "rows": [' % (json.dumps(title), json.dumps(columns))
+        separator = ""
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if len(chunk) == 0:
+                break
+            yield separator + ", ".join(json.dumps(list(row)) for row in chunk)
+            separator = ", "
+        yield "]}\n"
+
+    def start_pager(self):
+        try:
+            return subprocess.Popen(self.pager, shell=True, stdin=subprocess.PIPE)
+        except OSError:
+            return None
+
+    def write(self, chunks):
+        """
+        Writes chunks of text. On a terminal (with a pager), chunks are held back until they fill the screen,
+        then the pager is started and gets everything from there on.
+        """
+        output = self.output or sys.stdout
+        use_pager = self.pager is not None and self.is_terminal()
+        height = get_terminal_height(output) if use_pager else 0
+
+        pager = None
+        target = output
+        pending = []  # Chunks that haven't been written, while it's unknown if the table fits on the screen
+        pending_lines = 0
+
+        try:
+            for chunk in chunks:
+                if use_pager:
+                    pending.append(chunk)
+                    pending_lines += chunk.count("\n")
+                    if pending_lines < height:
+                        continue
+
+                    use_pager = False
+                    pager = self.start_pager()
+                    if pager is not None:
+                        target = pager.stdin
+                    chunk = "".join(pending)
+                    pending = []
+
+                target.write(chunk)
+
+            if len(pending) > 0:
+                target.write("".join(pending))
+
+        # The pager was quit before the end of the table
+        except (IOError, KeyboardInterrupt):
+            pass
+
+        finally:
+            if pager is not None:
+                try:
+                    pager.stdin.close()
+                except IOError:
+                    pass
+                pager.wait()
+            output.flush()
+
+    def render(self, title, columns, rows, row_format, header_lines=(), header=None, key=None, reverse=False):
+        """
+        Writes a table. Only the rows from offset up to offset + limit are formatted (see select_rows()).
+        :param title: Name of the table, the "# command" line of TSV and "command" of JSON
+        :param columns: Column names in TSV and JSON
+        :param rows: Iterable of rows (tuples of values), e.g. a generator
+        :param row_format: str.format() pattern of a row in text, e.g. "{0:50}{1:>15.2f}", or a function that
+                           takes the values of a row and returns the line
+        :param header_lines: Lines before the table in text, e.g. a banner (see SampleManager.get_header())
+        :param header: Line with the column names in text
+        :param key: Function of a row to order rows by, None if rows are in order already
+        :param reverse: Order rows by key from high to low
+        """
+        rows = select_rows(rows, self.limit, self.offset, key, reverse)
+
+        output_format = self.get_format()
+        if output_format == "json":
+            chunks = self.get_json_chunks(title, columns, rows)
+        elif output_format == "tsv":
+            chunks = self.get_chunks(self.get_tsv_lines(title, columns, rows))
+        else:
+            chunks = self.get_chunks(self.get_text_lines(rows, row_format, header_lines, header))
+
+        self.write(chunks)
+
+    def __init__(self, output_format=None, limit=None, offset=0, pager=None, output=None, chunk_size=1000):
+        self.output_format = output_format  # Format when not writing to a terminal: tsv (default), json or text
+        self.limit = limit  # Maximum number of rows of a table, None for all
+        self.offset = offset  # Number of rows to skip
+        self.pager = pager  # Shell command of the pager (see get_pager()), None to write tables to the terminal directly
+        self.output = output  # Open file to write to, sys.stdout (at the time of writing) if None
+        self.chunk_size = chunk_size  # Lines per write
@@ -0,0 +1,338 @@
+import os
+import bisect
+import tarfile
+import threading
+import zlib
+
+# First bytes of a gzip file
+GZIP_MAGIC = "\x1f\x8b"
+
+# Compressed bytes decompressed at a time
+CHUNK_SIZE = 256 * 1024
+
+# Decompressed bytes that a cursor of GzipIndex.read_at() keeps before its position, so a zip-file shortly
+# before the previous one (e.g. the other read of the same sample) is read without starting again from a checkpoint
+REWIND_SIZE = 1024 * 1024
+
+# Archives that are being browsed, by absolute path. Format: {archive_path: TarArchive}
+archives = {}
+archives_lock = threading.Lock()
+
+
+def is_archive(path):
+    """
+    Returns True if path is a tar file (.tar, or compressed with gzip) rather than a directory.
+    """
+    return os.path.isfile(path) and tarfile.is_tarfile(path)
+
+
+def open_archive(path):
+    """
+    Creates a TarArchive and makes its files available to Sample (see find_archive()). Call scan() to read it.
+    """
+    archive = TarArchive(path)
+    with archives_lock:
+        archives[archive.path] = archive
+    return archive
+
+
+def find_archive(path):
+    """
+    Returns the TarArchive a path points into, e.g. /runs/project.tar.gz/project/sample1/sample1_1.zip,
+    or None for a path on disk. An archive that isn't open yet (e.g. when a --connect client opens a report)
+    is opened and indexed, which reads it once.
+    """
+    for archive_path, archive in archives.items():
+        if path == archive_path or path.startswith(archive_path + "/"):
+            return archive
+
+    if os.path.exists(path):
+        return None
+
+    # Look for an archive among the path's parents
+    parent = os.path.dirname(path)
+    while parent and parent != os.path.dirname(parent):
+        if os.path.isfile(parent):
+            if not is_archive(parent):
+                return None
+            archive = archives.get(parent)
+            if archive is None:
+                archive = TarArchive(parent)
+                for sample_dir in archive.scan(read_contents=False):
+                    pass
+                with archives_lock:
+                    archive = archives.setdefault(parent, archive)
+            return archive
+        parent = os.path.dirname(parent)
+
+    return None
+
+
+class GzipCursor(object):
+    """
+    Decompresses a gzip file from a given point onwards: the start of the file, or a checkpoint (see GzipIndex).
+    Files of several concatenated gzip members (e.g. from pigz or bgzip) are read as one stream.
+    """
+
+    def fill(self):
+        """
+        Decompresses the next chunk of the file.
+        :return more: False at the end of the file
+        """
+        chunk = self.raw.read(CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.raw_position += len(chunk)
+
+        data = self.decompressor.decompress(chunk)
+        while self.decompressor.unused_data:
+            rest = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                data += self.decompressor.decompress(rest)
+            except zlib.error:
+                break  # Padding after the last member
+
+        self.total_out += len(data)
+        start = max(0, self.buffer_position - self.rewind_size)
+        self.buffer = self.buffer[start:] + data
+        self.buffer_position -= start
+
+        if self.on_fill is not None:
+            self.on_fill(self)
+        return True
+
+    @property
+    def position(self):
+        # Position in the decompressed stream of the next byte read()
+        return self.total_out - (len(self.buffer) - self.buffer_position)
+
+    @property
+    def start(self):
+        # Position in the decompressed stream of the first byte that's still in the buffer
+        return self.total_out - len(self.buffer)
+
+    def read(self, size):
+        while len(self.buffer) - self.buffer_position < size and self.fill():
+            pass
+        data = self.buffer[self.buffer_position:self.buffer_position + size]
+        self.buffer_position += len(data)
+        return data
+
+    def skip(self, size):
+        """
+        Skips bytes without keeping them.
+        """
+        while size > 0:
+            if self.buffer_position == len(self.buffer) and not self.fill():
+                return
+            step = min(size, len(self.buffer) - self.buffer_position)
+            self.buffer_position += step
+            size -= step
+
+    def seek(self, offset):
+        """
+        Moves to an offset, back within the buffer (see start) or forward by decompressing up to it.
+        """
+        if offset < self.position:
+            self.buffer_position = offset - self.start
+        else:
+            self.skip(offset - self.position)
+
+    def close(self):
+        self.raw.close()
+
+    def __init__(self, path, raw_position=0, total_out=0, decompressor=None, on_fill=None, rewind_size=0):
+        self.raw = open(path, "rb")
+        self.raw.seek(raw_position)
+        self.raw_position = raw_position  # Compressed bytes read so far
+        self.total_out = total_out  # Decompressed bytes so far
+        self.decompressor = decompressor or zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = ""  # Decompressed bytes that haven't been read
+        self.buffer_position = 0
+        self.rewind_size = rewind_size  # Bytes kept before the position, see seek()
+        self.on_fill = on_fill  # Called after every chunk, see GzipIndex.add_checkpoint()
+
+
+class GzipIndex(object):
+    """
+    Reads a gzip file once from start to end (read()), and keeps a copy of the decompressor every
+    checkpoint_interval bytes of output. Any part can then be read again (read_at()) by decompressing from the
+    nearest checkpoint before it, rather than from the start of the file. A checkpoint costs about 40 KB of memory
+    (the decompressor's 32 KB window), so the default of one per 16 MB keeps about 25 MB for a 10 GB archive.
+    """
+
+    def add_checkpoint(self, cursor):
+        if cursor.total_out >= self.checkpoints[-1][0] + self.checkpoint_interval:
+            self.checkpoints.append((cursor.total_out, cursor.raw_position, cursor.decompressor.copy()))
+
+    def read(self, size):
+        return self.stream.read(size)
+
+    def read_at(self, offset, size):
+        """
+        Reads size bytes at an offset in the decompressed stream. Reads at increasing offsets (e.g. of every sample
+        in archive order, see Sample.get_read_order()) continue from the previous one, so they decompress the file
+        at most once more.
+        """
+        with self.lock:
+            index = bisect.bisect_right(self.checkpoint_offsets(), offset) - 1
+            out_position, raw_position, decompressor = self.checkpoints[index]
+
+            # Continue from the previous read, unless the checkpoint is closer
+            cursor = self.cursor
+            if cursor is None or offset < cursor.start or cursor.position < out_position:
+                if cursor is not None:
+                    cursor.close()
+                cursor = GzipCursor(self.path, raw_position, out_position, decompressor.copy() if decompressor is not None else None,
+                                    rewind_size=REWIND_SIZE)
+                self.cursor = cursor
+
+            cursor.seek(offset)
+            return cursor.read(size)
+
+    def checkpoint_offsets(self):
+        return [checkpoint[0] for checkpoint in self.checkpoints]
+
+    def close(self):
+        self.stream.close()
+        if self.cursor is not None:
+            self.cursor.close()
+
+    def __init__(self, path, checkpoint_interval=16 * 1024 * 1024):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = [(0, 0, None)]  # Format: [(decompressed_offset, compressed_offset, decompressor)], None: a new one
+        self.stream = GzipCursor(path, on_fill=self.add_checkpoint)  # Reads the file once, for tarfile
+        self.cursor = None  # GzipCursor of the last read_at()
+        self.lock = threading.Lock()
+
+
+class PlainFile(object):
+    """
+    An uncompressed tar file, read once from start to end (read()) and at any offset later (read_at()).
+    """
+
+    def read(self, size):
+        return self.stream.read(size)
+
+    def read_at(self, offset, size):
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def close(self):
+        self.stream.close()
+        self.file.close()
+
+    def __init__(self, path):
+        self.stream = open(path, "rb")
+        self.file = open(path, "rb")  # For read_at(), so it doesn't move the stream
+        self.lock = threading.Lock()
+
+
+class TarArchive(object):
+    """
+    A .tar or .tar.gz file with FastQC zip-files in a directory per sample, browsed without unpacking it.
+    The archive is streamed once (scan()): every zip-file is read into memory, where the sample it belongs to
+    reads summary.txt and fastqc_data.txt from it (see Sample.open_zip()), and the zip-file's offset in the tar
+    is kept. Zip-files are read again later (module tables, HTML reports) from their offset, without going through
+    the archive from the start (see GzipIndex).
+
+    Files in the archive get paths below the archive's own path, e.g. /runs/project.tar.gz/project/sample1/sample1_1.zip,
+    so samples in an archive look like samples in a directory.
+    """
+
+    def get_path(self, member_name):
+        """
+        Returns the path of a member of the archive, e.g. ./project/sample1 becomes ARCHIVE/project/sample1.
+        """
+        return self.path + "/" + os.path.normpath(member_name).lstrip("/")
+
+    def open_reader(self):
+        with open(self.path, "rb") as f:
+            magic = f.read(2)
+        if magic == GZIP_MAGIC:
+            return GzipIndex(self.path)
+        return PlainFile(self.path)
+
+    def scan(self, read_contents=True):
+        """
+        Streams the archive once. Yields the directory (path, see get_path()) of every sample after all of its
+        zip-files have been read. Until the next directory is yielded, their content is in memory, so the sample
+        can be created from it. A directory whose zip-files aren't next to each other in the archive is yielded again
+        at the end, when its other zip-files have been found.
+        :param read_contents: Only index the zip-files, e.g. to fetch a single report
+        """
+        self.reader = self.open_reader()
+        stream = tarfile.open(fileobj=self.reader, mode="r|")
+
+        current = None
+        yielded = set()
+        incomplete = []  # Directories that got more zip-files after they were yielded
+        try:
+            for member in stream:
+                if not member.isfile() or not member.name.endswith(".zip"):
+                    continue
+
+                path = self.get_path(member.name)
+                directory = os.path.dirname(path)
+                if directory != current:
+                    if current is not None:
+                        yield current
+                        yielded.add(current)
+                    self.contents.clear()
+                    current = directory
+                    if directory in yielded and directory not in incomplete:
+                        incomplete.append(directory)
+
+                self.members[path] = (member.offset_data, member.size)
+                self.zip_files.setdefault(directory, []).append(os.path.basename(path))
+                if read_contents:
+                    self.contents[path] = stream.extractfile(member).read()
+
+            if current is not None:
+                yield current
+            self.contents.clear()
+
+            for directory in incomplete:
+                yield directory
+        finally:
+            stream.close()
+
+    def get_offset(self, directory):
+        """
+        Returns the offset of the first zip-file of a directory in the archive, 0 if it has none.
+        """
+        offsets = [self.members[directory + "/" + name][0] for name in self.zip_files.get(directory, [])]
+        return min(offsets) if len(offsets) > 0 else 0
+
+    def list_zip_files(self, directory):
+        """
+        Returns the names of the zip-files in a directory of the archive.
+        """
+        return list(self.zip_files.get(directory, []))
+
+    def read_file(self, path):
+        """
+        Returns the content of a zip-file in the archive: from memory while it's scanned, otherwise read at its offset.
+        """
+        content = self.contents.get(path)
+        if content is not None:
+            return content
+
+        if path not in self.members:
+            raise IOError("No such file in %s: %s" % (self.path, path))
+        offset, size = self.members[path]
+        return self.reader.read_at(offset, size)
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.reader = None  # GzipIndex or PlainFile, see open_reader()
+        self.members = {}  # Format: {path: (offset, size)}, every zip-file in the archive
+        self.zip_files = {}  # Format: {directory: [zip_name]}
+        self.contents = {}  # Format: {path: content}, zip-files of the sample that's being created during scan()
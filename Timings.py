@@ -0,0 +1,112 @@
+import sys
+import time
+import pstats
+import cProfile
+from contextlib import contextmanager
+
+
+class Timings(object):
+    """
+    Wall time, bytes read and number of files per load phase (e.g. reading zip-files), and per sample.
+    A sample records its own phases in a Timings of its own (see Sample.timings), which is merged in with
+    add_sample(). That way samples loaded in worker processes are counted too. Per-sample phases are
+    summed over all samples, so with --jobs they can add up to more than the wall time of the load.
+    When timings are off, nothing creates a Timings and instrumented code only checks for None.
+    """
+
+    def add(self, phase, seconds, bytes_read=0, files=0):
+        """
+        Adds one call of a phase.
+        """
+        totals = self.phases.get(phase)
+        if totals is None:
+            totals = self.phases[phase] = [0.0, 0, 0, 0]
+            self.phase_order.append(phase)
+
+        totals[0] += seconds
+        totals[1] += bytes_read
+        totals[2] += files
+        totals[3] += 1
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        Times the code in a with-block as one call of a phase.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start)
+
+    def add_sample(self, name, sample_timings):
+        """
+        Merges the phases of a single sample, prefixed with "sample: ".
+        :param sample_timings: Timings recorded while loading the sample
+        """
+        seconds = 0.0
+        bytes_read = 0
+        files = 0
+        for phase in sample_timings.phase_order:
+            phase_seconds, phase_bytes, phase_files, calls = sample_timings.phases[phase]
+            self.add("sample: " + phase, phase_seconds, phase_bytes, phase_files)
+            seconds += phase_seconds
+            bytes_read += phase_bytes
+            files += phase_files
+
+        self.samples.append((seconds, bytes_read, files, name))
+
+    def print_summary(self, num_slowest=10, output=None):
+        """
+        Prints every phase and the slowest samples.
+        """
+        output = output or sys.stdout
+
+        print >> output, "Load timings:"
+        print >> output, "%-36s %10s %8s %8s %10s" % ("Phase", "Seconds", "Calls", "Files", "MB read")
+        for phase in self.phase_order:
+            seconds, bytes_read, files, calls = self.phases[phase]
+            print >> output, "%-36s %10.3f %8d %8d %10.1f" % (phase, seconds, calls, files, bytes_read / 1048576.0)
+        print >> output, "%-36s %10.3f" % ("Total (wall time)", time.time() - self.start_time)
+
+        if len(self.samples) == 0:
+            return
+
+        print >> output, ""
+        print >> output, "Slowest samples (of %d parsed):" % len(self.samples)
+        print >> output, "%-36s %10s %8s %10s" % ("Sample", "Seconds", "Files", "KB read")
+        for seconds, bytes_read, files, name in sorted(self.samples, reverse=True)[:num_slowest]:
+            print >> output, "%-36s %10.3f %8d %10.1f" % (name, seconds, files, bytes_read / 1024.0)
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.phases = {}  # Format: {phase: [seconds, bytes_read, files, calls]}
+        self.phase_order = []  # Phases in the order they were first recorded
+        self.samples = []  # Format: [(seconds, bytes_read, files, sample_name)]
+
+
+class Profiler(object):
+    """
+    Runs code under cProfile and writes the statistics to a file, which can be read with pstats
+    (python -m pstats FILE) or tools like snakeviz. Only the current process is profiled.
+    """
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stops profiling, writes the statistics file and prints the most expensive functions.
+        """
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+
+        stats = pstats.Stats(self.path, stream=self.output)
+        stats.sort_stats("cumulative").print_stats(self.num_functions)
+        print >> self.output, "Profile written to %s" % self.path
+
+    def __init__(self, path, num_functions=25, output=None):
+        self.path = path
+        self.num_functions = num_functions
+        self.output = output or sys.stdout
+        self.profile = cProfile.Profile()
@@ -0,0 +1,467 @@
+import json
+import gzip
+import urllib
+import urlparse
+import mimetypes
+import threading
+import BaseHTTPServer
+import SocketServer
+from StringIO import StringIO
+from QueryRunner import MODULE_NAMES, STATUSES
+from Sample import open_zip
+
+# Rows per page if the client doesn't ask for a number, and the most it can ask for
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Responses smaller than this aren't worth compressing
+MIN_GZIP_SIZE = 1024
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>FastQC browser</title>
+<style>
+body { font-family: sans-serif; font-size: 14px; margin: 20px; }
+table { border-collapse: collapse; margin-bottom: 10px; }
+th, td { padding: 3px 10px; border-bottom: 1px solid #ddd; text-align: left; }
+th { cursor: pointer; background: #f0f0f0; }
+th.sorted { background: #d8e4f0; }
+td.PASS { color: #2a7d2a; } td.WARN { color: #b07d00; } td.FAIL { color: #b02a2a; }
+a { color: #2a5db0; cursor: pointer; }
+.panel { display: inline-block; vertical-align: top; margin-right: 40px; }
+</style>
+</head>
+<body>
+<h2>FastQC browser</h2>
+<div class="panel">
+  <h3>Modules</h3>
+  <table id="modules"></table>
+</div>
+<div class="panel">
+  <h3>Samples</h3>
+  <div>
+    Name contains <input id="filter" size="15">
+    Module <select id="module"><option value="">(any)</option></select>
+    <select id="status"><option>FAIL</option><option>WARN</option><option>PASS</option></select>
+  </div>
+  <table id="samples"></table>
+  <div><a id="prev">&laquo; previous</a> <span id="page"></span> <a id="next">next &raquo;</a></div>
+</div>
+<div class="panel">
+  <h3 id="details-title"></h3>
+  <div id="reports"></div>
+  <table id="details"></table>
+</div>
+<script>
+var state = {sort: "fail", order: "desc", offset: 0, limit: 50};
+var moduleState = {sort: "module", order: "asc"};
+var STATUSES = ["PASS", "WARN", "FAIL"];
+
+function get(url, callback) {
+  var request = new XMLHttpRequest();
+  request.onload = function() { callback(JSON.parse(request.responseText)); };
+  request.open("GET", url);
+  request.send();
+}
+
+function query(params) {
+  var parts = [];
+  for (var key in params) { parts.push(key + "=" + encodeURIComponent(params[key])); }
+  return parts.join("&");
+}
+
+// Tables are built with DOM nodes and textContent, so sample names never end up in markup
+function render(table, data, sortState, onSort, onRow) {
+  table.textContent = "";
+  var header = table.insertRow();
+  data.columns.forEach(function(column) {
+    var th = document.createElement("th");
+    th.textContent = column;
+    if (sortState && sortState.sort === column) { th.className = "sorted"; }
+    th.onclick = function() { onSort && onSort(column); };
+    header.appendChild(th);
+  });
+  data.rows.forEach(function(row) {
+    var tr = table.insertRow();
+    row.forEach(function(value, j) {
+      var td = tr.insertCell();
+      var text = String(value);
+      if (STATUSES.indexOf(text) >= 0) { td.className = text; }
+      if (j === 0 && onRow) {
+        var a = document.createElement("a");
+        a.textContent = text;
+        a.onclick = function() { onRow(row); };
+        td.appendChild(a);
+      } else {
+        td.textContent = text;
+      }
+    });
+  });
+}
+
+function toggle(sortState, column) {
+  sortState.order = sortState.sort === column && sortState.order === "desc" ? "asc" : "desc";
+  sortState.sort = column;
+}
+
+function loadModules() {
+  get("/api/modules?" + query(moduleState), function(data) {
+    render(document.getElementById("modules"), data, moduleState, function(column) {
+      toggle(moduleState, column);
+      loadModules();
+    });
+  });
+}
+
+function loadSamples() {
+  var params = {sort: state.sort, order: state.order, offset: state.offset, limit: state.limit,
+                filter: document.getElementById("filter").value};
+  var module = document.getElementById("module").value;
+  if (module) { params.module = module; params.status = document.getElementById("status").value; }
+  get("/api/samples?" + query(params), function(data) {
+    render(document.getElementById("samples"), data, state, function(column) {
+      toggle(state, column);
+      state.offset = 0;
+      loadSamples();
+    }, function(row) { loadSample(row[0]); });
+    var last = Math.min(data.offset + data.limit, data.total);
+    document.getElementById("page").textContent = (data.total ? data.offset + 1 : 0) + "-" + last + " of " + data.total;
+  });
+}
+
+function loadSample(name) {
+  get("/api/sample?" + query({name: name}), function(data) {
+    document.getElementById("details-title").textContent = name;
+    var reports = document.getElementById("reports");
+    reports.textContent = "";
+    data.reports.forEach(function(report, i) {
+      if (i > 0) { reports.appendChild(document.createTextNode(" | ")); }
+      var a = document.createElement("a");
+      a.href = report.url;
+      a.target = "_blank";
+      a.textContent = "HTML report, read " + report.read;
+      reports.appendChild(a);
+    });
+    render(document.getElementById("details"), data);
+  });
+}
+
+document.getElementById("prev").onclick = function() { state.offset = Math.max(0, state.offset - state.limit); loadSamples(); };
+document.getElementById("next").onclick = function() { state.offset += state.limit; loadSamples(); };
+document.getElementById("filter").oninput = function() { state.offset = 0; loadSamples(); };
+document.getElementById("module").onchange = document.getElementById("status").onchange = function() { state.offset = 0; loadSamples(); };
+
+get("/api/module_names", function(data) {
+  var select = document.getElementById("module");
+  data.rows.forEach(function(row) {
+    var option = document.createElement("option");
+    option.value = row[0];
+    option.textContent = row[1];
+    select.appendChild(option);
+  });
+});
+loadModules();
+loadSamples();
+</script>
+</body>
+</html>
+"""
+
+
+class HttpError(Exception):
+    """
+    Raised by request handlers to send an error response.
+    """
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+def get_page_arguments(params):
+    """
+    Reads offset and limit from query parameters.
+    """
+    try:
+        offset = max(0, int(params.get("offset", 0)))
+        limit = min(MAX_PAGE_SIZE, max(1, int(params.get("limit", DEFAULT_PAGE_SIZE))))
+    except ValueError:
+        raise HttpError(400, "offset and limit must be numbers")
+    return offset, limit
+
+
+class DashboardRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the dashboard page, JSON tables (/api/...) and HTML reports with their images straight
+    from the FastQC zip-files (/report/<sample>/<read>/...).
+    """
+
+    def log_message(self, format, *args):
+        # One line per request is too much when paging through tables
+        pass
+
+    def send_content(self, content, content_type, cache=False):
+        """
+        Sends a response, gzip-compressed if the client accepts it and it's worth it.
+        """
+        compress = "gzip" in self.headers.get("Accept-Encoding", "") and len(content) >= MIN_GZIP_SIZE and \
+            (content_type.startswith("text/") or content_type in ("application/json", "application/javascript", "image/svg+xml"))
+
+        if compress:
+            buf = StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6)
+            gz.write(content)
+            gz.close()
+            content = buf.getvalue()
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Vary", "Accept-Encoding")
+        if compress:
+            self.send_header("Content-Encoding", "gzip")
+        if cache:
+            # Reports only change when their zip-file does
+            self.send_header("Cache-Control", "max-age=3600")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_json(self, data):
+        self.send_content(json.dumps(data), "application/json")
+
+    def send_error_json(self, code, message):
+        content = json.dumps({"error": message})
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query).items())
+
+        try:
+            if url.path == "/":
+                self.send_content(DASHBOARD_HTML, "text/html; charset=utf-8")
+            elif url.path.startswith("/api/"):
+                handler = self.server.api_handlers.get(url.path[len("/api/"):])
+                if handler is None:
+                    raise HttpError(404, "Unknown API: %s" % url.path)
+                self.send_json(self.server.call(handler, params))
+            elif url.path.startswith("/report/"):
+                self.send_report(url.path[len("/report/"):])
+            else:
+                raise HttpError(404, "Not found: %s" % url.path)
+        except HttpError as e:
+            self.send_error_json(e.code, str(e))
+
+    def send_report(self, path):
+        """
+        Sends a file from the directory of an HTML report in a zip-file.
+        :param path: <sample>/<read>/ for the report itself, <sample>/<read>/<file> for e.g. Images/per_base_quality.png
+        """
+        parts = path.split("/", 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise HttpError(404, "Expected /report/<sample>/<read>/")
+
+        sample_name = urllib.unquote(parts[0])
+        read_number = int(parts[1])
+        relative_path = urllib.unquote(parts[2]) if len(parts) > 2 else ""
+
+        # Redirect to a path ending in /, so relative links in the report (Images/...) resolve
+        if len(parts) == 2:
+            self.send_response(301)
+            self.send_header("Location", "/report/%s/%d/" % (parts[0], read_number))
+            self.end_headers()
+            return
+
+        zip_path, member = self.server.call(self.server.get_report_member, sample_name, read_number, relative_path)
+
+        zip_ref = open_zip(zip_path)
+        try:
+            content = zip_ref.read(member)
+        except KeyError:
+            raise HttpError(404, "No file %s in the report" % relative_path)
+        finally:
+            zip_ref.close()
+
+        content_type = mimetypes.guess_type(member)[0] or "application/octet-stream"
+        if content_type == "text/html":
+            content_type += "; charset=utf-8"
+        self.send_content(content, content_type, cache=True)
+
+
+class WebDashboard(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Web dashboard for headless machines, reached through an SSH tunnel (ssh -L PORT:localhost:PORT host).
+    Cohort tables are sorted and paged on the server, so the browser only receives one page at a time;
+    ordering by status uses SampleManager's ranked views, so a page is a slice rather than a sort.
+    Only listens on localhost. Requests are handled in threads, but run one at a time against the
+    SampleManager (see call()); reading reports from zip-files happens outside the lock.
+    """
+    daemon_threads = True
+
+    def call(self, function, *args):
+        """
+        Runs a function while holding the lock. In watch mode, new samples are merged in first.
+        """
+        with self.lock:
+            if self.watcher is not None:
+                self.watcher.merge_pending(self.sample_manager)
+            return function(*args)
+
+    def get_sorted_names(self):
+        """
+        Returns all sample names in natural order, sorted again only when samples have been added.
+        """
+        if self.sorted_names_generation != self.sample_manager.generation:
+            self.sorted_names = sorted(self.sample_manager.sample_names, key=self.sample_manager.sort_keys.get)
+            self.sorted_names_generation = self.sample_manager.generation
+        return self.sorted_names
+
+    def get_samples(self, params):
+        """
+        Page of samples with their number of PASS/WARN/FAILs.
+        Parameters: sort (sample, pass, warn, fail), order (asc, desc), offset, limit,
+        filter (part of the name), module and status (only samples with this status in the module).
+        """
+        manager = self.sample_manager
+        manager.load_statuses()
+        offset, limit = get_page_arguments(params)
+        sort = params.get("sort", "fail").lower()
+        descending = params.get("order", "desc").lower() == "desc"
+
+        # Samples in natural order, or ranked by a status (highest first)
+        if sort == "sample":
+            ordered = self.get_sorted_names()
+            get_name = lambda entry: entry
+            reverse = descending
+        elif sort.upper() in STATUSES:
+            ordered = manager.ranked_samples[sort.upper()]
+            get_name = lambda entry: entry[2]
+            reverse = not descending
+        else:
+            raise HttpError(400, "Can't sort samples by %s" % sort)
+
+        # Samples with a given status in a module
+        reads_by_name = None
+        if params.get("module"):
+            if params["module"] not in MODULE_NAMES:
+                raise HttpError(400, "Invalid module name: %s" % params["module"])
+            status = params.get("status", "FAIL").upper()
+            if status not in STATUSES:
+                raise HttpError(400, "Invalid status: %s" % status)
+            reads_by_name = manager.get_samples_by_module_and_status(MODULE_NAMES[params["module"]], status)
+
+        name_filter = params.get("filter", "").lower()
+        num_samples = len(ordered)
+        positions = xrange(num_samples - 1, -1, -1) if reverse else xrange(num_samples)
+
+        # Without filters a page is a slice, otherwise matches are counted while collecting the page
+        if reads_by_name is None and not name_filter:
+            total = num_samples
+            page_positions = xrange(offset, min(offset + limit, num_samples))
+            page = [get_name(ordered[num_samples - 1 - i if reverse else i]) for i in page_positions]
+        else:
+            total = 0
+            page = []
+            for i in positions:
+                name = get_name(ordered[i])
+                if reads_by_name is not None and name not in reads_by_name:
+                    continue
+                if name_filter and name_filter not in name.lower():
+                    continue
+                if offset <= total < offset + limit:
+                    page.append(name)
+                total += 1
+
+        columns = ["sample"] + [s.lower() for s in STATUSES]
+        rows = [[name] + [manager.status_counts[name][s] for s in STATUSES] for name in page]
+        if reads_by_name is not None:
+            columns.append("reads")
+            for row in rows:
+                row.append(" ".join(str(rn) for rn in reads_by_name[row[0]]))
+
+        return {"total": total, "offset": offset, "limit": limit, "columns": columns, "rows": rows}
+
+    def get_modules(self, params):
+        """
+        Number of PASS/WARN/FAILs per module. Parameters: sort (module, pass, warn, fail), order (asc, desc).
+        """
+        self.sample_manager.load_statuses()
+        module_stats = self.sample_manager.module_stats
+        sort = params.get("sort", "module").lower()
+        descending = params.get("order", "asc").lower() == "desc"
+
+        if sort == "module":
+            modules = sorted(module_stats.keys(), reverse=descending)
+        elif sort.upper() in STATUSES:
+            modules = sorted(module_stats.keys(), key=lambda m: (module_stats[m][sort.upper()], m), reverse=descending)
+        else:
+            raise HttpError(400, "Can't sort modules by %s" % sort)
+
+        rows = [[m] + [module_stats[m][s] for s in STATUSES] for m in modules]
+        return {"total": len(rows), "columns": ["module"] + [s.lower() for s in STATUSES], "rows": rows}
+
+    def get_module_names(self, params):
+        """
+        Module names as used in queries, with the names FastQC uses.
+        """
+        rows = sorted([name, fastqc_name] for name, fastqc_name in MODULE_NAMES.items())
+        return {"total": len(rows), "columns": ["module", "name"], "rows": rows}
+
+    def get_sample(self, params):
+        """
+        Status of every module and read of a sample, and links to its HTML reports. Parameter: name.
+        """
+        name = params.get("name", "")
+        if not self.sample_manager.has_sample(name):
+            raise HttpError(404, "Invalid sample name: %s" % name)
+        sample = self.sample_manager.get_sample_by_name(name)
+
+        read_numbers = sorted(set(rn for reads in sample.modules.values() for rn in reads))
+        rows = []
+        for module in sorted(sample.modules.keys()):
+            rows.append([module] + [sample.modules[module].get(rn, "") for rn in read_numbers])
+
+        reports = [{"read": rn, "url": "/report/%s/%d/" % (urllib.quote(sample.name), rn)} for rn in sorted(sample.html_reports.keys())]
+        return {"name": sample.name, "columns": ["module"] + ["read %d" % rn for rn in read_numbers], "rows": rows, "reports": reports}
+
+    def get_report_member(self, sample_name, read_number, relative_path):
+        """
+        Returns the zip-file and member for a file in the directory of a sample's HTML report.
+        """
+        if not self.sample_manager.has_sample(sample_name):
+            raise HttpError(404, "Invalid sample name: %s" % sample_name)
+        sample = self.sample_manager.get_sample_by_name(sample_name)
+
+        if read_number not in sample.html_reports:
+            raise HttpError(404, "No HTML report for read %d in sample %s" % (read_number, sample_name))
+
+        report = sample.html_reports[read_number]
+        if not relative_path:
+            return sample.read_zips[read_number], report
+
+        report_dir = report.rsplit("/", 1)[0] + "/" if "/" in report else ""
+        return sample.read_zips[read_number], report_dir + relative_path
+
+    def __init__(self, sample_manager, port, watcher=None):
+        self.sample_manager = sample_manager
+        self.watcher = watcher  # Optional DirectoryWatcher
+        self.lock = threading.Lock()
+        self.sorted_names = []
+        self.sorted_names_generation = None
+
+        # Format: {path after /api/: function(params)}
+        self.api_handlers = {
+            "samples": self.get_samples,
+            "modules": self.get_modules,
+            "module_names": self.get_module_names,
+            "sample": self.get_sample,
+        }
+
+        # Do stuff
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", port), DashboardRequestHandler)
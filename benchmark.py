@@ -0,0 +1,266 @@
+import argparse
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+import multiprocessing
+
+# Benchmarked code lives next to this file
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_synthetic_fastqc
+from SampleCache import get_zip_fingerprint
+from SampleManager import SampleManager
+from QueryRunner import QueryRunner
+from fastqc_browser import setup_samples, module_descriptions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_default_work_directory():
+    """
+    Returns where synthetic trees are kept by default, next to the sample cache (see SampleCache.get_default_cache_dir()),
+    so running the benchmark from the repository doesn't write gigabytes of zip-files into the working tree.
+    """
+    base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base_dir, "fastqc_browser", "benchmark")
+
+
+def handle_arguments():
+    parser = argparse.ArgumentParser(description="Times loading and querying synthetic FastQC trees of different sizes, and writes the results to a JSON file that can be compared across versions.")
+    parser.add_argument("-s", "--sizes", help="Comma-separated numbers of samples", default="100,10000,100000")
+    parser.add_argument("-d", "--work-directory", help="Where synthetic trees are generated (and reused by later runs), default: ~/.cache/fastqc_browser/benchmark",
+                        default=get_default_work_directory())
+    parser.add_argument("-o", "--output", help="JSON file to write results to (default: benchmark_results.json in the work directory)", required=False)
+    parser.add_argument("-r", "--reads", help="Read files per sample", type=int, default=2)
+    parser.add_argument("-l", "--lanes", help="Lanes per read (0 = no lanes)", type=int, default=0)
+    parser.add_argument("-j", "--jobs", help="Processes used to load samples, as in fastqc_browser.py --jobs", type=int, default=1)
+    parser.add_argument("--repeat", help="Times every query is run, the minimum and median are reported", type=int, default=5)
+    parser.add_argument("--label", help="Name for this run in the results, e.g. a version or branch", default="")
+    parser.add_argument("--compare", help="Earlier results file to compare with", metavar="JSON", required=False)
+    parser.add_argument("--run-size", help=argparse.SUPPRESS, type=int, required=False)
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = os.path.join(args.work_directory, "benchmark_results.json")
+    return args
+
+
+class Quiet(object):
+    """
+    Sends stdout to /dev/null, so timings include formatting output but not writing it to a terminal.
+    """
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        self.devnull = open(os.devnull, "w")
+        sys.stdout = self.devnull
+
+    def __exit__(self, *exc_info):
+        sys.stdout = self.stdout
+        self.devnull.close()
+
+
+def time_call(function, repeat=1):
+    """
+    Calls a function repeat times, with stdout suppressed.
+    :return timing: Dictionary with "min", "median" and "first" (seconds), and the function's last return value
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        with Quiet():
+            start = time.time()
+            result = function()
+            times.append(time.time() - start)
+
+    ordered = sorted(times)
+    return {"min": ordered[0], "median": ordered[len(ordered) // 2], "first": times[0], "runs": repeat}, result
+
+
+def get_tree(args, num_samples):
+    """
+    Returns the directory of a synthetic tree with num_samples samples, generating it if it doesn't exist yet.
+    """
+    tree_dir = os.path.abspath(os.path.join(args.work_directory, "samples%d_r%d_l%d" % (num_samples, args.reads, args.lanes)))
+    marker = os.path.join(tree_dir, ".complete")
+    if os.path.exists(marker):
+        return tree_dir
+
+    print >> sys.stderr, "Generating %d samples in %s ..." % (num_samples, tree_dir)
+    generator_args = argparse.Namespace(output_directory=tree_dir, reads=args.reads, lanes=args.lanes, read_length=101,
+                                        naming="illumina", seed=1, status_weights="70,15,15", module_status_weights=[])
+    weights = generate_synthetic_fastqc.get_status_weights(generator_args)
+    jobs = [(number, generator_args, weights) for number in range(1, num_samples + 1)]
+
+    if not os.path.isdir(tree_dir):
+        os.makedirs(tree_dir)
+    pool = multiprocessing.Pool(multiprocessing.cpu_count())
+    try:
+        for _ in pool.imap_unordered(generate_synthetic_fastqc.write_sample, jobs, 64):
+            pass
+    finally:
+        pool.close()
+        pool.join()
+
+    open(marker, "w").close()
+    return tree_dir
+
+
+def scan_directory(tree_dir):
+    """
+    What loading does before parsing: list sample directories and stat their zip-files.
+    """
+    num_zips = 0
+    for name in sorted(os.listdir(tree_dir)):
+        sample_path = os.path.join(tree_dir, name)
+        if os.path.isdir(sample_path):
+            num_zips += len(get_zip_fingerprint(sample_path))
+    return num_zips
+
+
+def run_size(args, num_samples):
+    """
+    Benchmarks a single tree size. Runs in its own process (see main()), so memory use is per size.
+    :return results: Dictionary {step: timing}, see time_call()
+    """
+    tree_dir = get_tree(args, num_samples)
+    results = {}
+
+    results["scan"], _ = time_call(lambda: scan_directory(tree_dir))
+    results["parse"], samples = time_call(lambda: setup_samples(tree_dir, args.jobs))
+    results["manager"], manager = time_call(lambda: SampleManager(samples))
+    results["collect_global_summary_stats"], _ = time_call(manager.collect_global_summary_stats, args.repeat)
+    results["collect_stats_per_module"], _ = time_call(manager.collect_stats_per_module, args.repeat)
+
+    # Every REPL query, as called by read_input()
+    sample_name = manager.sample_names[len(manager.sample_names) // 2]
+    queries = [
+        ("print_global_stats", manager.print_global_summary),
+        ("print_module_stats", manager.print_module_stats),
+        ("print_sample_details", lambda: manager.print_sample_details(sample_name)),
+        ("print_samples_by_status_in_module", lambda: manager.print_samples_by_module_and_status("Adapter Content", "FAIL")),
+        ("print_all_samples_orderby_status", lambda: manager.print_samples_orderby_status("FAIL")),
+        ("print_all_modules_orderby_status", lambda: manager.print_modules_orderby_status("FAIL")),
+        ("print_metric_by_position", lambda: manager.print_metric_by_position("Per base sequence quality", "Mean", "50", 1)),
+        ("open_sample_html_report", lambda: manager.get_html_report_by_name_and_read(sample_name, 1)),
+    ]
+
+    results["queries"] = {}
+    for name, function in queries:
+        results["queries"][name], _ = time_call(function, args.repeat)
+
+    # The same queries as run by batch mode, the query server and the web dashboard
+    runner = QueryRunner(manager, module_descriptions)
+    command_lines = [
+        "print_global_stats",
+        "print_module_stats",
+        "print_sample_details %s" % sample_name,
+        "print_samples_by_status_in_module adapter_content FAIL",
+        "print_all_samples_orderby_status FAIL",
+        "print_all_modules_orderby_status FAIL",
+        "print_module_description adapter_content",
+        "print_metric_by_position per_base_sequence_quality 1 Mean 50",
+        "open_sample_html_report %s 1" % sample_name,
+        "list_samples",
+    ]
+
+    results["query_runner"] = {}
+    for line in command_lines:
+        timing, result = time_call(lambda: runner.run(line), args.repeat)
+        if "error" in result:
+            print >> sys.stderr, "ERROR: '%s' failed: %s" % (line, result["error"])
+        results["query_runner"][line.split()[0]] = timing
+
+    results["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=""):
+    """
+    Flattens results into {"100/parse": seconds, "100/queries/print_module_stats": seconds, ...}, using the minimum time.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict) and "min" in value:
+            flat[prefix + key] = value["min"]
+        elif isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "/"))
+    return flat
+
+
+def compare(old_path, new_results):
+    """
+    Prints every timing in both result files, with the ratio new/old.
+    """
+    with open(old_path) as f:
+        old_results = json.load(f)
+
+    old = flatten(old_results["sizes"])
+    new = flatten(new_results["sizes"])
+
+    print "Comparing with %s (%s)" % (old_path, old_results.get("label") or old_results.get("git_commit"))
+    print "%-60s %12s %12s %8s" % ("Step", "Old (s)", "New (s)", "New/Old")
+    for key in sorted(set(old) & set(new), key=lambda k: (int(k.split("/")[0]), k)):
+        ratio = new[key] / old[key] if old[key] > 0 else float("inf")
+        print "%-60s %12.4f %12.4f %8.2f" % (key, old[key], new[key], ratio)
+
+
+def main():
+    args = handle_arguments()
+
+    # Child process: benchmark one size and print the results as JSON
+    if args.run_size is not None:
+        results = run_size(args, args.run_size)
+        sys.stdout.write(json.dumps(results))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    output = {
+        "label": args.label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__ if np is not None else None,
+        "platform": platform.platform(),
+        "cpus": multiprocessing.cpu_count(),
+        "parameters": {"reads": args.reads, "lanes": args.lanes, "jobs": args.jobs, "repeat": args.repeat},
+        "sizes": {}
+    }
+
+    for num_samples in sizes:
+        print "Benchmarking %d samples ..." % num_samples
+        command = [sys.executable, os.path.abspath(__file__), "--run-size", str(num_samples),
+                   "--work-directory", args.work_directory, "--reads", str(args.reads), "--lanes", str(args.lanes),
+                   "--jobs", str(args.jobs), "--repeat", str(args.repeat)]
+        results = json.loads(subprocess.check_output(command))
+        output["sizes"][str(num_samples)] = results
+
+        print "  scan %.3fs, parse %.3fs, manager %.3fs, peak memory %d MB" % (
+            results["scan"]["min"], results["parse"]["min"], results["manager"]["min"], results["max_rss_kb"] // 1024)
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print "Results written to %s" % args.output
+
+    if args.compare:
+        compare(args.compare, output)
+
+if __name__ == "__main__":
+    main()
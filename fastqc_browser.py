@@ -1,11 +1,29 @@
 import argparse
 import os
 import sys
-from Sample import Sample
+import socket
+import pipes
+import signal
+import time
+from Sample import Sample, extract_html_report
 from SampleManager import SampleManager
-from AutoCompleter import MyCompleter
+from SampleCache import SampleCache
+from DirectoryWatcher import DirectoryWatcher
+from AutoCompleter import MyCompleter, CompletionIndex
+from QueryRunner import QueryRunner, MODULE_NAMES, STATUSES, run_batch, format_text, format_result
+from QueryServer import QueryServer, QueryClient, DEFAULT_SOCKET_MODE
+from WebDashboard import WebDashboard
+from Timings import Timings, Profiler
+from OutlierEngine import METRICS
+from TableRenderer import TableRenderer, get_pager
+import Exporter
+from SqliteBackend import SqliteBackend, SqliteQueryRunner
+import RunDiff
+import TarArchive
 import webbrowser
 import readline
+import multiprocessing
+import threading
 
 module_descriptions = {
         # Per tile sequence quality
@@ -325,7 +343,30 @@ This module is generally fairly robust and errors here usually indicate a genera
 
 def handle_arguments():
     parser = argparse.ArgumentParser(add_help=False)
-    parser.add_argument("-i", "--input-directory", help="Path to parent directory containing all sample directories. Provide absolute paths", required=False)
+    parser.add_argument("-i", "--input-directory", help="Path to parent directory containing all sample directories, or a .tar/.tar.gz archive of them. Provide absolute paths", required=False)
+    parser.add_argument("-j", "--jobs", help="Number of processes used to load samples (0 means one per CPU)", type=int, default=1, required=False)
+    parser.add_argument("--cache-dir", help="Directory for the parsed-sample cache (default: ~/.cache/fastqc_browser/...)", required=False)
+    parser.add_argument("--cache-hash", help="Also compare MD5 checksums of zip-files when validating the cache", action="store_true", required=False)
+    parser.add_argument("--no-cache", help="Don't read or write the parsed-sample cache", action="store_true", required=False)
+    parser.add_argument("-w", "--watch", help="Keep loading new or changed sample directories while running", action="store_true", required=False)
+    parser.add_argument("--watch-interval", help="Seconds between scans of the input directory in watch mode", type=float, default=10, required=False)
+    parser.add_argument("-b", "--batch", help="Run the commands in FILE (one per line, - for stdin) and exit", metavar="FILE", required=False)
+    parser.add_argument("--format", help="Output format in batch mode (default tsv), and of tables when stdout is not a terminal", choices=["tsv", "json", "text"], required=False)
+    parser.add_argument("--limit", help="Print at most N rows of every table", metavar="N", type=int, required=False)
+    parser.add_argument("--offset", help="Skip the first N rows of every table", metavar="N", type=int, default=0, required=False)
+    parser.add_argument("--no-pager", help="Don't show tables that are taller than the terminal in a pager", action="store_true", required=False)
+    parser.add_argument("--serve", help="Load samples once and answer queries on a Unix socket", metavar="SOCKET", required=False)
+    parser.add_argument("--socket-mode", help="Permissions of the --serve socket, in octal (default: 660, the owner and group can connect)", metavar="MODE", required=False)
+    parser.add_argument("--web", help="Serve a web dashboard on localhost:PORT", metavar="PORT", type=int, required=False)
+    parser.add_argument("--connect", help="Send queries to a server started with --serve instead of loading samples", metavar="SOCKET", required=False)
+    parser.add_argument("--timings", help="Print the time spent in every phase of loading, and the slowest samples", action="store_true", required=False)
+    parser.add_argument("--profile", help="Profile loading with cProfile and write the statistics to FILE", metavar="FILE", required=False)
+    parser.add_argument("--lazy", help="Only list sample directories at startup, read the zip-files when they're needed", action="store_true", required=False)
+    parser.add_argument("--export", help="Write statuses and Basic Statistics to PATH (Parquet directory or SQLite file) and exit", metavar="PATH", required=False)
+    parser.add_argument("--export-format", help="Format of --export (default: parquet if pyarrow is installed, otherwise sqlite)", choices=Exporter.FORMATS, required=False)
+    parser.add_argument("--export-modules", help="Also export every numeric value of the module tables", action="store_true", required=False)
+    parser.add_argument("--sqlite", help="Run queries as SQL against an indexed SQLite database at DB, kept between sessions", metavar="DB", required=False)
+    parser.add_argument("--diff", help="Compare the samples of the input directory with those of OTHER_DIR and exit", metavar="OTHER_DIR", required=False)
     parser.add_argument("-h", "--help", help="Print help text", action="store_true", required=False)
     args = parser.parse_args()
 
@@ -333,54 +374,260 @@ def handle_arguments():
         print_help()
         sys.exit()
 
-    if not args.input_directory:
+    # A client doesn't load anything itself
+    if not args.input_directory and not args.connect:
         print_help()
         sys.exit()
 
-    # Get path from args
-    parent_dir = args.input_directory
+    if (args.serve or args.web) and (args.batch or args.connect):
+        print "ERROR: --serve and --web can't be combined with --batch or --connect"
+        sys.exit()
+
+    if args.serve and args.web:
+        print "ERROR: --serve and --web can't be combined"
+        sys.exit()
+
+    if args.socket_mode is not None and not args.serve:
+        print "ERROR: --socket-mode needs --serve"
+        sys.exit()
+
+    if args.socket_mode is not None:
+        try:
+            args.socket_mode = int(args.socket_mode, 8)
+        except ValueError:
+            args.socket_mode = -1
+        if not 0 <= args.socket_mode <= 0777:
+            print "ERROR: --socket-mode must be octal permissions, e.g. 660"
+            sys.exit()
+
+    if args.connect and (args.timings or args.profile):
+        print "ERROR: --timings and --profile measure loading, which --connect doesn't do"
+        sys.exit()
+
+    if (args.limit is not None and args.limit < 0) or args.offset < 0:
+        print "ERROR: --limit and --offset must be 0 or more"
+        sys.exit()
+
+    if args.jobs < 0:
+        print "ERROR: --jobs must be 0 or more"
+        sys.exit()
+
+    if args.export and (args.batch or args.serve or args.web or args.connect):
+        print "ERROR: --export can't be combined with --batch, --serve, --web or --connect"
+        sys.exit()
+
+    if args.export_format == "parquet" and Exporter.pyarrow is None:
+        print "ERROR: Exporting to Parquet needs pyarrow, use --export-format sqlite"
+        sys.exit()
+
+    if args.sqlite and (args.connect or args.web):
+        print "ERROR: --sqlite can't be combined with --connect or --web"
+        sys.exit()
+
+    if args.connect and args.lazy:
+        print "ERROR: --lazy can't be combined with --connect"
+        sys.exit()
+
+    if args.diff and (args.batch or args.serve or args.web or args.connect or args.export or args.sqlite or args.lazy or args.watch):
+        print "ERROR: --diff can't be combined with --batch, --serve, --web, --connect, --export, --sqlite, --lazy or --watch"
+        sys.exit()
 
-    return parent_dir
+    if args.diff and (args.timings or args.profile):
+        print "ERROR: --timings and --profile can't be combined with --diff"
+        sys.exit()
 
+    if args.diff and RunDiff.np is None:
+        print "ERROR: --diff needs numpy"
+        sys.exit()
 
-def setup_samples(parent_dir):
+    if args.input_directory and TarArchive.is_archive(args.input_directory) and (args.lazy or args.watch):
+        print "ERROR: --lazy and --watch need a directory, not an archive"
+        sys.exit()
+
+    if args.diff and not os.path.isdir(args.diff) and not TarArchive.is_archive(args.diff):
+        print "ERROR: Directory %s does not exist" % args.diff
+        sys.exit(1)
+
+    if args.batch and args.batch != "-" and not os.path.isfile(args.batch):
+        print "ERROR: Batch file %s does not exist" % args.batch
+        sys.exit()
+
+    return args
+
+
+def load_sample_state(paths):
     """
-    Reads samples directories and creates objects for each sample.
+    Parses a single sample directory and returns the sample's state (see Sample.get_state()) and its timings.
+    Runs in worker processes, so it returns plain containers rather than the Sample object.
+    Returns None if the sample could not be loaded.
+    :param paths: Tuple of (absolute sample path, absolute parent directory, record timings)
+    :return (state, timings): Timings is None unless they're recorded (see --timings)
     """
-    print "Reading directory %s ..." % parent_dir
+    sample_path, parent_dir, record_timings = paths
+    Sample.record_timings = record_timings
+    try:
+        sample = Sample(sample_path, parent_dir)
+    except SystemExit:
+        # Sample() has already printed the reason
+        return None
+    return sample.get_state(), sample.timings
 
-    # Container to keep sample objects
-    samples = []
 
-    # Get subdirectories in parent dir
-    subdirs = [os.path.join(parent_dir, s) for s in os.listdir(parent_dir) if os.path.isdir(os.path.join(parent_dir, s))]
-    for sd in subdirs:
-        # Loop files in sample directory
-        abs_sample_path = os.path.abspath(os.path.join(parent_dir, sd))
+def setup_samples(parent_dir, jobs=1, cache=None, timings=None, lazy=False):
+    """
+    Reads samples directories and creates objects for each sample.
+    :param parent_dir: Directory containing one directory per sample
+    :param jobs: Number of worker processes to load samples with (0 means one per CPU)
+    :param cache: Optional SampleCache. Samples that haven't changed since they were cached are not parsed again
+    :param timings: Optional Timings, gets the time spent in every phase of loading and per parsed sample
+    :param lazy: Don't parse samples that aren't cached, they're loaded on demand (see Sample.load()) and
+                 added to the cache when it's saved
+    """
+    # Samples in a tar archive are created while streaming it
+    if TarArchive.is_archive(parent_dir):
+        return setup_archive_samples(parent_dir)
 
-        # Create sample object
-        sample = Sample(abs_sample_path, os.path.abspath(parent_dir))
+    print "Reading directory %s ..." % parent_dir
+
+    # Samples record their own timings, merged in below
+    Sample.record_timings = timings is not None
+
+    # Get subdirectories in parent dir, sorted so samples always come in the same order
+    start = time.time()
+    subdirs = [os.path.join(parent_dir, s) for s in sorted(os.listdir(parent_dir)) if os.path.isdir(os.path.join(parent_dir, s))]
+    sample_paths = [(os.path.abspath(os.path.join(parent_dir, sd)), os.path.abspath(parent_dir)) for sd in subdirs]
+    if timings is not None:
+        timings.add("find sample directories", time.time() - start)
+
+    # Container to keep sample objects, in the same order as the sample paths
+    samples = [None] * len(sample_paths)
+
+    # Take unchanged samples from the cache, the rest has to be parsed
+    start = time.time()
+    fingerprints = {}  # Format: {index: fingerprint}
+    to_load = []  # Indices of samples that must be parsed
+    for i, (abs_sample_path, abs_parent_dir) in enumerate(sample_paths):
+        if cache is None:
+            to_load.append(i)
+            continue
 
-        # Add to samples collection
-        samples.append(sample)
+        fingerprints[i] = cache.get_fingerprint(abs_sample_path)
+        state = cache.get(abs_sample_path, fingerprints[i])
+        if state is None:
+            to_load.append(i)
+        else:
+            samples[i] = Sample.from_state(state)
+
+    if cache is not None:
+        print "Found %d of %d samples in cache" % (len(sample_paths) - len(to_load), len(sample_paths))
+        if timings is not None:
+            timings.add("check cache", time.time() - start, 0, sum(len(f) for f in fingerprints.values()))
+
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+
+    # Only create the sample objects, their zip-files are read when they're needed
+    start = time.time()
+    if lazy:
+        for i in to_load:
+            abs_sample_path, abs_parent_dir = sample_paths[i]
+            samples[i] = Sample(abs_sample_path, abs_parent_dir, lazy=True)
+            if cache is not None:
+                cache.put_sample(abs_sample_path, fingerprints[i], samples[i])
+
+    # Load everything in this process
+    elif jobs == 1 or len(to_load) < 2:
+        for i in to_load:
+            abs_sample_path, abs_parent_dir = sample_paths[i]
+
+            # Create sample object
+            samples[i] = Sample(abs_sample_path, abs_parent_dir)
+
+            if timings is not None:
+                timings.add_sample(samples[i].name, samples[i].timings)
+                samples[i].timings = None
+
+    # Spread samples across worker processes. imap() returns results in the same order as the input
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(to_load)))
+        chunksize = max(1, len(to_load) // (jobs * 4))
+        try:
+            results = pool.imap(load_sample_state, [sample_paths[i] + (timings is not None,) for i in to_load], chunksize)
+            for i, result in zip(to_load, results):
+                if result is None:
+                    print "ERROR: Failed to load all samples. Exiting."
+                    pool.terminate()
+                    sys.exit()
+                samples[i] = Sample.from_state(result[0])
+
+                if timings is not None:
+                    timings.add_sample(samples[i].name, result[1])
+        finally:
+            pool.close()
+            pool.join()
+
+    if timings is not None:
+        timings.add("create samples" if lazy else "parse samples (wall time)", time.time() - start)
+        Sample.record_timings = False
+
+    # Store newly parsed samples
+    if cache is not None and not lazy:
+        start = time.time()
+        for i in to_load:
+            cache.put(sample_paths[i][0], fingerprints[i], samples[i].get_state())
+        cache.save()
+        if timings is not None:
+            timings.add("save cache", time.time() - start)
 
     # Return all samples
     return samples
 
 
+def setup_archive_samples(archive_path):
+    """
+    Creates a sample for every sample directory in a .tar or .tar.gz file, reading the archive once (see TarArchive).
+    The zip-files of a sample are read from memory, and later (module tables, HTML reports) from their offset
+    in the archive, so nothing is unpacked to disk.
+    :return samples: Samples sorted by the path of their directory in the archive
+    """
+    print "Reading archive %s ..." % archive_path
+    start = time.time()
+
+    archive = TarArchive.open_archive(archive_path)
+    samples = {}  # Format: {sample_dir: Sample}
+    for sample_dir in archive.scan():
+        samples[sample_dir] = Sample(sample_dir, os.path.dirname(sample_dir))
+
+    print "Read %d samples (%d zip-files) in %.1f seconds" % (len(samples), len(archive.members), time.time() - start)
+    return [samples[sample_dir] for sample_dir in sorted(samples)]
+
+
 def open_html_report(path, sample_manager, sample_name, read_number):
     """
     Opens a given html file in a webbrowser. If there is no webbrowser available,
     a textual representation of the report (i.e. without figures) are fetched and displayed.
+    :param sample_manager: SampleManager to print the textual representation with. If None (client mode), the path is printed
     """
     try:
         webbrowser.get()
         webbrowser.open("file://" + os.path.realpath(path))
     except webbrowser.Error as e:
+        if sample_manager is None:
+            print "Something went wrong when opening webbrowser (Error: %s). The report is in %s" % (e, path)
+            return
         print "Something went wrong when opening webbrowser (Error: %s). Fall back to textual representation:" % e
+        print "(On machines without a desktop, start with --web PORT to browse reports through an SSH tunnel)"
         sample_manager.print_sample_details_by_readnumber(sample_name, read_number)
 
 
+def set_completer(options):
+    """
+    Sets the options for tab-completion at the next prompt.
+    :param options: CompletionIndex, or a list for small option lists that change between prompts
+    """
+    readline.set_completer(MyCompleter(options).complete)
+
+
 def print_query_help():
     print "=============== SUPPORTED COMMANDS ==============="
     print "help                               - prints this message"
@@ -393,6 +640,15 @@ def print_query_help():
     print "print_all_samples_orderby_status   - prints all samples ordered by PASS/WARN/FAILs"
     print "print_all_modules_orderby_status   - prints all modules ordered by PASS/WARN/FAILs"
     print "print_module_description           - prints textual description of given module"
+    print "print_metric_by_position           - prints a module metric at one position for all samples"
+    print "print_read_count_stats             - prints percentiles of the number of reads, by worst status"
+    print "print_read_count_histogram         - prints a histogram of the number of reads (log scale)"
+    print "print_read_counts_by_status        - prints the number of reads of files that PASS/WARN/FAIL a module"
+    print "print_low_depth_reads              - prints read files with fewer reads than a fraction of the median"
+    print "print_outlier_samples              - prints samples that differ most from the cohort in a metric (robust z-scores)"
+    print "print_outlier_positions            - prints the positions of a metric where most samples are outliers"
+    print "query                              - prints read files matching a filter, e.g. FAIL in adapter_content and"
+    print "                                     reads < 5e6 sort reads limit 20 (see README for the syntax)"
 
 
 def print_help():
@@ -422,6 +678,31 @@ def print_help():
     print ""
     print "python fastqc_browser.py --input-directory fastqc_output"
     print ""
+    print "Optional arguments:"
+    print "-j / --jobs N            load samples with N processes (0 = one per CPU)"
+    print "--cache-dir DIRECTORY    where to keep parsed samples between sessions"
+    print "--cache-hash             validate the cache with checksums, not only size/mtime"
+    print "--no-cache               always parse every sample"
+    print "-w / --watch             keep loading new sample directories while running"
+    print "--watch-interval SECONDS how often to scan for new samples in watch mode"
+    print "-b / --batch FILE        run the commands in FILE (- for stdin), print results and exit"
+    print "--format tsv|json|text   output format in batch mode (default: tsv), and of tables when not on a terminal"
+    print "--limit N                print at most N rows of every table"
+    print "--offset N               skip the first N rows of every table"
+    print "--no-pager               don't page tables that are taller than the terminal"
+    print "--serve SOCKET           load samples once and answer queries on a Unix socket"
+    print "--socket-mode MODE       permissions of the --serve socket (default 660)"
+    print "--connect SOCKET         query a server started with --serve (no -i needed)"
+    print "--web PORT               serve a web dashboard on http://localhost:PORT/"
+    print "--timings                print time, bytes and files per loading phase and the slowest samples"
+    print "--profile FILE           profile loading with cProfile, statistics are written to FILE"
+    print "--lazy                   only list sample directories at startup, read zip-files when needed"
+    print "--export PATH            write statuses and Basic Statistics to Parquet (directory) or SQLite (file)"
+    print "--export-format FORMAT   parquet or sqlite (default: parquet if pyarrow is installed)"
+    print "--export-modules         also export every numeric value of the module tables"
+    print "--sqlite DB              answer queries with SQL against an indexed SQLite database"
+    print "--diff OTHER_DIR         compare the samples with those of OTHER_DIR, print the differences and exit"
+    print ""
     print "After everything is loaded, you'll be prompted for keyboard input."
     print "Type 'help' to see all available commands, or press the <TAB> "
     print "key (sometimes twice) for suggestions and auto-completion."
@@ -434,9 +715,11 @@ def print_help():
     print "================================================"
 
 
-def read_input(sample_manager):
+def read_input(sample_manager, watcher=None):
     """
     Continuous loop that reads keyboard input and interprets queries
+    :param sample_manager: SampleManager to query
+    :param watcher: Optional DirectoryWatcher. Samples it has found are merged in before each query
     """
 
     # Supported commands for auto-completion
@@ -451,43 +734,33 @@ def read_input(sample_manager):
         "print_all_samples_orderby_status",
         "print_all_modules_orderby_status",
         "print_module_description",
+        "print_metric_by_position",
+        "print_read_count_stats",
+        "print_read_count_histogram",
+        "print_read_counts_by_status",
+        "print_low_depth_reads",
+        "print_outlier_samples",
+        "print_outlier_positions",
+        "query",
     ]
 
-    # Supported module-names for auto-completion
-    supported_module_names = [
-        "per_tile_sequence_quality",
-        "per_base_sequence_quality",
-        "sequence_duplication_levels",
-        "per_base_sequence_content",
-        "per_sequence_gc_content",
-        "sequence_length_distribution",
-        "kmer_content",
-        "basic_statistics",
-        "adapter_content",
-        "overrepresented_sequences",
-        "per_base_n_content",
-        "per_sequence_quality_scores"
-    ]
+    # Supported module-names and statuses for auto-completion
+    supported_module_names = sorted(MODULE_NAMES.keys())
+    supported_statuses = STATUSES
+    supported_metrics = [m[0] for m in METRICS]
 
-    # Supported statuses for auto-completion
-    supported_statuses = ["PASS", "WARN", "FAIL"]
-
-    modules = {
-        "pertilesequencequality": "Per tile sequence quality",
-        "perbasesequencequality": "Per base sequence quality",
-        "sequenceduplicationlevels": "Sequence Duplication Levels",
-        "perbasesequencecontent": "Per base sequence content",
-        "persequencegccontent": "Per sequence GC content",
-        "sequencelengthdistribution": "Sequence Length Distribution",
-        "kmercontent": "Kmer Content",
-        "basicstatistics": "Basic Statistics",
-        "adaptercontent": "Adapter Content",
-        "overrepresentedsequences": "Overrepresented sequences",
-        "perbasencontent": "Per base N content",
-        "persequencequalityscores": "Per sequence quality scores"
-    }
+    # Filter queries are run (and kept once parsed) by a query runner
+    query_runner = QueryRunner(sample_manager, module_descriptions, sample_manager.renderer.limit, sample_manager.renderer.offset)
+
+    # Completion indices are built once and shared by all prompts
+    command_index = CompletionIndex(supported_start_commands)
+    module_index = CompletionIndex(supported_module_names)
+    status_index = CompletionIndex(supported_statuses)
+    sample_index = CompletionIndex(sample_manager.sample_names)
 
-    all_sample_names = [s.name for s in sample_manager.all_samples]
+    # Complete whole sample names, even if they contain e.g. "-"
+    readline.set_completer_delims(" \t\n")
+    readline.parse_and_bind('tab: complete')
 
     print "===== SUBMIT QUERY ====="
     print "(type 'help' for help)"
@@ -495,13 +768,15 @@ def read_input(sample_manager):
 
     while True:
         # Setup auto-completer
-        completer = MyCompleter(supported_start_commands)
-        readline.set_completer(completer.complete)
-        readline.parse_and_bind('tab: complete')
+        set_completer(command_index)
 
         # Read input from keyboard
         choice = raw_input("> ").lower()
 
+        # Add samples that have appeared while waiting for input
+        if watcher is not None and watcher.merge_pending(sample_manager) > 0:
+            sample_index.update(sample_manager.sample_names)
+
         # Quit
         if choice.startswith("exit"):
             print "Exiting.."
@@ -516,24 +791,20 @@ def read_input(sample_manager):
         if choice.startswith("open_sample_html_report"):
 
             # Set auto-completer for sample names
-            completer = MyCompleter(all_sample_names)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(sample_index)
 
             # Read sample name from keyboard
             sample_name = raw_input(">> Sample name: ")
 
             # Check if sample name is valid
-            if sample_name not in all_sample_names:
+            if not sample_manager.has_sample(sample_name):
                 print "DOES NOT COMPUTE; INVALID SAMPLE NAME"
                 continue
 
             # Setup auto-completer for read number
             sample = sample_manager.get_sample_by_name(sample_name)
             read_num_options = [str(k) for k in sample.read_dirs.keys()]
-            completer = MyCompleter(read_num_options)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(read_num_options)
 
             # Read read number from input
             read_number = int(raw_input(">>> Read file number: "))
@@ -546,15 +817,13 @@ def read_input(sample_manager):
         # Print sample details
         if choice.lower().startswith("print_sample_details"):
             # Setup auto-completer for sample names
-            completer = MyCompleter(all_sample_names)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(sample_index)
 
             # Read sample name from keyboard
             sample_name = raw_input(">> Sample name: ")
 
             # Check if sample name is valid
-            if sample_name not in all_sample_names:
+            if not sample_manager.has_sample(sample_name):
                 print "BLEEP BLOP, DOES NOT COMPUTE! INVALID SAMPLE NAME: %s" % sample_name
                 continue
 
@@ -565,9 +834,7 @@ def read_input(sample_manager):
         # Print samples by module and status
         if choice.lower().startswith("print_samples_by_status_in_module"):
             # Setup auto-completer for module names
-            completer = MyCompleter(supported_module_names)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(module_index)
 
             # Read module name
             module_name = raw_input(">> Module name: ")
@@ -578,13 +845,10 @@ def read_input(sample_manager):
                 continue
 
             # Get module
-            lookup = module_name.replace(" ", "").replace("_", "")
-            module_query = modules[lookup]
+            module_query = MODULE_NAMES[module_name]
 
             # Setup auto-completer for status
-            completer = MyCompleter(supported_statuses)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(status_index)
 
             # Read status
             status_name = raw_input(">>> Status: ")
@@ -612,9 +876,7 @@ def read_input(sample_manager):
         if choice.startswith("print_all_modules_orderby_status"):
 
             # Setup auto-completer for statuses
-            completer = MyCompleter(supported_statuses)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(status_index)
 
             # Read status
             status_name = raw_input("> Status: ")
@@ -632,9 +894,7 @@ def read_input(sample_manager):
         if choice.startswith("print_all_samples_orderby_status"):
 
             # Setup auto-completer for status
-            completer = MyCompleter(supported_statuses)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(status_index)
 
             # Read status
             status_name = raw_input("> Order samples by status: ")
@@ -648,12 +908,138 @@ def read_input(sample_manager):
             sample_manager.print_samples_orderby_status(status_name)
             continue
 
+        # Print a module metric at one position for all samples
+        if choice.startswith("print_metric_by_position"):
+            # Setup auto-completer for module name
+            set_completer(module_index)
+
+            # Read module name
+            module_name = raw_input(">> Module name: ")
+
+            # Validate
+            if module_name not in supported_module_names:
+                print "BLEEP BLOP, DOES NOT COMPUTE! INVALID MODULE NAME: %s" % module_name
+                continue
+
+            # Get module
+            module_query = MODULE_NAMES[module_name]
+
+            # Setup auto-completer for read number
+            set_completer(["1", "2"])
+
+            # Read read number
+            read_number = raw_input(">>> Read file number: ")
+            if not read_number.isdigit():
+                print "BLEEP BLOP, DOES NOT COMPUTE! INVALID READ NUMBER: %s" % read_number
+                continue
+            read_number = int(read_number)
+
+            # Setup auto-completer for the columns in this module
+            columns = sample_manager.get_metric_columns(module_query, read_number)
+            if len(columns) == 0:
+                print "No numeric data in module '%s'" % module_query
+                continue
+            set_completer(columns)
+
+            # Read column
+            column = raw_input(">>>> Column (%s): " % ", ".join(columns))
+            if column not in columns:
+                print "BLEEP BLOP, DOES NOT COMPUTE! INVALID COLUMN: %s" % column
+                continue
+
+            # Read position
+            position = raw_input(">>>>> Position: ")
+
+            sample_manager.print_metric_by_position(module_query, column, position, read_number)
+            continue
+
+        # Print read count percentiles
+        if choice.startswith("print_read_count_stats"):
+            sample_manager.print_read_count_stats()
+            continue
+
+        # Print read count histogram
+        if choice.startswith("print_read_count_histogram"):
+            sample_manager.print_read_count_histogram()
+            continue
+
+        # Print read counts of files that PASS, WARN or FAIL a module
+        if choice.startswith("print_read_counts_by_status"):
+            # Setup auto-completer for module name
+            set_completer(module_index)
+
+            # Read module name
+            module_name = raw_input(">> Module name: ")
+
+            # Validate
+            if module_name not in supported_module_names:
+                print "BLEEP BLOP, DOES NOT COMPUTE! INVALID MODULE NAME: %s" % module_name
+                continue
+
+            sample_manager.print_read_counts_by_status(MODULE_NAMES[module_name])
+            continue
+
+        # Print read files with few reads
+        if choice.startswith("print_low_depth_reads"):
+            set_completer(["0.1", "0.25", "0.5"])
+
+            # Read fraction of the median
+            raw_fraction = raw_input(">> Fraction of the median number of reads: ")
+            try:
+                fraction = float(raw_fraction)
+            except ValueError:
+                fraction = -1
+            if fraction < 0 or fraction != fraction or fraction == float("inf"):
+                print "BLEEP BLOP, DOES NOT COMPUTE! INVALID FRACTION: %s" % raw_fraction
+                continue
+
+            sample_manager.print_low_depth_reads(fraction)
+            continue
+
+        # Print samples or positions that are outliers in a module metric
+        if choice.startswith("print_outlier_samples") or choice.startswith("print_outlier_positions"):
+            # Setup auto-completer for metric name
+            set_completer(supported_metrics)
+
+            # Read metric name
+            metric = raw_input(">> Metric (%s): " % ", ".join(supported_metrics))
+
+            # Validate
+            if metric not in supported_metrics:
+                print "BLEEP BLOP, DOES NOT COMPUTE! INVALID METRIC: %s" % metric
+                continue
+
+            # Setup auto-completer for read number
+            set_completer(["1", "2"])
+
+            # Read read number
+            read_number = raw_input(">>> Read file number: ")
+            if not read_number.isdigit():
+                print "BLEEP BLOP, DOES NOT COMPUTE! INVALID READ NUMBER: %s" % read_number
+                continue
+
+            if choice.startswith("print_outlier_samples"):
+                sample_manager.print_outlier_samples(metric, int(read_number))
+            else:
+                sample_manager.print_outlier_positions(metric, int(read_number))
+            continue
+
+        # Print read files that match a filter query
+        if choice.split(" ", 1)[0] == "query":
+            expression = choice.split(" ", 1)[1] if " " in choice else ""
+
+            # Read the query, if it wasn't given on the same line
+            if not expression.strip():
+                set_completer(module_index)
+                expression = raw_input(">> Query: ")
+
+            print format_text(query_runner.run("query " + expression))
+            continue
+
         # Print module descriptions
         if choice.startswith("print_module_description"):
             # Setup auto-completer for module name
-            completer = MyCompleter(supported_module_names)
-            readline.set_completer(completer.complete)
-            readline.parse_and_bind('tab: complete')
+            set_completer(module_index)
 
             # Read module name
             module_name = raw_input(">> Module name: ")
@@ -668,21 +1054,360 @@ def read_input(sample_manager):
             print module_descriptions[module_name]
 
 
+def read_remote_input(client, watcher=None):
+    """
+    Continuous loop that reads keyboard input, like read_input(), but queries are answered by a server
+    (see QueryServer) or a query runner, and results are printed as tables.
+    :param client: QueryClient connected to the server, or a QueryRunner (e.g. SqliteQueryRunner)
+    :param watcher: Optional DirectoryWatcher of a local query runner. Samples it has found are merged in before each query
+    """
+    # Arguments of every command, and how to prompt for them
+    command_arguments = dict(QueryRunner.commands)
+    argument_prompts = {
+        "SAMPLE": "Sample name",
+        "MODULE": "Module name",
+        "STATUS": "Status",
+        "READ": "Read file number",
+        "COLUMN": "Column",
+        "POSITION": "Position",
+        "FRACTION": "Fraction of the median number of reads",
+        "METRIC": "Metric",
+        "EXPRESSION": "Query"
+    }
+
+    # Completion indices are built once and shared by all prompts
+    command_index = CompletionIndex(list(command_arguments.keys()) + ["exit"])
+    module_index = CompletionIndex(MODULE_NAMES.keys())
+    status_index = CompletionIndex(STATUSES)
+    sample_index = CompletionIndex(row[0] for row in client.run("list_samples").get("rows", []))
+
+    readline.set_completer_delims(" \t\n")
+    readline.parse_and_bind('tab: complete')
+
+    print "===== SUBMIT QUERY ====="
+    print "(type 'help' for help)"
+    print "(press <TAB> for auto-completion)"
+
+    while True:
+        set_completer(command_index)
+        choice = raw_input("> ").strip().lower()
+
+        # Add samples that have appeared while waiting for input
+        if watcher is not None and watcher.merge_pending(client.sample_manager) > 0:
+            sample_index.update(client.sample_manager.sample_names)
+
+        # Quit
+        if choice.startswith("exit"):
+            print "Exiting.."
+            break
+
+        # Help
+        if choice.startswith("help"):
+            print_query_help()
+            continue
+
+        command = choice.split()[0] if choice else ""
+        if command not in command_arguments:
+            continue
+
+        # Read arguments, one prompt each
+        arguments = []
+        for level, argument in enumerate(command_arguments[command]):
+            if argument == "SAMPLE":
+                set_completer(sample_index)
+            elif argument == "MODULE":
+                set_completer(module_index)
+            elif argument == "STATUS":
+                set_completer(status_index)
+            elif argument == "READ":
+                set_completer(["1", "2"])
+            elif argument == "METRIC":
+                set_completer([m[0] for m in METRICS])
+            elif argument == "COLUMN":
+                columns = client.run("list_metric_columns %s %s" % (pipes.quote(arguments[0]), pipes.quote(arguments[1])))
+                set_completer([row[0] for row in columns.get("rows", [])])
+            else:
+                set_completer([])
+
+            arguments.append(raw_input("%s %s: " % (">" * (level + 2), argument_prompts[argument])).strip())
+
+        result = client.run(" ".join(pipes.quote(a) for a in [command] + arguments))
+
+        # The server says where the report is, it's extracted and opened here
+        if command == "open_sample_html_report" and "error" not in result:
+            sample_name, read_number, zip_path, member = result["rows"][0]
+            target_dir = os.path.join(Sample.get_report_cache_dir(), sample_name, str(read_number))
+            open_html_report(extract_html_report(zip_path, member, target_dir), None, sample_name, read_number)
+            continue
+
+        print format_text(result)
+
+
+def run_batch_file(query_runner, batch_file, output_format, output):
+    """
+    Runs the commands in a batch file (- for stdin) and exits, with status 1 if any command failed.
+    """
+    command_file = sys.stdin if batch_file == "-" else open(batch_file)
+    try:
+        num_errors = run_batch(query_runner, command_file, output_format, output)
+    finally:
+        if command_file is not sys.stdin:
+            command_file.close()
+    sys.exit(1 if num_errors > 0 else 0)
+
+
+def export_samples(sample_manager, path, export_format=None, include_modules=False):
+    """
+    Writes the statuses and Basic Statistics of all samples (and optionally their module tables) to tables.
+    :param path: Directory of Parquet files, or an SQLite database file
+    :param export_format: parquet or sqlite (see Exporter.FORMATS), None for Parquet if pyarrow is installed
+    """
+    exporter = Exporter.Exporter(path, export_format, include_modules)
+    print "Exporting %d samples to %s (%s) ..." % (len(sample_manager.all_samples), path, exporter.export_format)
+
+    num_rows = exporter.export(sample_manager.all_samples)
+    for table, columns in exporter.get_tables():
+        print "%-15s %10d rows" % (table, num_rows[table])
+
+
+def load_run(parent_dir, jobs=1, use_cache=True, cache_dir=None, cache_hash=False):
+    """
+    Loads the samples of a parent directory into a SampleManager, using (and updating) its cache.
+    :param cache_dir: Directory of the cache, None for the default cache of parent_dir
+    """
+    cache = None
+    metrics_dir = None
+    if use_cache and not TarArchive.is_archive(parent_dir):
+        cache_dir = cache_dir or SampleCache.get_default_cache_dir(parent_dir)
+        cache = SampleCache(cache_dir, use_hashing=cache_hash)
+        metrics_dir = os.path.join(cache_dir, "metrics")
+
+    samples = setup_samples(parent_dir, jobs, cache)
+    return SampleManager(samples, metrics_dir)
+
+
+class ThreadOutput(object):
+    """
+    Stands in for sys.stdout while threads run at the same time, and keeps what every thread prints apart,
+    so their progress messages don't interleave. Other processes (--jobs workers) write straight through.
+    """
+
+    def write(self, text):
+        buffer = self.buffers.get(threading.current_thread())
+        if buffer is None or os.getpid() != self.pid:
+            self.output.write(text)
+        else:
+            buffer.append(text)
+
+    def flush(self):
+        self.output.flush()
+
+    def get_text(self, thread):
+        return "".join(self.buffers.get(thread, []))
+
+    def __init__(self, output, threads):
+        self.output = output
+        self.pid = os.getpid()
+        self.buffers = dict((thread, []) for thread in threads)  # Format: {thread: [text]}
+
+
+def diff_runs(args, output):
+    """
+    Loads the input directory and the --diff directory at the same time, and writes how they differ to output
+    (see RunDiff.get_tables()) in the --format of batch mode. The input directory is the "before" run.
+    """
+    # Load both directories at the same time, with --jobs each of them is parsed by its own worker processes
+    managers = {}  # Format: {run: SampleManager}
+
+    def load(run, parent_dir, cache_dir):
+        managers[run] = load_run(parent_dir, args.jobs, not args.no_cache, cache_dir, args.cache_hash)
+
+    loaders = [threading.Thread(target=load, args=("before", args.input_directory, args.cache_dir), name="DiffLoader"),
+               threading.Thread(target=load, args=("after", args.diff, None), name="DiffLoader")]
+    # Progress of both loaders is printed when they're done, one after the other
+    progress = ThreadOutput(sys.stdout, loaders)
+    sys.stdout = progress
+    try:
+        for loader in loaders:
+            loader.start()
+        for loader in loaders:
+            loader.join()
+    finally:
+        sys.stdout = progress.output
+    for loader in loaders:
+        sys.stdout.write(progress.get_text(loader))
+
+    if len(managers) != 2:
+        print "ERROR: Failed to load both directories. Exiting."
+        sys.exit(1)
+
+    for result in RunDiff.RunDiff(managers["before"], managers["after"]).get_tables():
+        output.write(format_result(result, args.format or "tsv"))
+    output.flush()
+
+
+def connect_to_server(socket_path):
+    """
+    Connects to a server started with --serve, exits if there's none.
+    """
+    try:
+        return QueryClient(socket_path)
+    except socket.error as e:
+        print "ERROR: Could not connect to a server on %s (%s)" % (socket_path, e)
+        sys.exit()
+
+
+def serve_until_stopped(server, watcher=None):
+    """
+    Handles requests until Ctrl-C or kill, then closes the server and stops the watcher.
+    """
+    # Also shut down cleanly (and remove the socket) when stopped with kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print "Stopping server.."
+    finally:
+        server.server_close()
+        if watcher is not None:
+            watcher.stop()
+
+
 def main():
-    parent_dir = handle_arguments()
+    args = handle_arguments()
+
+    # In batch mode stdout only gets results, progress messages go to stderr
+    stdout = sys.stdout
+    if args.batch or args.diff:
+        sys.stdout = sys.stderr
+
+    # Queries are answered by a server, nothing to load
+    if args.connect:
+        client = connect_to_server(args.connect)
+        try:
+            if args.batch:
+                run_batch_file(client, args.batch, args.format or "tsv", stdout)
+            read_remote_input(client)
+        except IOError as e:
+            print "ERROR: Lost connection to the server (%s)" % e
+        finally:
+            client.close()
+        return
+
+    # Compare two runs and exit
+    if args.diff:
+        diff_runs(args, stdout)
+        return
+
+    # Setup cache of parsed samples, cross-sample metrics are stored next to it
+    # Archives are read once per session anyway (see setup_archive_samples()), and aren't cached
+    cache = None
+    metrics_dir = None
+    if not args.no_cache and not TarArchive.is_archive(args.input_directory):
+        cache_dir = args.cache_dir or SampleCache.get_default_cache_dir(args.input_directory)
+        cache = SampleCache(cache_dir, use_hashing=args.cache_hash)
+        metrics_dir = os.path.join(cache_dir, "metrics")
+
+    # Check the socket before spending time on loading
+    if args.serve:
+        QueryServer.remove_stale_socket(os.path.abspath(args.serve))
+
+    # Take a snapshot of the input directory before loading, so changes made while loading are picked up
+    watcher = None
+    if args.watch:
+        watcher = DirectoryWatcher(args.input_directory, args.watch_interval)
+
+    # Measure loading
+    timings = Timings() if args.timings else None
+    profiler = None
+    if args.profile:
+        if args.jobs != 1:
+            print "Note: --profile only covers this process, use --jobs 1 to include parsing the samples"
+        profiler = Profiler(args.profile)
+        profiler.start()
+
+    if args.lazy and args.jobs != 1:
+        print "Note: --jobs is ignored with --lazy, samples are loaded on demand and in a background thread"
 
     # Parse parent dir
-    samples = setup_samples(parent_dir)
+    samples = setup_samples(args.input_directory, args.jobs, cache, timings, args.lazy)
 
     # Create sample manager
-    sample_manager = SampleManager(samples)
+    sample_manager = SampleManager(samples, metrics_dir, timings, args.lazy)
+
+    if profiler is not None:
+        profiler.stop()
+    if timings is not None:
+        timings.print_summary()
+
+    # Write tables and exit
+    if args.export:
+        export_samples(sample_manager, args.export, args.export_format, args.export_modules)
+        if cache is not None:
+            cache.save()
+        return
+
+    # Tables are cut to --offset and --limit, and paged on a terminal
+    sample_manager.renderer = TableRenderer(args.format, args.limit, args.offset, None if args.no_pager else get_pager())
+
+    # Answer queries with SQL against a database of the samples
+    query_runner = QueryRunner(sample_manager, module_descriptions, args.limit, args.offset)
+    if args.sqlite:
+        backend = SqliteBackend(args.sqlite)
+        if backend.build(sample_manager):
+            print "Wrote query database %s" % args.sqlite
+        query_runner = SqliteQueryRunner(sample_manager, backend, module_descriptions, args.limit, args.offset)
+
+    # Run commands from a file and exit. With --lazy, the queries load only the samples they need
+    if args.batch:
+        try:
+            run_batch_file(query_runner, args.batch, args.format or "tsv", stdout)
+        finally:
+            if cache is not None:
+                cache.save()
+
+    # Load the rest of the samples while waiting for queries, and cache them when they're all loaded
+    if args.lazy:
+        sample_manager.load_in_background(cache.save if cache is not None else None)
+
+    if watcher is not None:
+        watcher.start()
+
+    # Answer queries from clients until interrupted
+    if args.serve:
+        server = QueryServer(args.serve, query_runner, watcher, args.socket_mode if args.socket_mode is not None else DEFAULT_SOCKET_MODE)
+        print "Serving queries on %s (press Ctrl-C to stop)" % server.socket_path
+        serve_until_stopped(server, watcher)
+        sample_manager.stop_background_loading()
+        return
+
+    # Serve the web dashboard until interrupted
+    if args.web:
+        try:
+            server = WebDashboard(sample_manager, args.web, watcher)
+        except socket.error as e:
+            print "ERROR: Could not listen on port %d (%s)" % (args.web, e)
+            sys.exit()
+        print "Dashboard on http://localhost:%d/ (press Ctrl-C to stop)" % args.web
+        print "From another machine: ssh -L %d:localhost:%d <this host>, then open http://localhost:%d/" % (args.web, args.web, args.web)
+        serve_until_stopped(server, watcher)
+        sample_manager.stop_background_loading()
+        return
 
     # Print global stats
     #sample_manager.print_global_summary()
     #sample_manager.print_module_stats()
 
-    # Wait for input
-    read_input(sample_manager)
+    # Wait for input. With --sqlite, commands are run by the query runner, as they are for a server
+    if args.sqlite:
+        read_remote_input(query_runner, watcher)
+    else:
+        read_input(sample_manager, watcher)
+
+    sample_manager.stop_background_loading()
+    if watcher is not None:
+        watcher.stop()
 
 if __name__ == "__main__":
     main()
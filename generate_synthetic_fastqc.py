@@ -0,0 +1,257 @@
+import argparse
+import os
+import sys
+import random
+import zipfile
+import multiprocessing
+
+# Modules in the order FastQC writes them
+MODULES = [
+    "Basic Statistics",
+    "Per base sequence quality",
+    "Per tile sequence quality",
+    "Per sequence quality scores",
+    "Per base sequence content",
+    "Per sequence GC content",
+    "Per base N content",
+    "Sequence Length Distribution",
+    "Sequence Duplication Levels",
+    "Overrepresented sequences",
+    "Adapter Content",
+    "Kmer Content"
+]
+
+STATUSES = ["PASS", "WARN", "FAIL"]
+
+
+def handle_arguments():
+    parser = argparse.ArgumentParser(description="Writes a directory tree of synthetic FastQC zip-files, one directory per sample, for testing and benchmarking the FastQC browser.")
+    parser.add_argument("-o", "--output-directory", help="Directory to write sample directories to (created if needed)", required=True)
+    parser.add_argument("-n", "--samples", help="Number of samples", type=int, default=100)
+    parser.add_argument("-r", "--reads", help="Read files per sample (1 = single-end, 2 = paired-end)", type=int, default=2)
+    parser.add_argument("-l", "--lanes", help="Lanes per read (0 = no lane in the file names)", type=int, default=0)
+    parser.add_argument("--read-length", help="Read length in bases", type=int, default=101)
+    parser.add_argument("--status-weights", help="Relative weights of PASS,WARN,FAIL for every module but Basic Statistics", default="70,15,15")
+    parser.add_argument("--module-status-weights", help="Weights for a single module, e.g. 'Adapter Content=20,30,50'. Can be repeated", action="append", default=[])
+    parser.add_argument("--naming", help="File names: illumina (sample1_S1_L001_R1_001_fastqc.zip) or short (sample1_1_fastqc.zip, no lanes)", choices=["illumina", "short"], default="illumina")
+    parser.add_argument("--seed", help="Random seed, the same seed always gives the same tree", type=int, default=1)
+    parser.add_argument("-j", "--jobs", help="Number of processes (0 means one per CPU)", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.samples < 1 or args.reads < 1 or args.lanes < 0:
+        print "ERROR: --samples and --reads must be 1 or more, --lanes 0 or more"
+        sys.exit()
+
+    if args.naming == "short" and args.lanes > 0:
+        print "ERROR: --naming short can't be combined with --lanes"
+        sys.exit()
+
+    return args
+
+
+def parse_weights(text):
+    """
+    Parses "PASS,WARN,FAIL" weights, e.g. "70,15,15".
+    """
+    try:
+        weights = [float(w) for w in text.split(",")]
+    except ValueError:
+        weights = []
+
+    if len(weights) != 3 or min(weights) < 0 or sum(weights) == 0:
+        print "ERROR: Status weights must be three non-negative numbers (PASS,WARN,FAIL), got '%s'" % text
+        sys.exit()
+
+    return weights
+
+
+def get_status_weights(args):
+    """
+    Returns the PASS/WARN/FAIL weights of every module.
+    :return weights: Dictionary {module: [pass, warn, fail]}
+    """
+    default = parse_weights(args.status_weights)
+    weights = dict((module, default) for module in MODULES)
+
+    # Basic Statistics never raises warnings or errors
+    weights["Basic Statistics"] = [1, 0, 0]
+
+    for entry in args.module_status_weights:
+        module, _, text = entry.partition("=")
+        if module not in weights:
+            print "ERROR: Unknown module '%s'. Modules are: %s" % (module, ", ".join(MODULES))
+            sys.exit()
+        weights[module] = parse_weights(text)
+
+    return weights
+
+
+def choose_status(rnd, weights):
+    """
+    Picks a status at random, with the given PASS/WARN/FAIL weights.
+    """
+    x = rnd.uniform(0, sum(weights))
+    for status, weight in zip(STATUSES, weights):
+        if x < weight:
+            return status
+        x -= weight
+    return "FAIL"
+
+
+def get_positions(read_length):
+    """
+    Returns base positions as FastQC groups them: single bases up to 9, then ranges, e.g. "10-14".
+    """
+    positions = [str(i) for i in range(1, min(read_length, 9) + 1)]
+    start = 10
+    while start <= read_length:
+        end = min(start + 4, read_length)
+        positions.append(str(start) if start == end else "%d-%d" % (start, end))
+        start = end + 1
+    return positions
+
+
+def get_fastqc_data(filename, statuses, total, read_length, rnd):
+    """
+    Returns the content of a fastqc_data.txt file. Values roughly follow the statuses, e.g. a failing
+    Per base sequence quality has low qualities towards the end of the read.
+    """
+    lines = ["##FastQC\t0.11.5"]
+    positions = get_positions(read_length)
+
+    def add_module(name, header, rows, comment=None):
+        lines.append(">>%s\t%s" % (name, statuses[name].lower()))
+        if comment is not None:
+            lines.append(comment)
+        lines.append("#" + "\t".join(header))
+        for row in rows:
+            lines.append("\t".join(str(v) for v in row))
+        lines.append(">>END_MODULE")
+
+    # Quality drops towards the end of the read, more so for worse statuses
+    drop = {"PASS": 4.0, "WARN": 10.0, "FAIL": 18.0}[statuses["Per base sequence quality"]]
+    quality_rows = []
+    for i, position in enumerate(positions):
+        mean = 36.0 - drop * (float(i) / len(positions)) ** 2 + rnd.uniform(-0.5, 0.5)
+        quality_rows.append([position, round(mean, 2), round(mean + 1), round(mean - 3), round(mean + 2), round(mean - 6), round(mean + 3)])
+
+    gc = rnd.randint(38, 62)
+    adapter_max = {"PASS": 1.0, "WARN": 7.0, "FAIL": 20.0}[statuses["Adapter Content"]]
+    n_max = {"PASS": 0.1, "WARN": 8.0, "FAIL": 25.0}[statuses["Per base N content"]]
+    duplication = {"PASS": 85.0, "WARN": 65.0, "FAIL": 35.0}[statuses["Sequence Duplication Levels"]]
+
+    add_module("Basic Statistics", ["Measure", "Value"], [
+        ["Filename", filename],
+        ["File type", "Conventional base calls"],
+        ["Encoding", "Sanger / Illumina 1.9"],
+        ["Total Sequences", total],
+        ["Sequences flagged as poor quality", 0],
+        ["Sequence length", read_length],
+        ["%GC", gc]])
+    add_module("Per base sequence quality", ["Base", "Mean", "Median", "Lower Quartile", "Upper Quartile", "10th Percentile", "90th Percentile"], quality_rows)
+    add_module("Per tile sequence quality", ["Tile", "Base", "Mean"],
+               [[tile, position, round(rnd.uniform(-1.5, 1.5), 3)] for tile in (1101, 1102, 1201, 1202) for position in positions])
+    add_module("Per sequence quality scores", ["Quality", "Count"],
+               [[q, float(int(total * 0.5 ** abs(q - 36) / 3))] for q in range(2, 42)])
+    add_module("Per base sequence content", ["Base", "G", "A", "T", "C"],
+               [[p, round(gc / 2.0 + rnd.uniform(-1, 1), 2), round(50 - gc / 2.0, 2), round(50 - gc / 2.0, 2), round(gc / 2.0, 2)] for p in positions])
+    add_module("Per sequence GC content", ["GC Content", "Count"],
+               [[g, float(int(total * 0.9 ** abs(g - gc) / 20))] for g in range(0, 101)])
+    add_module("Per base N content", ["Base", "N-Count"],
+               [[p, round(n_max * float(i) / len(positions), 3)] for i, p in enumerate(positions)])
+    add_module("Sequence Length Distribution", ["Length", "Count"], [[read_length, float(total)]])
+    add_module("Sequence Duplication Levels", ["Duplication Level", "Percentage of deduplicated", "Percentage of total"],
+               [[level, round(duplication / (i + 1), 2), round(duplication / (i + 2), 2)] for i, level in enumerate(["1", "2", "3", "4", "5", ">10", ">50", ">100", ">500", ">1k", ">5k", ">10k+"])],
+               "#Total Deduplicated Percentage\t%.2f" % duplication)
+    add_module("Overrepresented sequences", ["Sequence", "Count", "Percentage", "Possible Source"],
+               [["".join(rnd.choice("ACGT") for _ in range(50)), int(total * 0.002), 0.2, "No Hit"]] if statuses["Overrepresented sequences"] != "PASS" else [])
+    add_module("Adapter Content", ["Position", "Illumina Universal Adapter", "Illumina Small RNA 3' Adapter", "Nextera Transposase Sequence", "SOLID Small RNA Adapter"],
+               [[p, round(adapter_max * float(i) / len(positions), 3), 0.0, round(rnd.uniform(0, 0.01), 3), 0.0] for i, p in enumerate(positions)])
+    add_module("Kmer Content", ["Sequence", "Count", "PValue", "Obs/Exp Max", "Max Obs/Exp Position"],
+               [["".join(rnd.choice("ACGT") for _ in range(7)), rnd.randint(100, 10000), 0.0, round(rnd.uniform(5, 50), 2), str(rnd.randint(1, read_length))] for _ in range(5)])
+
+    return "\n".join(lines) + "\n"
+
+
+def get_report_html(base, statuses):
+    """
+    Returns a small HTML report in the layout of FastQC's, with an image and icons from the zip-file.
+    """
+    icons = {"PASS": "tick.png", "WARN": "warning.png", "FAIL": "error.png"}
+    items = "".join("<li><img src='Icons/%s'> %s</li>" % (icons[statuses[m]], m) for m in MODULES)
+    return "<html><head><title>%s FastQC Report</title></head><body><h1>%s</h1><ul>%s</ul><img src='Images/per_base_quality.png'></body></html>" % (base, base, items)
+
+
+def write_zip(path, base, statuses, total, read_length, rnd):
+    """
+    Writes one FastQC zip-file: summary.txt, fastqc_data.txt, the HTML report, an image and icons.
+    """
+    zip_ref = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+    try:
+        prefix = base + "_fastqc/"
+        zip_ref.writestr(prefix + "summary.txt", "".join("%s\t%s\t%s.fastq.gz\n" % (statuses[m], m, base) for m in MODULES))
+        zip_ref.writestr(prefix + "fastqc_data.txt", get_fastqc_data(base + ".fastq.gz", statuses, total, read_length, rnd))
+        zip_ref.writestr(prefix + "fastqc_report.html", get_report_html(base, statuses))
+        zip_ref.writestr(prefix + "Images/per_base_quality.png", "\x89PNG\r\n\x1a\n")
+        for icon in ("tick.png", "warning.png", "error.png"):
+            zip_ref.writestr(prefix + "Icons/" + icon, "\x89PNG\r\n\x1a\n")
+    finally:
+        zip_ref.close()
+
+
+def write_sample(job):
+    """
+    Writes the directory of a single sample. Every sample has its own random generator (seeded from
+    the seed and sample number), so the tree is the same no matter how many processes write it.
+    :param job: Tuple of (sample number, parsed arguments, status weights)
+    """
+    number, args, weights = job
+    rnd = random.Random("%d-%d" % (args.seed, number))
+    name = "sample%d" % number
+
+    sample_dir = os.path.join(args.output_directory, name)
+    if not os.path.isdir(sample_dir):
+        os.makedirs(sample_dir)
+
+    for read_number in range(1, args.reads + 1):
+        for lane in range(1, args.lanes + 1) if args.lanes > 0 else [0]:
+            if args.naming == "short":
+                base = "%s_%d" % (name, read_number)
+            elif lane > 0:
+                base = "%s_S%d_L%03d_R%d_001" % (name, number, lane, read_number)
+            else:
+                base = "%s_S%d_R%d_001" % (name, number, read_number)
+
+            statuses = dict((m, choose_status(rnd, weights[m])) for m in MODULES)
+            total = rnd.randint(1000000, 40000000)
+            write_zip(os.path.join(sample_dir, base + "_fastqc.zip"), base, statuses, total, args.read_length, rnd)
+
+
+def main():
+    args = handle_arguments()
+    weights = get_status_weights(args)
+
+    if not os.path.isdir(args.output_directory):
+        os.makedirs(args.output_directory)
+
+    jobs = [(number, args, weights) for number in range(1, args.samples + 1)]
+    num_processes = args.jobs or multiprocessing.cpu_count()
+
+    print "Writing %d samples to %s ..." % (args.samples, args.output_directory)
+
+    if num_processes == 1:
+        for job in jobs:
+            write_sample(job)
+    else:
+        pool = multiprocessing.Pool(num_processes)
+        try:
+            for _ in pool.imap_unordered(write_sample, jobs, max(1, len(jobs) // (num_processes * 4))):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    print "Done."
+
+if __name__ == "__main__":
+    main()